@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import process_routes as pr
+import route_polyline
+from route_spatial import SpatialIndex
+
+# Synthetic corridor benchmark for process_routes.py.
+#
+# Generates routes files shaped like assets/routes.json (Groups 1-5 with
+# options made of Google Directions legs and encoded polylines) at a chosen
+# scale, then times and memory-profiles each pipeline stage. Results are
+# written as JSON and can be compared against an earlier run.
+
+HUBS = ['Brough', 'York', 'Beverley', 'Hull', 'Eastrington']
+ACCESS_MODES = ['Bus', 'Cycle', 'Uber', 'Drive', 'Walk']
+LEEDS = (53.7950, -1.5474)
+
+# Beside this script (client/), where .gitignore expects it, whatever the cwd
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_results.json')
+
+def random_path(rng, start, points, step=0.0015):
+    lat, lng = start
+    path = []
+    for _ in range(points):
+        lat += rng.uniform(-step, step)
+        lng += rng.uniform(-step, step)
+        path.append([round(lat, 5), round(lng, 5)])
+    return path
+
+def synthetic_leg(rng, mode, start, points, name=None, vehicle=None):
+    path = random_path(rng, start, points)
+    leg = {
+        'mode': mode,
+        'polyline': route_polyline.encode_polyline(path),
+        'distance_value': rng.randint(300, 40000),
+        'duration_value': rng.randint(120, 3600),
+        'start_location': {'lat': path[0][0], 'lng': path[0][1]},
+        'end_location': {'lat': path[-1][0], 'lng': path[-1][1]},
+        'instructions': f"Head from {name or 'Start'} to {name or 'End'}"
+    }
+    if mode == 'transit':
+        leg['transit_details'] = {
+            'line_name': name or 'Northern',
+            'vehicle_type': vehicle or 'HEAVY_RAIL',
+            'departure_stop': {'name': f'{name or "Leeds"} Station'},
+            'arrival_stop': {'name': 'Leeds Station'},
+            'num_stops': rng.randint(1, 12),
+            'color': '#262262'
+        }
+    return leg, path[-1]
+
+def synthetic_option(rng, name, legs, points):
+    json_legs = []
+    position = LEEDS
+    for mode, label, vehicle in legs:
+        leg, position = synthetic_leg(rng, mode, position, points, label, vehicle)
+        json_legs.append(leg)
+    return {'name': name, 'legs': json_legs}
+
+def access_legs(rng, access, hub):
+    if access == 'Bus':
+        return [('walking', None, None), ('transit', f'X{rng.randint(1, 99)}', 'BUS'),
+                ('walking', None, None), ('transit', hub, 'HEAVY_RAIL')]
+    if access == 'Cycle':
+        return [('bicycling', None, None), ('transit', hub, 'HEAVY_RAIL')]
+    if access == 'Walk':
+        return [('walking', None, None), ('transit', hub, 'HEAVY_RAIL')]
+    return [('driving', None, None), ('walking', None, None), ('transit', hub, 'HEAVY_RAIL')]
+
+def generate_routes(options=10, rail_legs=2, points=50, seed=0):
+    rng = random.Random(seed)
+
+    first_mile = []
+    for i in range(options):
+        hub = HUBS[i % len(HUBS)]
+        access = ACCESS_MODES[(i // len(HUBS)) % len(ACCESS_MODES)]
+        name = f'{access} to {hub} Station then Train to Leeds {i}'
+        first_mile.append(synthetic_option(rng, name, access_legs(rng, access, hub), points))
+
+    # Long multi-change rail trip with short walks between trains
+    core = []
+    for i in range(rail_legs):
+        if i:
+            core.append(('walking', None, None))
+        core.append(('transit', f'Change {i}', 'HEAVY_RAIL'))
+    main_leg = synthetic_option(rng, 'Train: Leeds to Destination', core, points * 4)
+
+    last_mile = []
+    for i in range(options):
+        access = ['Bus', 'Uber', 'Cycle'][i % 3]
+        if access == 'Bus':
+            legs = [('walking', None, None), ('transit', f'{rng.randint(1, 99)}', 'BUS'), ('walking', None, None)]
+        elif access == 'Uber':
+            legs = [('driving', None, None)]
+        else:
+            legs = [('bicycling', None, None)]
+        last_mile.append(synthetic_option(rng, f'{access} to Destination {i}', legs, points))
+
+    direct = synthetic_option(rng, 'Direct Drive: Origin to Destination', [('driving', None, None)], points * 8)
+
+    return {'groups': [
+        {'name': 'Group 1: Access to Leeds Station', 'options': first_mile},
+        {'name': 'Group 3: Core Journey', 'options': [main_leg]},
+        {'name': 'Group 4: Final Mile', 'options': last_mile},
+        {'name': 'Group 5: Direct Option', 'options': [direct]},
+    ]}
+
+def measure(fn, repeat=3):
+    # Best wall time over `repeat` runs, plus peak traced allocation of one run
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': best, 'peakBytes': peak}
+
+def bench_scale(data, route_id='route1', repeat=3, journey_mode='all', **process_options):
+    groups = data['groups']
+    polylines = pr.collect_polylines(groups)
+    options = list(pr.leg_options(groups))
+    paths = route_polyline.decode_path_batch(polylines)
+
+    legs = [pr.parse_option_to_leg(option, name, route_id, paths) for name, option in options]
+    first_mile = [leg for (name, _), leg in zip(options, legs) if 'Group 1' in name or 'Group 2' in name]
+    last_mile = [leg for (name, _), leg in zip(options, legs) if 'Group 4' in name]
+    main_leg = next(leg for (name, _), leg in zip(options, legs) if 'Group 3' in name)
+    direct_drive = {'time': 0, 'cost': 0, 'distance': 0, 'co2': 0}
+    raw_segments = [[pr.parse_segment(json_leg, option['name'], route_id, paths)
+                     for json_leg in option.get('legs', [])] for _, option in options]
+    spatial_index = SpatialIndex.build(legs)
+    query_rng = random.Random(0)
+    query_points = [query_rng.choice(paths[p]) for p in query_rng.choices(polylines, k=100) if paths[p]]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, 'routes.json')
+        output_path = os.path.join(tmp, 'routes_clean.json')
+        with open(input_path, 'w') as f:
+            json.dump(data, f)
+
+        stages = {
+            'decode_reference': lambda: [route_polyline.decode_polyline(p) for p in polylines],
+            'decode_batch': lambda: route_polyline.decode_path_batch(polylines),
+            'parse_option_to_leg': lambda: [pr.parse_option_to_leg(option, name, route_id, paths)
+                                            for name, option in options],
+            'group_segments': lambda: [pr.group_segments(segments, {}) for segments in raw_segments],
+            'generate_journeys': lambda: pr.generate_journeys(first_mile, main_leg, last_mile,
+                                                              direct_drive, route_id, journey_mode),
+            'spatial_index': lambda: SpatialIndex.build(legs),
+            'spatial_query_x100': lambda: [(spatial_index.legs_near(lat, lng, 100),
+                                            spatial_index.nearest_stops(lat, lng))
+                                           for lat, lng in query_points],
+            'process_file': lambda: pr.process_file(input_path, output_path, route_id,
+                                                    journey_mode=journey_mode, **process_options),
+        }
+        results = {name: measure(fn, repeat) for name, fn in stages.items()}
+        results['process_file']['outputBytes'] = os.path.getsize(output_path)
+
+    return {
+        'polylines': len(polylines),
+        'polylineBytes': sum(len(p) for p in polylines),
+        'options': len(options),
+        'journeys': len(pr.generate_journeys(first_mile, main_leg, last_mile, direct_drive, route_id,
+                                             journey_mode)),
+        'stages': results
+    }
+
+def compare(results, baseline):
+    lines = []
+    base_runs = {run['scale']: run for run in baseline.get('runs', [])}
+    for run in results['runs']:
+        base = base_runs.get(run['scale'])
+        if not base:
+            continue
+        for stage, stats in run['stages'].items():
+            base_stats = base['stages'].get(stage)
+            if base_stats and base_stats['seconds'] > 0:
+                ratio = stats['seconds'] / base_stats['seconds']
+                lines.append(f"{run['scale']:>6} {stage:<22} {stats['seconds']:9.4f}s  x{ratio:5.2f} vs baseline")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark process_routes.py on synthetic corridors.')
+    # With --journeys all the journey count grows with options squared; use
+    # pareto or topk for the larger scales.
+    parser.add_argument('--options', default='10,30,100',
+                        help='comma separated first/last-mile options per group (default 10,30,100)')
+    parser.add_argument('--rail-legs', type=int, default=4, help='trains in the core journey (default 4)')
+    parser.add_argument('--points', type=int, default=50, help='points per leg polyline (default 50)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage, best is kept (default 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--journeys', choices=pr.JOURNEY_MODES, default='all',
+                        help='journey generation mode for the generate_journeys and process_file stages')
+    parser.add_argument('--dedupe', action='store_true', help='process_file stage writes deduplicated output')
+    parser.add_argument('--encode-paths', action='store_true', help='process_file stage writes encoded paths')
+    parser.add_argument('--compact', action='store_true', help='process_file stage writes compact output')
+    parser.add_argument('--output', default=RESULTS_PATH,
+                        help='where to write results (default client/bench_results.json)')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    results = {'rulesVersion': pr.RULES_VERSION, 'numpy': route_polyline.np is not None, 'journeys': args.journeys,
+               'dedupe': args.dedupe, 'encodePaths': args.encode_paths,
+               'compact': args.compact, 'runs': []}
+    for scale in [int(n) for n in args.options.split(',')]:
+        data = generate_routes(options=scale, rail_legs=args.rail_legs, points=args.points, seed=args.seed)
+        run = bench_scale(data, repeat=args.repeat, journey_mode=args.journeys,
+                          dedupe=args.dedupe, encode_paths=args.encode_paths, compact=args.compact)
+        run['scale'] = scale
+        results['runs'].append(run)
+
+        print(f"options={scale} polylines={run['polylines']} journeys={run['journeys']}")
+        for stage, stats in run['stages'].items():
+            print(f"  {stage:<22} {stats['seconds']:9.4f}s  peak {stats['peakBytes'] / 1e6:8.2f} MB")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            print(compare(results, json.load(f)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlencode, urlsplit
+
+import process_routes as pr
+import route_server
+from route_build import load_manifest
+
+# Load generator for route_server.py.
+#
+# Sends a mix of journey searches from a pool of worker threads, each with a
+# keep-alive connection, and reports latency percentiles, throughput and how
+# many responses were cache hits or 304s. Without --url a server is started
+# in-process on a free port, so everything runs locally.
+
+SORTS = list(route_server.SORT_KEYS)
+EXCLUDES = ['', 'bus', 'car', 'bike', 'taxi', 'bus,car', 'train']
+
+def query_mix(rng, route_ids, count, distinct):
+    # `distinct` different queries, drawn uniformly, so the cache hit ratio
+    # after warm-up depends on distinct against --cache-size
+    pool = []
+    for _ in range(distinct):
+        params = {'sort': rng.choice(SORTS), 'limit': rng.choice([10, 50, 200])}
+        exclude = rng.choice(EXCLUDES)
+        if exclude:
+            params['exclude'] = exclude
+        if rng.random() < 0.3:
+            params['maxTime'] = rng.choice([90, 120, 180])
+        if rng.random() < 0.3:
+            params['maxCost'] = rng.choice([20, 40, 80])
+        pool.append(f"/api/routes/{rng.choice(route_ids)}/journeys?{urlencode(params)}")
+    return [rng.choice(pool) for _ in range(count)]
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def run_load(host, port, paths, concurrency, gzip=True, revalidate=False):
+    stats = {'latencies': [], 'status': {}, 'cacheHits': 0, 'bytes': 0}
+    lock = threading.Lock()
+    local = threading.local()
+    etags = {}
+
+    def send(path):
+        if not hasattr(local, 'conn'):
+            local.conn = HTTPConnection(host, port, timeout=30)
+        headers = {'Accept-Encoding': 'gzip'} if gzip else {}
+        if revalidate and path in etags:
+            headers['If-None-Match'] = etags[path]
+        start = time.perf_counter()
+        local.conn.request('GET', path, headers=headers)
+        response = local.conn.getresponse()
+        body = response.read()
+        elapsed = time.perf_counter() - start
+        with lock:
+            stats['latencies'].append(elapsed)
+            stats['status'][response.status] = stats['status'].get(response.status, 0) + 1
+            stats['bytes'] += len(body)
+            if response.getheader('X-Cache') == 'HIT':
+                stats['cacheHits'] += 1
+            if response.getheader('ETag'):
+                etags[path] = response.getheader('ETag')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, paths))
+    wall = time.perf_counter() - start
+
+    latencies = stats['latencies']
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'seconds': wall,
+        'requestsPerSecond': len(latencies) / wall if wall else 0.0,
+        'latencyMs': {f'p{p}': percentile(latencies, p) * 1000 for p in [50, 95, 99]},
+        'maxMs': max(latencies) * 1000 if latencies else 0.0,
+        'status': {str(k): v for k, v in sorted(stats['status'].items())},
+        'cacheHitRatio': stats['cacheHits'] / len(latencies) if latencies else 0.0,
+        'bytes': stats['bytes']
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test route_server.py.')
+    parser.add_argument('--url', help='server to test (default: start one in-process on a free port)')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='process_routes.py manifest for the in-process server (default: the app routes)')
+    parser.add_argument('--cache-size', type=int, default=256, help='LRU size for the in-process server')
+    parser.add_argument('--requests', type=int, default=2000, help='requests to send (default 2000)')
+    parser.add_argument('--concurrency', type=int, default=8, help='worker threads (default 8)')
+    parser.add_argument('--distinct', type=int, default=100, help='distinct queries in the mix (default 100)')
+    parser.add_argument('--no-gzip', action='store_true', help='do not send Accept-Encoding: gzip')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='send If-None-Match with the last ETag seen for each query')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+        with HTTPConnection(host, port, timeout=30) as conn:
+            conn.request('GET', '/api/routes')
+            route_ids = [r['routeId'] for r in json.loads(conn.getresponse().read())['routes']]
+    else:
+        entries = load_manifest(args.manifest) if args.manifest else pr.ROUTE_FILES
+        server = route_server.create_server(entries, port=0, cache_size=args.cache_size)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address[:2]
+        route_ids = list(server.routes)
+
+    try:
+        rng = random.Random(args.seed)
+        paths = query_mix(rng, route_ids, args.requests, args.distinct)
+        results = run_load(host, port, paths, args.concurrency, gzip=not args.no_gzip, revalidate=args.revalidate)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    latency = results['latencyMs']
+    print(f"{results['requests']} requests in {results['seconds']:.2f}s "
+          f"({results['requestsPerSecond']:.0f}/s, concurrency {results['concurrency']})")
+    print(f"latency p50 {latency['p50']:.2f} ms  p95 {latency['p95']:.2f} ms  "
+          f"p99 {latency['p99']:.2f} ms  max {results['maxMs']:.2f} ms")
+    print(f"status {results['status']}  cache hits {results['cacheHitRatio']:.0%}  "
+          f"{results['bytes'] / 1e6:.2f} MB received")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+if __name__ == '__main__':
+    main()
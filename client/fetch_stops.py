@@ -1,24 +1,188 @@
+import argparse
+import http.client
 import json
 import os
+import sqlite3
+import threading
+import time
 import urllib.request
 import urllib.parse
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-# Function to fetch directions and get stops
-def fetch_transit_details(start_loc, end_loc, api_key):
-    base_url = "https://maps.googleapis.com/maps/api/directions/json"
-    params = {
+from gtfs_stops import GtfsFeed, leg_line
+from route_stream import iter_route_options, read_json_stream, write_json_stream
+
+DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+
+# Token bucket shared by all fetch threads: `rate` requests per second with
+# bursts of up to `capacity`.
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Directions API client that keeps one keep-alive connection per thread.
+# Every connection is also tracked centrally so close() can shut down the
+# ones opened by worker threads.
+class DirectionsClient:
+    def __init__(self, api_key, base_url=DIRECTIONS_URL, rate_limiter=None, timeout=30):
+        self.api_key = api_key
+        self.url = urllib.parse.urlsplit(base_url)
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+            conn = conn_class(self.url.netloc, timeout=self.timeout)
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def _reset(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            with self.lock:
+                self.connections.remove(conn)
+        self.local.conn = None
+
+    def get_json(self, params):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+        query = urllib.parse.urlencode(dict(params, key=self.api_key))
+        path = f"{self.url.path}?{query}"
+
+        # A kept-alive connection may have been closed by the server; retry once on a fresh one
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.request('GET', path, headers={'Connection': 'keep-alive'})
+                response = conn.getresponse()
+                body = response.read()
+                if response.status != 200:
+                    raise http.client.HTTPException(f"HTTP {response.status}")
+                return json.loads(body.decode())
+            except (http.client.RemoteDisconnected, ConnectionError, http.client.CannotSendRequest):
+                self._reset()
+                if attempt:
+                    raise
+
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.close()
+        # Threads that call again after this start over on a new connection
+        self.local = threading.local()
+
+# Persistent cache of parsed transit details, keyed by rounded endpoints and
+# mode. Entries expire after `ttl` seconds and the least recently used ones
+# are evicted beyond `max_entries`.
+class ResponseCache:
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=10000, precision=5):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.db.commit()
+
+    def key(self, start_loc, end_loc, mode):
+        start_lat, start_lng, end_lat, end_lng = leg_key(start_loc, end_loc, self.precision)
+        return f"{start_lat},{start_lng}|{end_lat},{end_lng}|{mode}"
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+            self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now))
+            self.db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def transit_params(start_loc, end_loc):
+    return {
         "origin": f"{start_loc['lat']},{start_loc['lng']}",
         "destination": f"{end_loc['lat']},{end_loc['lng']}",
         "mode": "transit",
-        "key": api_key,
     }
 
-    url = f"{base_url}?{urllib.parse.urlencode(params)}"
+# Function to fetch directions and get stops
+def fetch_transit_details(start_loc, end_loc, api_key, client=None, cache=None, offline=False):
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.key(start_loc, end_loc, 'transit')
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    if offline:
+        return None
+
+    details = request_transit_details(start_loc, end_loc, api_key, client)
+    if details and cache is not None:
+        cache.put(cache_key, details)
+    return details
+
+def request_transit_details(start_loc, end_loc, api_key, client=None):
+    params = transit_params(start_loc, end_loc)
 
     try:
-        with urllib.request.urlopen(url) as response:
-            data = json.loads(response.read().decode())
+        if client is not None:
+            data = client.get_json(params)
+        else:
+            url = f"{DIRECTIONS_URL}?{urllib.parse.urlencode(dict(params, key=api_key))}"
+            with urllib.request.urlopen(url) as response:
+                data = json.loads(response.read().decode())
 
         if data['status'] == 'OK':
             if not data['routes']:
@@ -43,53 +207,210 @@ def fetch_transit_details(start_loc, end_loc, api_key):
 
     return None
 
-def process_file(filepath, api_key):
-    print(f"Processing {filepath}...")
+def option_transit_legs(option):
+    # Every transit leg with both endpoints, in file order
+    for leg in option.get('legs', []):
+        if leg.get('mode') == 'transit' and leg.get('start_location') and leg.get('end_location'):
+            yield leg
+
+def transit_legs(data):
+    # (option, leg) for every transit leg in the file
+    for group in data.get('groups', []):
+        for option in group.get('options', []):
+            for leg in option_transit_legs(option):
+                yield option, leg
+
+def scan_transit_legs(filepath):
+    # Transit legs of a routes file, reading one option at a time
     with open(filepath, 'r') as f:
-        data = json.load(f)
+        for _, _, option in iter_route_options(f):
+            yield from option_transit_legs(option)
+
+def fetch_all(client, jobs, concurrency, cache=None, offline=False):
+    # jobs are (start, end) pairs; results come back in the same order
+    api_key = client.api_key if client else None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(
+            lambda job: fetch_transit_details(job[0], job[1], api_key, client, cache, offline), jobs))
 
+def apply_details(option, leg, details):
+    if not details:
+        return False
+
+    if 'transit_details' not in leg:
+        leg['transit_details'] = {}
+    transit_details = leg['transit_details']
     updated = False
 
-    for group in data.get('groups', []):
-        for option in group.get('options', []):
-            for leg in option.get('legs', []):
-                if leg.get('mode') == 'transit':
-                    start = leg.get('start_location')
-                    end = leg.get('end_location')
-
-                    if start and end:
-                        line_name = leg.get('transit_details', {}).get('line_name', 'Unknown')
-                        print(f"Fetching transit details for {option['name']} ({line_name})...")
-
-                        details = fetch_transit_details(start, end, api_key)
-                        if details:
-                            if 'transit_details' not in leg:
-                                leg['transit_details'] = {}
-
-                            current_num = leg['transit_details'].get('num_stops')
-                            new_num = details['num_stops']
-
-                            # Only update if changed or new
-                            if current_num != new_num:
-                                print(f"  Updated num_stops: {current_num} -> {new_num}")
-                                leg['transit_details']['num_stops'] = new_num
-                                updated = True
-
-    if updated:
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
-        print(f"Updated {filepath}")
+    current_num = transit_details.get('num_stops')
+    new_num = details['num_stops']
+
+    # Only update if changed or new
+    if current_num != new_num:
+        print(f"  {option['name']}: updated num_stops: {current_num} -> {new_num}")
+        transit_details['num_stops'] = new_num
+        updated = True
+
+    # The directions API has no intermediate stops; only GTFS fills these
+    for key in ['stops', 'stop_points']:
+        if details.get(key) and transit_details.get(key) != details[key]:
+            print(f"  {option['name']}: updated {key}: {len(transit_details.get(key) or [])} -> {len(details[key])}")
+            transit_details[key] = details[key]
+            updated = True
+    return updated
+
+def leg_key(start_loc, end_loc, precision=5):
+    return (round(start_loc['lat'], precision), round(start_loc['lng'], precision),
+            round(end_loc['lat'], precision), round(end_loc['lng'], precision))
+
+def endpoint_job(leg):
+    return leg_key(leg['start_location'], leg['end_location']), (leg['start_location'], leg['end_location'])
+
+def gtfs_job(leg):
+    # GTFS matching also uses the line, so legs only share a job if it agrees
+    line = leg_line(leg)
+    key = leg_key(leg['start_location'], leg['end_location']) + (line['name'], line['agency'], line['family'])
+    return key, (leg['start_location'], leg['end_location'], line)
+
+def plan_fetches(legs, job=endpoint_job):
+    # Unique jobs (by default (start, end) pairs) in first-seen order, and the
+    # job index for each leg (only the jobs are kept, not the legs)
+    jobs = []
+    job_index = {}
+    leg_jobs = []
+    for leg in legs:
+        key, value = job(leg)
+        if key not in job_index:
+            job_index[key] = len(jobs)
+            jobs.append(value)
+        leg_jobs.append(job_index[key])
+    return jobs, leg_jobs
+
+def process_files(filepaths, client, concurrency=8, cache=None, offline=False, feed=None):
+    # Planning pass over every file first so each unique leg is fetched once.
+    # With a GTFS feed the legs are matched against it instead of fetched.
+    # Files are streamed one option at a time in both passes, so memory is
+    # bounded by the largest option rather than the largest file.
+    file_legs = []
+
+    def all_legs():
+        for filepath in filepaths:
+            print(f"Processing {filepath}...")
+            count = 0
+            for leg in scan_transit_legs(filepath):
+                count += 1
+                yield leg
+            file_legs.append(count)
+
+    if feed is not None:
+        jobs, leg_jobs = plan_fetches(all_legs(), gtfs_job)
+        print(f"Matching {len(jobs)} unique legs ({len(leg_jobs)} transit legs) against GTFS...")
+        results = feed.match_all(jobs)
+        print(f"Matched {sum(1 for r in results if r)} of {len(jobs)} legs")
     else:
-        print(f"No changes for {filepath}")
+        jobs, leg_jobs = plan_fetches(all_legs())
+        print(f"Fetching transit details for {len(jobs)} unique legs ({len(leg_jobs)} transit legs)...")
+        results = fetch_all(client, jobs, concurrency, cache=cache, offline=offline)
+
+    # Fan the results back out to every leg, rewriting each file as it is read
+    offset = 0
+    for filepath, count in zip(filepaths, file_legs):
+        state = {'offset': offset, 'updated': False}
+
+        def update_option(option):
+            for leg in option_transit_legs(option):
+                if apply_details(option, leg, results[leg_jobs[state['offset']]]):
+                    state['updated'] = True
+                state['offset'] += 1
+            return option
+
+        with open(filepath, 'r') as f, open(filepath + '.tmp', 'w') as out:
+            doc = read_json_stream(f, {'groups': [{'options': [update_option]}]})
+            write_json_stream(out, doc, max_depth=4)
+        offset += count
+
+        if state['updated']:
+            os.replace(filepath + '.tmp', filepath)
+            print(f"Updated {filepath}")
+        else:
+            os.remove(filepath + '.tmp')
+            print(f"No changes for {filepath}")
+
+def process_file(filepath, client, concurrency=8, cache=None, offline=False, feed=None):
+    # client may still be an API key, as in process_file(filepath, api_key);
+    # a client is made for it and closed afterwards
+    if isinstance(client, str):
+        client = DirectionsClient(client)
+        try:
+            process_files([filepath], client, concurrency=concurrency, cache=cache, offline=offline, feed=feed)
+        finally:
+            client.close()
+        return
+    process_files([filepath], client, concurrency=concurrency, cache=cache, offline=offline, feed=feed)
 
 def main():
-    api_key = os.environ.get('Googlemapsapi')
-    if not api_key:
-        print("Error: Googlemapsapi environment variable not set.")
+    parser = argparse.ArgumentParser(description='Refresh transit stop counts in routes JSON.')
+    parser.add_argument('--gtfs', metavar='FEED',
+                        help='fill stop counts, names and coordinates from a local GTFS feed (.zip or '
+                             'directory) instead of the directions API')
+    parser.add_argument('--gtfs-db', default='client/.gtfs.sqlite',
+                        help='SQLite import of the GTFS feed, rebuilt when the feed changes '
+                             '(default client/.gtfs.sqlite)')
+    parser.add_argument('--gtfs-radius', type=float, default=400.0,
+                        help='metres from a leg end to the stops it may match (default 400)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='parallel requests in flight (default 8)')
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='maximum requests per second, 0 for no limit (default 10)')
+    parser.add_argument('--base-url', default=DIRECTIONS_URL,
+                        help='directions endpoint, e.g. a local stub server for testing')
+    parser.add_argument('--cache', default='client/.stops_cache.sqlite',
+                        help='SQLite response cache (default client/.stops_cache.sqlite)')
+    parser.add_argument('--no-cache', action='store_true', help='always call the directions API')
+    parser.add_argument('--ttl-days', type=float, default=7.0,
+                        help='days before a cached response expires (default 7)')
+    parser.add_argument('--cache-size', type=int, default=10000,
+                        help='maximum cached responses, least recently used evicted first (default 10000)')
+    parser.add_argument('--offline', action='store_true',
+                        help='serve from the cache only, never call the directions API')
+    parser.add_argument('files', nargs='*',
+                        default=['client/assets/routes.json', 'client/assets/routes_2.json'])
+    args = parser.parse_args()
+    if args.rate < 0:
+        parser.error("--rate must be positive, or 0 for no limit")
+
+    if args.gtfs:
+        feed = GtfsFeed.open(args.gtfs, args.gtfs_db, radius=args.gtfs_radius)
+        try:
+            process_files(args.files, None, feed=feed)
+        finally:
+            feed.close()
+        return
+
+    if args.offline and args.no_cache:
+        print("Error: --offline needs the response cache.")
         return
 
-    process_file('client/assets/routes.json', api_key)
-    process_file('client/assets/routes_2.json', api_key)
+    client = None
+    if not args.offline:
+        api_key = os.environ.get('Googlemapsapi')
+        if not api_key:
+            print("Error: Googlemapsapi environment variable not set.")
+            return
+        rate_limiter = TokenBucket(args.rate) if args.rate > 0 else None
+        client = DirectionsClient(api_key, base_url=args.base_url, rate_limiter=rate_limiter)
+
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache, ttl=args.ttl_days * 24 * 3600, max_entries=args.cache_size)
+
+    try:
+        process_files(args.files, client, concurrency=args.concurrency, cache=cache, offline=args.offline)
+    finally:
+        if client:
+            client.close()
+        if cache:
+            cache.close()
 
 if __name__ == "__main__":
     main()
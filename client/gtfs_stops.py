@@ -0,0 +1,263 @@
+import contextlib
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import zipfile
+
+from route_spatial import Grid, Projection
+
+# Offline stop lookup from a GTFS feed.
+#
+# The feed (a .zip or a directory of .txt files) is imported once into an
+# indexed SQLite database; the import is reused while the feed files are
+# unchanged. A transit leg is matched by finding stops near its start and
+# end, then the trips that call at a start stop and later at an end stop.
+# Candidates are ranked by vehicle type, line name and endpoint distance, and
+# the best trip's calls in between give num_stops, stop names and stop
+# coordinates.
+
+# Columns kept from each feed file, in table order
+FEED_TABLES = {
+    'agency': ['agency_id', 'agency_name'],
+    'routes': ['route_id', 'agency_id', 'route_short_name', 'route_long_name', 'route_type'],
+    'trips': ['trip_id', 'route_id'],
+    'stops': ['stop_id', 'stop_name', 'stop_lat', 'stop_lon'],
+    'stop_times': ['trip_id', 'stop_id', 'stop_sequence'],
+}
+OPTIONAL_TABLES = {'agency'}
+
+SCHEMA = [
+    "CREATE TABLE agency (agency_id TEXT PRIMARY KEY, agency_name TEXT)",
+    "CREATE TABLE routes (route_id TEXT PRIMARY KEY, agency_id TEXT, route_short_name TEXT, "
+    "route_long_name TEXT, route_type INTEGER)",
+    "CREATE TABLE trips (trip_id TEXT PRIMARY KEY, route_id TEXT)",
+    "CREATE TABLE stops (stop_id TEXT PRIMARY KEY, stop_name TEXT, stop_lat REAL, stop_lon REAL)",
+    "CREATE TABLE stop_times (trip_id TEXT, stop_id TEXT, stop_sequence INTEGER, "
+    "PRIMARY KEY (trip_id, stop_sequence)) WITHOUT ROWID",
+]
+# Created after loading, which is much faster than maintaining them per row
+INDEXES = [
+    "CREATE INDEX stop_times_by_stop ON stop_times (stop_id, trip_id, stop_sequence)",
+]
+
+# GTFS route_type -> vehicle family; extended types (100 and up) go by hundreds
+ROUTE_TYPES = {0: 'tram', 1: 'subway', 2: 'rail', 3: 'bus', 4: 'ferry', 5: 'tram', 6: 'tram', 7: 'tram',
+               11: 'bus', 12: 'rail'}
+EXTENDED_ROUTE_TYPES = {1: 'rail', 2: 'bus', 4: 'subway', 7: 'bus', 9: 'tram', 10: 'ferry'}
+
+# Google Directions vehicle types -> vehicle family
+VEHICLE_FAMILIES = {
+    'RAIL': 'rail', 'HEAVY_RAIL': 'rail', 'COMMUTER_TRAIN': 'rail', 'HIGH_SPEED_TRAIN': 'rail',
+    'LONG_DISTANCE_TRAIN': 'rail', 'METRO_RAIL': 'subway', 'SUBWAY': 'subway', 'MONORAIL': 'subway',
+    'TRAM': 'tram', 'LIGHT_RAIL': 'tram', 'BUS': 'bus', 'INTERCITY_BUS': 'bus',
+    'TROLLEYBUS': 'bus', 'SHARE_TAXI': 'bus', 'FERRY': 'ferry',
+}
+
+DEFAULT_RADIUS = 400  # metres from a leg end to a candidate stop
+COORD_PRECISION = 6
+
+def route_family(route_type):
+    if route_type >= 100:
+        return EXTENDED_ROUTE_TYPES.get(route_type // 100)
+    return ROUTE_TYPES.get(route_type)
+
+def normalise_name(name):
+    return re.sub(r'[^a-z0-9]', '', (name or '').lower())
+
+def leg_line(leg):
+    # Line name, agency and vehicle family of a routes.json transit leg, in
+    # either the flattened or the Directions API 'line' shape
+    details = leg.get('transit_details') or {}
+    line = details.get('line') or {}
+    agencies = line.get('agencies') or []
+    vehicle = details.get('vehicle_type') or (line.get('vehicle') or {}).get('type')
+    return {
+        'name': line.get('short_name') or line.get('name') or details.get('line_name'),
+        'agency': agencies[0].get('name') if agencies else details.get('agency'),
+        'family': VEHICLE_FAMILIES.get((vehicle or '').upper()),
+    }
+
+# --- Import ---
+
+def feed_files(feed_path):
+    # {table: (size, mtime)} of the feed, the signature of an import
+    if os.path.isdir(feed_path):
+        names = {table: os.path.join(feed_path, table + '.txt') for table in FEED_TABLES}
+        return {table: [os.path.getsize(p), os.path.getmtime(p)] for table, p in names.items() if os.path.exists(p)}
+    return {'zip': [os.path.getsize(feed_path), os.path.getmtime(feed_path)]}
+
+def read_feed_table(feed_path, table):
+    # Rows of one feed file as tuples of FEED_TABLES columns; None if missing
+    name = table + '.txt'
+    archive = None
+    if os.path.isdir(feed_path):
+        path = os.path.join(feed_path, name)
+        if not os.path.exists(path):
+            return None
+        f = open(path, 'r', encoding='utf-8-sig', newline='')
+    else:
+        archive = zipfile.ZipFile(feed_path)
+        members = {os.path.basename(m): m for m in archive.namelist()}
+        if name not in members:
+            archive.close()
+            return None
+        f = io.TextIOWrapper(archive.open(members[name]), encoding='utf-8-sig', newline='')
+
+    def rows():
+        with contextlib.ExitStack() as stack:
+            if archive is not None:
+                stack.enter_context(archive)
+            stack.enter_context(f)
+            reader = csv.reader(f)
+            header = [h.strip() for h in next(reader, [])]
+            columns = [header.index(c) if c in header else None for c in FEED_TABLES[table]]
+            for row in reader:
+                if row:
+                    yield tuple(row[i].strip() if i is not None and i < len(row) else None for i in columns)
+    return rows()
+
+def import_feed(feed_path, db_path):
+    # Loads the feed into db_path unless it already holds this feed; returns
+    # the open connection
+    signature = json.dumps({'feed': os.path.abspath(feed_path), 'files': feed_files(feed_path)}, sort_keys=True)
+    if os.path.exists(db_path):
+        db = sqlite3.connect(db_path)
+        try:
+            row = db.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+        except sqlite3.DatabaseError:
+            row = None
+        if row and row[0] == signature:
+            return db
+        db.close()
+        os.remove(db_path)
+
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    for statement in SCHEMA:
+        db.execute(statement)
+    db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    for table, columns in FEED_TABLES.items():
+        rows = read_feed_table(feed_path, table)
+        if rows is None:
+            if table in OPTIONAL_TABLES:
+                continue
+            db.close()
+            os.remove(tmp_path)
+            raise ValueError(f"{feed_path} has no {table}.txt")
+        placeholders = ', '.join('?' * len(columns))
+        db.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", rows)
+    for statement in INDEXES:
+        db.execute(statement)
+    db.execute("INSERT INTO meta VALUES ('signature', ?)", (signature,))
+    db.commit()
+    db.close()
+    os.replace(tmp_path, db_path)
+    return sqlite3.connect(db_path)
+
+# --- Matching ---
+
+class GtfsFeed:
+    def __init__(self, db, radius=DEFAULT_RADIUS):
+        self.db = db
+        self.radius = radius
+        # Stops are few next to stop_times, so they are held in memory with a
+        # grid for the nearby-stop searches
+        self.stops = {}
+        stop_ids = []
+        boxes = []
+        for stop_id, name, lat, lng in db.execute("SELECT stop_id, stop_name, stop_lat, stop_lon FROM stops"):
+            # Stations without coordinates (or with blanks) cannot be matched
+            if not isinstance(lat, (int, float)) or not isinstance(lng, (int, float)):
+                continue
+            self.stops[stop_id] = (name, lat, lng)
+            stop_ids.append(stop_id)
+            boxes.append([lat, lng, lat, lng])
+        self.stop_ids = stop_ids
+        self.grid = Grid.build(boxes, 0.01)
+
+    @classmethod
+    def open(cls, feed_path, db_path, radius=DEFAULT_RADIUS):
+        return cls(import_feed(feed_path, db_path), radius)
+
+    def close(self):
+        self.db.close()
+
+    def stops_near(self, lat, lng):
+        # {stop_id: metres} within radius
+        projection = Projection(lat)
+        dlat = self.radius / projection.ky
+        dlng = self.radius / projection.kx
+        found = {}
+        for i in self.grid.query_bbox(lat - dlat, lng - dlng, lat + dlat, lng + dlng):
+            stop_id = self.stop_ids[i]
+            _, stop_lat, stop_lng = self.stops[stop_id]
+            distance = projection.point_distance(lat, lng, stop_lat, stop_lng)
+            if distance <= self.radius:
+                found[stop_id] = distance
+        return found
+
+    def candidates(self, board, alight):
+        # (trip, route and sequence details) for trips calling at a board stop
+        # and later at an alight stop
+        board_marks = ', '.join('?' * len(board))
+        alight_marks = ', '.join('?' * len(alight))
+        return self.db.execute(
+            "SELECT b.trip_id, b.stop_id, b.stop_sequence, a.stop_id, a.stop_sequence, "
+            "r.route_short_name, r.route_long_name, r.route_type, ag.agency_name "
+            "FROM stop_times b "
+            "JOIN stop_times a ON a.trip_id = b.trip_id AND a.stop_sequence > b.stop_sequence "
+            "JOIN trips t ON t.trip_id = b.trip_id "
+            "JOIN routes r ON r.route_id = t.route_id "
+            "LEFT JOIN agency ag ON ag.agency_id = r.agency_id "
+            f"WHERE b.stop_id IN ({board_marks}) AND a.stop_id IN ({alight_marks})",
+            list(board) + list(alight))
+
+    def match(self, start_loc, end_loc, line=None):
+        # Best trip for a leg as fetch_stops details, or None
+        line = line or {}
+        board = self.stops_near(start_loc['lat'], start_loc['lng'])
+        alight = self.stops_near(end_loc['lat'], end_loc['lng'])
+        if not board or not alight:
+            return None
+
+        wanted = {normalise_name(line.get('name')), normalise_name(line.get('agency'))} - {''}
+        best = None
+        for (trip_id, board_id, board_seq, alight_id, alight_seq,
+             short_name, long_name, route_type, agency_name) in self.candidates(board, alight):
+            family = route_family(int(route_type)) if route_type not in (None, '') else None
+            names = {normalise_name(short_name), normalise_name(long_name), normalise_name(agency_name)} - {''}
+            rank = (
+                bool(line.get('family')) and family != line['family'],
+                bool(wanted) and not (wanted & names),
+                round(board[board_id] + alight[alight_id]),
+                alight_seq - board_seq,
+                trip_id,
+            )
+            if best is None or rank < best[0]:
+                best = (rank, trip_id, board_seq, alight_seq)
+        if best is None:
+            return None
+
+        _, trip_id, board_seq, alight_seq = best
+        calls = self.db.execute(
+            "SELECT stop_id FROM stop_times WHERE trip_id = ? AND stop_sequence > ? AND stop_sequence < ? "
+            "ORDER BY stop_sequence", (trip_id, board_seq, alight_seq)).fetchall()
+        between = [self.stops.get(stop_id) for (stop_id,) in calls]
+        between = [stop for stop in between if stop is not None]
+        return {
+            'num_stops': len(calls) + 1,
+            'stops': [name for name, _, _ in between],
+            'stop_points': [[round(lat, COORD_PRECISION), round(lng, COORD_PRECISION)] for _, lat, lng in between]
+        }
+
+    def match_all(self, jobs):
+        # jobs are (start, end, line) triples; results come back in the same order
+        return [self.match(start, end, line) for start, end, line in jobs]
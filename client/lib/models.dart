@@ -1,5 +1,7 @@
 import 'package:flutter/foundation.dart';
 import 'package:latlong2/latlong.dart';
+import 'utils/journey_index.dart';
+import 'utils/polyline.dart';
 
 // ignore_for_file: constant_identifier_names
 class IconIds {
@@ -57,7 +59,9 @@ class Segment {
       subSegments = subSegmentsList.map((i) => Segment.fromJson(i)).toList();
     }
 
-    var pathList = json['path'] as List?;
+    // Paths may be emitted as encoded polyline strings (--encode-paths).
+    var rawPath = json['path'];
+    var pathList = rawPath is String ? decodePolyline(rawPath) : rawPath as List?;
     List<LatLng>? path;
     if (pathList != null) {
       try {
@@ -307,16 +311,19 @@ class InitData {
   final DirectDrive directDrive;
   final List<LatLng> mockPath;
   final List<JourneyResult> journeys;
+  final JourneyIndex? journeyIndex;
 
   InitData({
     required this.segmentOptions,
     required this.directDrive,
     required this.mockPath,
     required this.journeys,
+    this.journeyIndex,
   });
 
   factory InitData.fromJson(Map<String, dynamic> json) {
-    var pathList = json['mockPath'] as List?;
+    var rawMockPath = json['mockPath'];
+    var pathList = rawMockPath is String ? decodePolyline(rawMockPath) : rawMockPath as List?;
     List<LatLng> mockPath = [];
     if (pathList != null) {
       try {
@@ -343,6 +350,9 @@ class InitData {
       directDrive: DirectDrive.fromJson(json['directDrive']),
       mockPath: mockPath,
       journeys: journeys,
+      journeyIndex: json['journeyIndex'] != null
+          ? JourneyIndex.fromJson(json['journeyIndex'])
+          : null,
     );
   }
 }
@@ -1,20 +1,91 @@
 import 'dart:convert';
 import 'package:flutter/services.dart';
+import 'package:http/http.dart' as http;
 import '../models.dart';
+import '../utils/route_refs.dart';
+import '../utils/route_shards.dart';
 import '../utils/route_selector.dart';
 
 class ApiService {
   // Simulate network delay
   static const Duration _delay = Duration(milliseconds: 500);
 
-  Future<InitData> _loadRoutes(String? routeId) async {
-    String assetPath = 'assets/routes_clean.json';
+  /// Base URL of a route_server.py instance. When set, journey searches are
+  /// answered by the server instead of the bundled assets.
+  final String? baseUrl;
+  final http.Client _client;
+
+  ApiService({this.baseUrl, http.Client? client})
+      : _client = client ?? http.Client();
+
+  final Map<String, RouteShards> _shards = {};
+
+  String _assetPath(String? routeId) {
     if (routeId == 'route2') {
-      assetPath = 'assets/routes_2_clean.json';
+      return 'assets/routes_2_clean.json';
     }
+    return 'assets/routes_clean.json';
+  }
+
+  Future<Map<String, dynamic>> _loadAsset(String assetPath) async {
     final jsonString = await rootBundle.loadString(assetPath);
-    final Map<String, dynamic> jsonData = jsonDecode(jsonString);
-    return InitData.fromJson(jsonData);
+    return jsonDecode(jsonString);
+  }
+
+  // Sharded assets (process_routes.py --format shards) keep one reader per
+  // route so shards already fetched are reused.
+  Future<RouteShards?> _routeShards(String? routeId) async {
+    final assetPath = _assetPath(routeId);
+    if (_shards.containsKey(assetPath)) return _shards[assetPath];
+    final jsonData = await _loadAsset(assetPath);
+    if (!RouteShards.isSharded(jsonData)) return null;
+    final dir = assetPath.substring(0, assetPath.lastIndexOf('/') + 1);
+    return _shards[assetPath] = RouteShards(
+      jsonData,
+      (path) => rootBundle.loadString('$dir$path'),
+    );
+  }
+
+  Future<InitData> _loadRoutes(String? routeId) async {
+    final shards = await _routeShards(routeId);
+    if (shards != null) {
+      return InitData.fromJson(await shards.resolve());
+    }
+    final jsonData = await _loadAsset(_assetPath(routeId));
+    return InitData.fromJson(resolveRouteRefs(jsonData));
+  }
+
+  /// Leg and journey totals only. For sharded assets this reads just the
+  /// index; legs come back without segments (see [fetchLegSegments]).
+  Future<InitData> fetchRouteSummary({String? routeId}) async {
+    final shards = await _routeShards(routeId);
+    if (shards != null) {
+      return InitData.fromJson(shards.summary());
+    }
+    return _loadRoutes(routeId);
+  }
+
+  /// Segments and geometry of the segment option at [position] in [slot]
+  /// (`firstMile`, `mainLeg` or `lastMile`), fetching its shard on demand.
+  /// Leg ids are not unique across slots, so legs are picked by position.
+  Future<List<Segment>> fetchLegSegments(String slot, int position,
+      {String? routeId}) async {
+    final shards = await _routeShards(routeId);
+    if (shards != null) {
+      final segments =
+          await shards.segmentsForOption(slot, position) ?? const [];
+      return segments.map((s) => Segment.fromJson(s)).toList();
+    }
+    final options = (await _loadRoutes(routeId)).segmentOptions;
+    final legs = slot == 'mainLeg'
+        ? [options.mainLeg]
+        : slot == 'firstMile'
+            ? options.firstMile
+            : slot == 'lastMile'
+                ? options.lastMile
+                : const <Leg>[];
+    if (position < 0 || position >= legs.length) return const [];
+    return legs[position].segments;
   }
 
   Future<InitData> fetchInitData({String? routeId}) async {
@@ -27,10 +98,21 @@ class ApiService {
     required Map<String, bool> selectedModes,
     String? routeId,
   }) async {
+    if (baseUrl != null) {
+      return _searchServer(tab, selectedModes, routeId);
+    }
+
     await Future.delayed(_delay);
 
     final initData = await _loadRoutes(routeId);
 
+    // Assets built with --journey-index come filtered and sorted by lookup
+    final indexed =
+        initData.journeyIndex?.select(initData.journeys, tab, selectedModes);
+    if (indexed != null) {
+      return RouteSelector.selectJourneys(indexed, tab, presorted: true);
+    }
+
     // Filter Modes
     List<JourneyResult> combos = initData.journeys.where((combo) {
       final allSegments = [
@@ -53,4 +135,39 @@ class ApiService {
 
     return RouteSelector.selectJourneys(combos, tab);
   }
+
+  Future<List<JourneyResult>> _searchServer(
+    String tab,
+    Map<String, bool> selectedModes,
+    String? routeId,
+  ) async {
+    // The server filters modes and sorts; diversity selection stays here
+    final excluded = [
+      for (final entry in selectedModes.entries)
+        if (!entry.value) entry.key,
+    ]..sort();
+    final uri = Uri.parse(
+      '$baseUrl/api/routes/${routeId ?? 'route1'}/journeys',
+    ).replace(queryParameters: {
+      'sort': tab == 'fastest'
+          ? 'time'
+          : tab == 'cheapest'
+              ? 'cost'
+              : 'smart',
+      'view': 'full',
+      'limit': '1000',
+      if (excluded.isNotEmpty) 'exclude': excluded.join(','),
+    });
+
+    final response = await _client.get(uri);
+    if (response.statusCode != 200) {
+      throw Exception(
+          'Journey search failed (${response.statusCode}): ${response.body}');
+    }
+    final Map<String, dynamic> jsonData = jsonDecode(response.body);
+    final combos = (jsonData['journeys'] as List)
+        .map((j) => JourneyResult.fromJson(j))
+        .toList();
+    return RouteSelector.selectJourneys(combos, tab, presorted: true);
+  }
 }
@@ -0,0 +1,114 @@
+import '../models.dart';
+
+/// Precomputed journey orderings from `process_routes.py --journey-index`.
+///
+/// Every entry refers to journeys by their position in the asset's
+/// `journeys` list:
+/// - `order[key]` lists positions best first for each sort key,
+/// - `rank[key]` gives each journey's place in that order,
+/// - `modeMasks[i]` has bit b set when journey i uses `modes[b]`,
+/// - `buckets[metric]` holds, for each limit on the metric, how many
+///   journeys are within it and the best one by each sort key.
+class JourneyIndex {
+  final Map<String, List<int>> order;
+  final Map<String, List<int>> rank;
+  final List<String> modes;
+  final List<int> modeMasks;
+  final Map<String, JourneyBucket> buckets;
+
+  JourneyIndex({
+    required this.order,
+    required this.rank,
+    required this.modes,
+    required this.modeMasks,
+    required this.buckets,
+  });
+
+  static Map<String, List<int>> _intLists(Map<String, dynamic>? json) => {
+        for (final entry in (json ?? const {}).entries)
+          entry.key: (entry.value as List).cast<int>(),
+      };
+
+  factory JourneyIndex.fromJson(Map<String, dynamic> json) {
+    final buckets = (json['buckets'] as Map<String, dynamic>?) ?? const {};
+    return JourneyIndex(
+      order: _intLists(json['order'] as Map<String, dynamic>?),
+      rank: _intLists(json['rank'] as Map<String, dynamic>?),
+      modes: ((json['modes'] as List?) ?? const []).cast<String>(),
+      modeMasks: ((json['modeMasks'] as List?) ?? const []).cast<int>(),
+      buckets: {
+        for (final entry in buckets.entries)
+          entry.key:
+              JourneyBucket.fromJson(entry.value as Map<String, dynamic>),
+      },
+    );
+  }
+
+  /// Sort key behind a summary tab.
+  static String sortKeyForTab(String tab) {
+    if (tab == 'fastest') return 'time';
+    if (tab == 'cheapest') return 'cost';
+    return 'smart';
+  }
+
+  /// Mask of the modes switched off in [selectedModes]; journeys whose
+  /// mask shares a bit with it are filtered out.
+  int excludedMask(Map<String, bool> selectedModes) {
+    var mask = 0;
+    for (var b = 0; b < modes.length; b++) {
+      if (selectedModes[modes[b]] == false) mask |= 1 << b;
+    }
+    return mask;
+  }
+
+  /// Journeys in [tab] order without excluded modes, or null when the index
+  /// does not cover [journeys].
+  List<JourneyResult>? select(
+    List<JourneyResult> journeys,
+    String tab,
+    Map<String, bool> selectedModes,
+  ) {
+    final positions = order[sortKeyForTab(tab)];
+    if (positions == null ||
+        positions.length != journeys.length ||
+        modeMasks.length != journeys.length) {
+      return null;
+    }
+    final excluded = excludedMask(selectedModes);
+    return [
+      for (final i in positions)
+        if (modeMasks[i] & excluded == 0) journeys[i],
+    ];
+  }
+
+  /// Position of the best journey by [sortKey] with [metric] at most
+  /// [limit], e.g. `bestWithin('time', 60, 'cost')` for the cheapest under
+  /// an hour. Null when no journey qualifies or the limit is not indexed.
+  int? bestWithin(String metric, num limit, String sortKey) {
+    final bucket = buckets[metric];
+    if (bucket == null) return null;
+    final i = bucket.limits.indexOf(limit);
+    if (i < 0) return null;
+    return bucket.best[sortKey]?[i];
+  }
+}
+
+class JourneyBucket {
+  final List<num> limits;
+  final List<int> count;
+  final Map<String, List<int?>> best;
+
+  JourneyBucket({required this.limits, required this.count, required this.best});
+
+  factory JourneyBucket.fromJson(Map<String, dynamic> json) {
+    final best = (json['best'] as Map<String, dynamic>?) ?? const {};
+    return JourneyBucket(
+      limits: (json['limits'] as List).cast<num>(),
+      count: (json['count'] as List).cast<int>(),
+      best: {
+        for (final entry in best.entries)
+          entry.key: (entry.value as List).cast<int?>(),
+      },
+    );
+  }
+}
@@ -0,0 +1,120 @@
+import 'dart:convert';
+
+/// Applies a build delta (`"format": "delta"`, written by
+/// `process_routes.py --delta`) to a cached inline routes asset, giving the
+/// asset of the delta's build.
+///
+/// Leg ids are not unique, so legs are keyed by slot and position
+/// (`firstMile/0`, `mainLeg`, `lastMile/2`). A journey leg takes the key of
+/// the first leg in its slot with the same id and content; journey legs
+/// outside the segment options get `journey/0`, `journey/1`, ... in order of
+/// first use. Journeys are keyed by id, with `#1`, `#2`, ... added to repeats
+/// of an id. This matches `leg_keys` and `journey_keys` in
+/// process_routes.py. The delta lists added, changed and removed
+/// legs, journeys (with legs as keys) and top-level values, the new segment
+/// options as leg keys, the journey order when it is not implied, and the
+/// top-level key order.
+///
+/// Throws [StateError] when [cached] is not the build the delta starts from;
+/// the full asset has to be fetched instead.
+Map<String, dynamic> applyRouteDelta(
+    Map<String, dynamic> cached, Map<String, dynamic> delta) {
+  if (cached['build'] != delta['from']) {
+    throw StateError(
+        'Delta ${delta['from']} -> ${delta['to']} does not apply to build ${cached['build']}');
+  }
+  const structureKeys = {'segmentOptions', 'journeys', 'build'};
+
+  void patch(Map<String, dynamic> table, Map<String, dynamic> diff) {
+    for (final key in diff['removed'] as List) {
+      table.remove(key);
+    }
+    table.addAll(diff['added'] as Map<String, dynamic>);
+    table.addAll(diff['changed'] as Map<String, dynamic>);
+  }
+
+  // Leg keys of the cached asset, as assigned by the build
+  final options = cached['segmentOptions'] as Map<String, dynamic>;
+  final legs = <String, dynamic>{'mainLeg': options['mainLeg']};
+  final slots = <String, List<String>>{
+    'firstMile': [],
+    'lastMile': [],
+    'journey': [],
+  };
+  for (final slot in ['firstMile', 'lastMile']) {
+    final slotLegs = options[slot] as List;
+    for (var i = 0; i < slotLegs.length; i++) {
+      legs['$slot/$i'] = slotLegs[i];
+      slots[slot]!.add('$slot/$i');
+    }
+  }
+  final encoded = Map<Object, String>.identity();
+  String encode(Object leg) => encoded.putIfAbsent(leg, () => jsonEncode(leg));
+  String legKey(Map<String, dynamic> leg, String slot) {
+    for (final candidates in [slots[slot]!, slots['journey']!]) {
+      for (final key in candidates) {
+        if (identical(legs[key], leg)) return key;
+      }
+      for (final key in candidates) {
+        final other = legs[key] as Map<String, dynamic>;
+        if (other['id'] == leg['id'] && encode(other) == encode(leg)) return key;
+      }
+    }
+    final key = 'journey/${slots['journey']!.length}';
+    legs[key] = leg;
+    slots['journey']!.add(key);
+    return key;
+  }
+
+  final cachedJourneys = (cached['journeys'] as List?) ?? const [];
+  final journeyKeys = <String>[];
+  final seen = <String, int>{};
+  for (final journey in cachedJourneys) {
+    final id = journey['id'] as String;
+    final n = seen[id] ?? 0;
+    seen[id] = n + 1;
+    journeyKeys.add(n == 0 ? id : '$id#$n');
+  }
+  final journeys = <String, dynamic>{
+    for (var i = 0; i < cachedJourneys.length; i++)
+      journeyKeys[i]: {
+        ...(cachedJourneys[i] as Map<String, dynamic>),
+        'leg1': legKey(cachedJourneys[i]['leg1'] as Map<String, dynamic>, 'firstMile'),
+        'leg3': legKey(cachedJourneys[i]['leg3'] as Map<String, dynamic>, 'lastMile'),
+      },
+  };
+
+  patch(legs, delta['legs'] as Map<String, dynamic>);
+  final journeyDiff = delta['journeys'] as Map<String, dynamic>;
+  final removed = (journeyDiff['removed'] as List).toSet();
+  final order = (journeyDiff['order'] as List?) ??
+      [
+        for (final key in journeyKeys)
+          if (!removed.contains(key)) key,
+        ...(journeyDiff['added'] as Map<String, dynamic>).keys,
+      ];
+  patch(journeys, journeyDiff);
+
+  final values = <String, dynamic>{
+    for (final entry in cached.entries)
+      if (!structureKeys.contains(entry.key)) entry.key: entry.value,
+  };
+  patch(values, delta['values'] as Map<String, dynamic>);
+
+  final newOptions = delta['segmentOptions'] as Map<String, dynamic>;
+  values['segmentOptions'] = {
+    'firstMile': [for (final key in newOptions['firstMile'] as List) legs[key]],
+    'mainLeg': legs[newOptions['mainLeg']],
+    'lastMile': [for (final key in newOptions['lastMile'] as List) legs[key]],
+  };
+  values['journeys'] = [
+    for (final id in order)
+      {
+        ...(journeys[id] as Map<String, dynamic>),
+        'leg1': legs[journeys[id]['leg1']],
+        'leg3': legs[journeys[id]['leg3']],
+      },
+  ];
+  values['build'] = delta['to'];
+  return {for (final key in delta['keys'] as List) key as String: values[key]};
+}
@@ -0,0 +1,67 @@
+import 'polyline.dart';
+
+/// Expands a reference-deduplicated routes asset (`"format": "refs"`) back
+/// into the inline layout expected by [InitData.fromJson].
+///
+/// Journeys and segment options refer to legs by index into `legs`, and
+/// segments refer to decoded paths by index into `paths` via `pathRefs`.
+/// Assets without a `legs` table are returned unchanged.
+Map<String, dynamic> resolveRouteRefs(Map<String, dynamic> json) {
+  final legsTable = json['legs'] as List?;
+  if (legsTable == null) return json;
+  // Table entries are coordinate pairs, or encoded polylines (--encode-paths).
+  final pathsTable = ((json['paths'] as List?) ?? const [])
+      .map((p) => p is String ? decodePolyline(p) : p as List)
+      .toList();
+
+  List<dynamic> concatPaths(List refs) => [
+        for (final ref in refs) ...pathsTable[ref as int],
+      ];
+
+  Map<String, dynamic> resolveSegment(Map<String, dynamic> seg) {
+    final resolved = Map<String, dynamic>.from(seg);
+    final subSegments = seg['subSegments'] as List?;
+    if (subSegments != null) {
+      resolved['subSegments'] = subSegments
+          .map((s) => resolveSegment(s as Map<String, dynamic>))
+          .toList();
+    }
+    final pathRefs = resolved.remove('pathRefs') as List?;
+    if (pathRefs != null) {
+      resolved['path'] = concatPaths(pathRefs);
+    }
+    return resolved;
+  }
+
+  // Resolve each leg once; journeys share the resolved maps.
+  final legs = legsTable.map((leg) {
+    final resolved = Map<String, dynamic>.from(leg as Map<String, dynamic>);
+    final segments = (leg['segments'] as List?) ?? const [];
+    resolved['segments'] = segments
+        .map((s) => resolveSegment(s as Map<String, dynamic>))
+        .toList();
+    return resolved;
+  }).toList();
+
+  final options = json['segmentOptions'] as Map<String, dynamic>;
+  final journeys = (json['journeys'] as List?) ?? const [];
+
+  return {
+    'segmentOptions': {
+      'firstMile': [for (final i in options['firstMile'] as List) legs[i as int]],
+      'mainLeg': legs[options['mainLeg'] as int],
+      'lastMile': [for (final i in options['lastMile'] as List) legs[i as int]],
+    },
+    'directDrive': json['directDrive'],
+    'mockPath': json['mockPath'],
+    if (json.containsKey('journeyIndex')) 'journeyIndex': json['journeyIndex'],
+    'journeys': [
+      for (final journey in journeys)
+        {
+          ...(journey as Map<String, dynamic>),
+          'leg1': legs[journey['leg1'] as int],
+          'leg3': legs[journey['leg3'] as int],
+        },
+    ],
+  };
+}
@@ -1,7 +1,10 @@
 import '../models.dart';
 
 class RouteSelector {
-  static List<JourneyResult> selectJourneys(List<JourneyResult> combos, String tab) {
+  /// [presorted] combos are already in [tab] order (see JourneyIndex), so
+  /// the groups built from them are too and are not sorted again.
+  static List<JourneyResult> selectJourneys(List<JourneyResult> combos, String tab,
+      {bool presorted = false}) {
     // Group & Sort based on "Diversity First" Algorithm
     Map<String, List<JourneyResult>> grouped = {};
     for (var result in combos) {
@@ -33,8 +36,10 @@ class RouteSelector {
     }
 
     // Sort within groups
-    for (var key in grouped.keys) {
-      sortResults(grouped[key]!);
+    if (!presorted) {
+      for (var key in grouped.keys) {
+        sortResults(grouped[key]!);
+      }
     }
 
     // Sort groups by their best journey
@@ -0,0 +1,96 @@
+import 'dart:convert';
+
+/// Loads the text of a shard file, given its path relative to the index.
+typedef ShardLoader = Future<String> Function(String path);
+
+/// Reader for sharded routes assets (`"format": "shards"`).
+///
+/// The index holds leg summaries (no segments), journeys and segment options
+/// as leg indices, and `mockPathShard`. Each leg's segments and geometry live
+/// in the shard named by its `shard` field, which is fetched on first use and
+/// then cached.
+class RouteShards {
+  final Map<String, dynamic> index;
+  final ShardLoader loadShard;
+  final Map<String, Future<Map<String, dynamic>>> _shards = {};
+
+  RouteShards(this.index, this.loadShard);
+
+  static bool isSharded(Map<String, dynamic> json) =>
+      json['format'] == 'shards';
+
+  List<dynamic> get legs => index['legs'] as List;
+
+  Future<Map<String, dynamic>> _shard(String path) => _shards.putIfAbsent(
+      path,
+      () async =>
+          jsonDecode(await loadShard(path)) as Map<String, dynamic>);
+
+  /// Summary-only data in the inline layout: legs have no segments and there
+  /// is no mockPath, so nothing beyond the index is read.
+  Map<String, dynamic> summary() => _expand(
+        legs.map((leg) => Map<String, dynamic>.from(leg as Map)).toList(),
+        const {},
+      );
+
+  /// Segments (with paths) of the leg at [legIndex] in the index.
+  Future<List<dynamic>> segments(int legIndex) async {
+    final shard = await _shard(legs[legIndex]['shard'] as String);
+    return shard['segments'] as List;
+  }
+
+  /// The segments of the segment option at [position] in [slot]
+  /// (`firstMile`, `mainLeg` or `lastMile`), or null when there is none.
+  /// Leg ids repeat between first and last mile, so options are found by
+  /// position rather than id.
+  Future<List<dynamic>?> segmentsForOption(String slot, [int position = 0]) async {
+    final options = index['segmentOptions'] as Map<String, dynamic>;
+    final entry = options[slot];
+    if (entry is int) return position == 0 ? segments(entry) : null;
+    if (entry is! List || position < 0 || position >= entry.length) return null;
+    return segments(entry[position] as int);
+  }
+
+  /// Everything, fetching every shard, in the inline layout expected by
+  /// [InitData.fromJson].
+  Future<Map<String, dynamic>> resolve() async {
+    final resolved = <Map<String, dynamic>>[];
+    for (var i = 0; i < legs.length; i++) {
+      resolved.add({
+        ...Map<String, dynamic>.from(legs[i] as Map),
+        'segments': await segments(i),
+      });
+    }
+    final geometry = await _shard(index['mockPathShard'] as String);
+    return _expand(resolved, geometry);
+  }
+
+  Map<String, dynamic> _expand(
+      List<Map<String, dynamic>> legs, Map<String, dynamic> geometry) {
+    for (final leg in legs) {
+      leg.remove('shard');
+    }
+    final options = index['segmentOptions'] as Map<String, dynamic>;
+    final journeys = (index['journeys'] as List?) ?? const [];
+
+    return {
+      'segmentOptions': {
+        'firstMile': [for (final i in options['firstMile'] as List) legs[i as int]],
+        'mainLeg': legs[options['mainLeg'] as int],
+        'lastMile': [for (final i in options['lastMile'] as List) legs[i as int]],
+      },
+      'directDrive': index['directDrive'],
+      'mockPath': geometry['mockPath'] ?? const [],
+      if (index.containsKey('journeyIndex'))
+        'journeyIndex': index['journeyIndex'],
+      'journeys': [
+        for (final journey in journeys)
+          {
+            ...(journey as Map<String, dynamic>),
+            'leg1': legs[journey['leg1'] as int],
+            'leg3': legs[journey['leg3'] as int],
+          },
+      ],
+    };
+  }
+}
@@ -1,6 +1,27 @@
+import argparse
+import contextlib
+import hashlib
+import heapq
 import json
 import math
+import os
 import re
+import sys
+import time
+
+import route_model
+import route_polyline
+import route_rules
+from route_binary import write_route_binary
+from route_build import build_routes, format_build_summary, load_manifest
+from route_delta import prepare_build_delta, save_build_manifest, update_cached_output
+from route_journey_index import add_journey_index
+from route_model import Journey, Leg, PackedPath, PathView, Segment, leg_from_json, to_json
+from route_output import build_ref_output, build_shard_output, encode_output_paths, output_legs, remove_stale_shards
+from route_polyline import check_batch_decoder, decode_path_batch, decode_polyline
+from route_rules import RouteRules
+from route_spatial import DEFAULT_CELL_SIZE, SpatialIndex
+from route_stream import iter_route_options, write_json_stream
 
 # Constants from Dart code
 ICON_IDS = {
@@ -12,42 +33,41 @@ ICON_IDS = {
     'parking': 'parking'
 }
 
-PRICING = {
-    'brough': {'parking': 5.80, 'uber': 22.58, 'train': 8.10},
-    'york': {'parking': 13.80, 'uber': 46.24, 'train': 5.20},
-    'beverley': {'parking': 4.40, 'uber': 4.62, 'train': 12.10},
-    'hull': {'parking': 6.00, 'uber': 20.63, 'train': 9.60},
-    'eastrington': {'parking': 0.00, 'uber': 34.75, 'train': 7.00},
-}
-
-def decode_polyline(polyline_str):
-    index, lat, lng = 0, 0, 0
-    coordinates = []
-    changes = {'latitude': 0, 'longitude': 0}
-
-    while index < len(polyline_str):
-        for unit in ['latitude', 'longitude']:
-            shift, result = 0, 0
-
-            while True:
-                byte = ord(polyline_str[index]) - 63
-                index += 1
-                result |= (byte & 0x1f) << shift
-                shift += 5
-                if not byte >= 0x20:
-                    break
-
-            if (result & 1):
-                changes[unit] = ~(result >> 1)
-            else:
-                changes[unit] = (result >> 1)
-
-        lat += changes['latitude']
-        lng += changes['longitude']
-
-        coordinates.append([lat / 100000.0, lng / 100000.0])
-
-    return coordinates
+# --- Route Rules ---
+# IDs, risk scores, icons, pricing, bus fares and per-route behaviour (cost
+# overrides, transfer buffers, detail cut-offs, labels, park & ride legs and
+# the journey buffer) are data in route_rules.json, matched by route_rules.py.
+# Rule lists are ordered (first match wins) and each rule's "when" lists
+# keywords that must all appear in the option name or group name; a nested
+# list means any one of them. Lower-case keywords match case-insensitively,
+# keywords with capitals match exactly.
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'route_rules.json')
+
+def load_rules(path=RULES_PATH):
+    with open(path, 'r') as f:
+        return RouteRules(json.load(f))
+
+RULES = load_rules()
+PRICING = RULES.pricing
+
+def option_polylines(options):
+    polylines = []
+    for option in options:
+        for leg in option.get('legs', []):
+            poly = leg.get('polyline', '')
+            if poly:
+                polylines.append(poly)
+    return polylines
+
+def collect_polylines(groups):
+    return option_polylines(option for group in groups for option in group.get('options', []))
+
+def lookup_path(polyline_str, paths):
+    # Paths are never modified in place, so decoded buffers can be shared
+    if paths is not None and polyline_str in paths:
+        return paths[polyline_str]
+    return PackedPath.from_pairs(decode_polyline(polyline_str))
 
 def get_emission_factor(icon_id):
     if icon_id == ICON_IDS['train']: return 0.06
@@ -59,12 +79,7 @@ def calculate_emission(distance_miles, icon_id):
     return distance_miles * get_emission_factor(icon_id)
 
 def get_bus_cost(label):
-    lower = label.lower()
-    if re.search(r'\bx1\b', lower) or re.search(r'\bx46\b', lower):
-        return 3.00
-    if re.search(r'\bpr\d+\b', lower):
-        return 5.00
-    return 2.00
+    return RULES.bus_fare(label)
 
 def map_mode(raw_mode, transit_details):
     raw_mode = raw_mode.lower()
@@ -84,12 +99,12 @@ def map_mode(raw_mode, transit_details):
         return 'bus'
     return raw_mode
 
-def parse_segment(json_segment, option_name, route_id):
+def parse_segment(json_segment, option_name, route_id, paths=None):
     raw_mode = json_segment.get('mode', '').lower()
     transit_details = json_segment.get('transit_details')
     mode = map_mode(raw_mode, transit_details)
     polyline = json_segment.get('polyline', '')
-    path = decode_polyline(polyline)
+    path = lookup_path(polyline, paths)
 
     label = mode
     line_color = '#000000'
@@ -182,7 +197,7 @@ def parse_segment(json_segment, option_name, route_id):
     elif mode == 'train':
         cost = 0.00
 
-    return {
+    return Segment({
         'mode': mode,
         'label': label,
         'lineColor': line_color,
@@ -197,7 +212,7 @@ def parse_segment(json_segment, option_name, route_id):
         'numStops': num_stops,
         'stops': stops,
         'stopPoints': stop_points
-    }
+    })
 
 def should_merge(a, b):
     if a['mode'] == b['mode'] and a['label'] == b['label']:
@@ -207,9 +222,7 @@ def should_merge(a, b):
     return False
 
 def merge_segments(a, b):
-    new_path = []
-    if a.get('path'): new_path.extend(a['path'])
-    if b.get('path'): new_path.extend(b['path'])
+    new_path = PackedPath.concat([a.get('path'), b.get('path')])
 
     new_time = a['time'] + b['time']
     new_dist = (a.get('distance') or 0) + (b.get('distance') or 0)
@@ -234,92 +247,45 @@ def merge_segments(a, b):
     return merged
 
 def calculate_risk(group_name, option_name):
-    lower_group = group_name.lower()
-    lower_option = option_name.lower()
-
-    if 'group 1' in lower_group:
-        if 'cycle' in lower_option: return {'score': 1, 'reason': 'Weather dependent, fitness required'}
-        if 'bus' in lower_option: return {'score': 0, 'reason': 'Frequent, reliable'}
-        if 'uber' in lower_option or 'drive' in lower_option: return {'score': 0, 'reason': 'Most reliable'}
-
-    if 'group 2' in lower_group:
-        if 'bus' in lower_option and 'train' in lower_option:
-            return {'score': 2, 'reason': 'Bus risk (+1) + Connection risk (+1)'}
-        if 'p&r' in lower_option:
-            return {'score': 1, 'reason': 'Connection risk'}
-        if 'walk' in lower_option and 'train' in lower_option:
-            return {'score': 2, 'reason': 'Timing risk (+1) + Connection risk (+1)'}
-        if 'cycle' in lower_option and 'train' in lower_option:
-            return {'score': 1, 'reason': 'Weather dependent, connection risk'}
-        if ('uber' in lower_option or 'drive' in lower_option) and 'train' in lower_option:
-            return {'score': 1, 'reason': 'Connection risk'}
-
-    if 'group 3' in lower_group:
-        if 'train' in lower_option: return {'score': 1, 'reason': 'Delay/timing risk'}
-
-    if 'group 4' in lower_group:
-        if 'bus' in lower_option: return {'score': 2, 'reason': 'Unfamiliar area, less frequent'}
-        if 'uber' in lower_option: return {'score': 0, 'reason': 'Most reliable'}
-        if 'cycle' in lower_option: return {'score': 1, 'reason': 'Weather dependent, fitness required'}
-
-    if 'group 5' in lower_group:
-        return {'score': 0, 'reason': 'Most reliable'}
-
-    return {'score': 0, 'reason': 'Standard risk'}
+    rule, _ = RULES.risk.match(RULES.mask(option_name), RULES.mask(group_name))
+    return {'score': rule['score'], 'reason': rule['reason']}
 
 def generate_id(name):
-    lower = name.lower()
-    hub = None
-    if 'brough' in lower: hub = 'brough'
-    elif 'york' in lower: hub = 'york'
-    elif 'beverley' in lower: hub = 'beverley'
-    elif 'hull' in lower: hub = 'hull'
-    elif 'eastrington' in lower: hub = 'eastrington'
-    elif 'headingley' in lower: hub = 'headingley'
-
-    if 'p&r' in lower or 'park & ride' in lower:
-        if 'stourton' in lower: return 'drive_stourton_pr'
-        if 'temple green' in lower: return 'drive_temple_green_pr'
-        if 'elland road' in lower: return 'drive_elland_road_pr'
-        return 'drive_pr'
-
-    if 'train' in lower:
-        if hub:
-            if 'walk' in lower: return f'train_walk_{hub}'
-            if 'cycle' in lower: return f'train_cycle_{hub}'
-            if 'uber' in lower: return f'train_uber_{hub}'
-            if 'drive' in lower: return f'train_drive_{hub}'
-            if 'bus' in lower: return f'train_bus_{hub}'
-            return f'train_{hub}'
-        if 'walk' in lower: return 'train_walk_headingley'
-        if 'cycle' in lower: return 'train_cycle_headingley'
-        if 'uber' in lower: return 'train_uber_headingley'
-        if 'drive' in lower: return 'train_drive'
-        if 'bus' in lower: return 'train_bus'
-        return 'train_main'
-
-    if 'uber' in lower: return 'uber'
-    if 'bus' in lower: return 'bus'
-    if 'cycle' in lower: return 'cycle'
-    if 'direct drive' in lower: return 'direct_drive'
-    if 'drive' in lower: return 'drive'
-
+    rule, hub = RULES.ids.match(RULES.mask(name))
+    if rule:
+        return rule['id'].format(hub=hub)
     return re.sub(r'[^a-zA-Z0-9]', '_', name).lower()
 
 def map_icon_id(name, segments):
-    lower = name.lower()
-    if 'uber' in lower: return ICON_IDS['car']
-    if 'bus' in lower: return ICON_IDS['bus']
-    if 'cycle' in lower: return ICON_IDS['bike']
-    if 'train' in lower:
-        if 'walk' in lower: return ICON_IDS['footprints']
-        if 'cycle' in lower: return ICON_IDS['bike']
-        if 'uber' in lower: return ICON_IDS['car']
-        if 'drive' in lower: return ICON_IDS['car']
-        if 'bus' in lower: return ICON_IDS['bus']
-        return ICON_IDS['train']
-    if 'walk' in lower: return ICON_IDS['footprints']
-    return ICON_IDS['car']
+    rule, _ = RULES.icons.match(RULES.mask(name))
+    return ICON_IDS[rule['icon']]
+
+def override_segments(segments, selector):
+    modes = selector.get('modes', [])
+    label = selector.get('label')
+    return [seg for seg in segments
+            if seg['mode'] in modes or (label and label in seg['label'].lower())]
+
+def apply_route_overrides(route_id, group_name, name, segments):
+    for rule in RULES.route_rules(route_id, 'overrides', name, group_name):
+        targets = override_segments(segments, rule['segments'])
+        action = rule['action']
+        if action == 'addCost':
+            for seg in targets:
+                seg['cost'] += rule['amount']
+        elif action == 'setCost':
+            # First matching segment only
+            if targets:
+                targets[0]['cost'] = rule['amount']
+        elif action == 'fare':
+            # Charged once, later matching segments are free
+            for n, seg in enumerate(targets):
+                seg['cost'] = 0.0 if n else rule['amount']
+        elif action == 'busFare':
+            for seg in targets:
+                seg['cost'] = get_bus_cost(seg['label'])
+        else:
+            raise ValueError(f"Unknown override action '{action}' for {route_id}")
 
 def map_line_color(name, segments):
     lower = name.lower()
@@ -350,154 +316,244 @@ def generate_detail(segments):
             parts.append(f"{seg['time']} min {mode}")
     return ' then '.join(parts)
 
+# --- Segment Grouping ---
+# group_segments classifies every segment once and precomputes, right to
+# left, where each walk/wait run ends and which train a train merges with.
+# A single left-to-right pass then emits train_group/access_group segments
+# whose paths are PathViews over their subSegments. Output matches the
+# original look-ahead grouping (test/segment_grouping_test.py).
+
+def segment_kinds(seg):
+    # (train, transfer, walk_or_wait, ride) flags used by the grouping pass
+    mode = seg['mode']
+    train = seg['iconId'] == ICON_IDS['train']
+    transfer = mode == 'walk' or seg['iconId'] == ICON_IDS['footprints']
+    walk_or_wait = transfer or (mode == 'wait' and seg.get('label') != 'Transfer')
+    ride = not walk_or_wait and not (mode == 'wait' and seg.get('label') == 'Transfer')
+    return train, transfer, walk_or_wait, ride
+
 def group_segments(segments, leg_context):
+    n = len(segments)
+    kinds = [segment_kinds(seg) for seg in segments]
+
+    # run_end[i]: first index >= i that is not a walk/wait
+    # train_next[i]: index of the train that train i merges with, or -1
+    run_end = [n] * (n + 1)
+    train_next = [-1] * n
+    for i in range(n - 1, -1, -1):
+        run_end[i] = run_end[i + 1] if kinds[i][2] else i
+        if kinds[i][0] and i + 1 < n:
+            j = i + 2 if kinds[i + 1][1] else i + 1
+            if j < n and kinds[j][0]:
+                train_next[i] = j
+
     grouped = []
     i = 0
-    while i < len(segments):
+    while i < n:
         seg = segments[i]
 
-        # --- Train Merge Logic ---
-        if seg['iconId'] == ICON_IDS['train']:
-            # Look ahead for next train
-            look_ahead_idx = i + 1
-            accumulated_wait = 0
-            next_train_seg = None
-
-            # Helper to check if a segment is just a walk/transfer
-            def is_transfer(s):
-                return s['mode'] == 'walk' or s['iconId'] == ICON_IDS['footprints']
-
-            temp_idx = look_ahead_idx
-            if temp_idx < len(segments):
-                check_seg = segments[temp_idx]
-                if is_transfer(check_seg):
-                    accumulated_wait += check_seg['time']
-                    temp_idx += 1
-                    if temp_idx < len(segments):
-                        check_seg = segments[temp_idx]
-                    else:
-                        check_seg = None
-
-                if check_seg and check_seg['iconId'] == ICON_IDS['train']:
-                    next_train_seg = check_seg
-                    look_ahead_idx = temp_idx
-
-            if next_train_seg:
-                # Merge Found
-                # Create Group Segment
-                wait_time = next_train_seg.get('waitTime', 0) + accumulated_wait
-
-                group_seg = {
-                    'mode': 'train_group', # Special mode for frontend check
-                    'label': seg['label'], # Use first train label or composite? Frontend logic uses internal.
-                    'lineColor': seg['lineColor'],
-                    'iconId': seg['iconId'],
-                    'time': seg['time'] + next_train_seg['time'], # Exclude wait_time, added separately by frontend
-                    'cost': seg['cost'] + next_train_seg['cost'],
-                    'distance': (seg.get('distance') or 0) + (next_train_seg.get('distance') or 0),
-                    'co2': (seg.get('co2') or 0) + (next_train_seg.get('co2') or 0),
-                    'subSegments': [seg, next_train_seg],
-                    'waitTime': wait_time, # Store calc wait time here
-                    'detail': f"Change at {seg.get('to', 'Station')}", # Helpful detail
-                    # Inherit other props from first segment
-                    'path': (seg.get('path') or []) + (next_train_seg.get('path') or [])
-                }
+        j = train_next[i]
+        if j >= 0:
+            next_train_seg = segments[j]
+            accumulated_wait = segments[i + 1]['time'] if j == i + 2 else 0
+            grouped.append(Segment({
+                'mode': 'train_group',
+                'label': seg['label'],
+                'lineColor': seg['lineColor'],
+                'iconId': seg['iconId'],
+                'time': seg['time'] + next_train_seg['time'], # wait time is added separately by the frontend
+                'cost': seg['cost'] + next_train_seg['cost'],
+                'distance': (seg.get('distance') or 0) + (next_train_seg.get('distance') or 0),
+                'co2': (seg.get('co2') or 0) + (next_train_seg.get('co2') or 0),
+                'subSegments': [seg, next_train_seg],
+                'waitTime': next_train_seg.get('waitTime', 0) + accumulated_wait,
+                'detail': f"Change at {seg.get('to', 'Station')}",
+                'path': PathView([seg.get('path'), next_train_seg.get('path')])
+            }))
+            i = j + 1
+            continue
+
+        if kinds[i][2]:
+            # [Walk/Wait, ..., Ride, Walk/Wait, ...] unless the ride starts a train merge
+            k = run_end[i]
+            if k < n and kinds[k][3] and train_next[k] < 0:
+                end_idx = run_end[k + 1]
+                group_list = segments[i:end_idx]
+                main_seg = segments[k]
+
+                group_seg = Segment({
+                    'mode': 'access_group',
+                    'label': main_seg['label'],
+                    'lineColor': main_seg['lineColor'],
+                    'iconId': main_seg['iconId'],
+                    'time': sum(s['time'] + s.get('waitTime', 0) for s in group_list),
+                    'cost': sum(s['cost'] for s in group_list),
+                    'distance': sum(s.get('distance', 0) for s in group_list),
+                    'co2': sum(s.get('co2', 0) for s in group_list),
+                    'subSegments': group_list,
+                    'path': PathView([s.get('path') for s in group_list])
+                })
+                if 'detail' in main_seg: group_seg['detail'] = main_seg['detail']
 
                 grouped.append(group_seg)
-                i = look_ahead_idx + 1 # Skip consumed segments
+                i = end_idx
                 continue
 
-        # --- Access Merge Logic ---
-        # Group [Walk/Wait, ..., Ride]
-        def is_walk_or_wait(s):
-            if s['mode'] == 'wait' and s.get('label') != 'Transfer': return True
-            if s['mode'] == 'walk' or s['iconId'] == ICON_IDS['footprints']: return True
-            return False
-
-        def is_ride(s):
-            if is_walk_or_wait(s): return False
-            if s['mode'] == 'wait' and s.get('label') == 'Transfer': return False
-            return True
-
-        if is_walk_or_wait(seg):
-            # Start of potential group
-            k = i + 1
-            while k < len(segments) and is_walk_or_wait(segments[k]):
-                k += 1
-
-            if k < len(segments):
-                next_seg = segments[k]
-                if is_ride(next_seg):
-                    # Check for Train Merge Conflict
-                    # If ride is Train, check if it would trigger a Train Merge (Train -> Train)
-                    # If so, do NOT access merge.
-                    prevent_merge = False
-                    if next_seg['iconId'] == ICON_IDS['train']:
-                        # Quick look ahead from k
-                        t_idx = k + 1
-                        if t_idx < len(segments):
-                            c_seg = segments[t_idx]
-                            if is_transfer(c_seg):
-                                t_idx += 1
-                                if t_idx < len(segments):
-                                    c_seg = segments[t_idx]
-                                else:
-                                    c_seg = None
-
-                            if c_seg and c_seg['iconId'] == ICON_IDS['train']:
-                                prevent_merge = True
-
-                    if not prevent_merge:
-                        # Proceed with Access Merge
-                        # Scan for trailing walks
-                        end_idx = k + 1
-                        while end_idx < len(segments) and is_walk_or_wait(segments[end_idx]):
-                            end_idx += 1
-
-                        group_list = segments[i:end_idx]
-
-                        total_time = sum([s['time'] + s.get('waitTime', 0) for s in group_list])
-                        total_cost = sum([s['cost'] for s in group_list])
-                        total_dist = sum([s.get('distance', 0) for s in group_list])
-                        total_co2 = sum([s.get('co2', 0) for s in group_list])
-
-                        # Main Segment is the Ride (next_seg)
-                        main_seg = next_seg
-
-                        group_seg = {
-                            'mode': 'access_group',
-                            'label': main_seg['label'],
-                            'lineColor': main_seg['lineColor'],
-                            'iconId': main_seg['iconId'],
-                            'time': total_time,
-                            'cost': total_cost,
-                            'distance': total_dist,
-                            'co2': total_co2,
-                            'subSegments': group_list,
-                            # Path is tricky - maybe concat all?
-                            'path': [pt for s in group_list if s.get('path') for pt in s['path']]
-                        }
-
-                        # Pass through details from main segment
-                        if 'detail' in main_seg: group_seg['detail'] = main_seg['detail']
-
-                        grouped.append(group_seg)
-                        i = end_idx
-                        continue
-
-        # Default: Add single segment
         grouped.append(seg)
         i += 1
 
     return grouped
 
-def parse_option_to_leg(option, group_name, route_id):
+# --- Build Instrumentation ---
+# Optional per-stage counters for parse_option_to_leg and the file-level
+# build steps: wall time, net allocated blocks (sys.getallocatedblocks) and
+# segment counts in and out of each pass, per stage and per option.
+
+class Instrumentation:
+    def __init__(self):
+        self.stages = {}
+        self.options = []
+        self.counters = {}
+
+    def add_stage(self, name, seconds, blocks, segments_in=0, segments_out=0):
+        stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'allocatedBlocks': 0,
+                                              'segmentsIn': 0, 'segmentsOut': 0})
+        stage['calls'] += 1
+        stage['seconds'] += seconds
+        stage['allocatedBlocks'] += blocks
+        stage['segmentsIn'] += segments_in
+        stage['segmentsOut'] += segments_out
+
+    def add_option(self, option_stats):
+        self.options.append(option_stats)
+        for name, stage in option_stats['stages'].items():
+            self.add_stage(name, stage['seconds'], stage['allocatedBlocks'],
+                           stage['segmentsIn'], stage['segmentsOut'])
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def measure(self, name):
+        return _StageBlock(self, name)
+
+    def to_dict(self):
+        return {'stages': self.stages, 'counters': self.counters, 'options': self.options}
+
+class _StageBlock:
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation.add_stage(self.name, time.perf_counter() - self.start,
+                                       sys.getallocatedblocks() - self.blocks)
+
+class _StageTimer:
+    def __init__(self, instrumentation, group_name, option_name, segments_in):
+        self.instrumentation = instrumentation
+        self.option = {'option': option_name, 'group': group_name, 'stages': {}}
+        self.segments_in = segments_in
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+
+    def mark(self, stage, segments):
+        now = time.perf_counter()
+        blocks = sys.getallocatedblocks()
+        self.option['stages'][stage] = {
+            'seconds': now - self.start,
+            'allocatedBlocks': blocks - self.blocks,
+            'segmentsIn': self.segments_in,
+            'segmentsOut': len(segments)
+        }
+        self.segments_in = len(segments)
+        # Restart after the bookkeeping so it is not charged to the next stage
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+
+    def finish(self):
+        # Records whichever stages ran, also when the option failed part way
+        self.instrumentation.add_option(self.option)
+
+class _NullTimer:
+    def mark(self, stage, segments):
+        pass
+
+    def finish(self):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+def measure_stage(instrumentation, name):
+    if instrumentation is None:
+        return contextlib.nullcontext()
+    return instrumentation.measure(name)
+
+def stage_timer(instrumentation, group_name, option_name, segments_in):
+    if instrumentation is None:
+        return _NULL_TIMER
+    return _StageTimer(instrumentation, group_name, option_name, segments_in)
+
+def format_prometheus(reports):
+    metrics = [
+        ('route_stage_seconds_total', 'Wall time spent in each build stage', 'seconds', 'counter'),
+        ('route_stage_calls_total', 'Times each build stage ran', 'calls', 'counter'),
+        # Net block counts go down when a stage frees more than it allocates
+        ('route_stage_allocated_blocks', 'Net allocated blocks after each build stage', 'allocatedBlocks', 'gauge'),
+        ('route_stage_segments_in_total', 'Segments entering each parse stage', 'segmentsIn', 'counter'),
+        ('route_stage_segments_out_total', 'Segments leaving each parse stage', 'segmentsOut', 'counter'),
+    ]
+    lines = []
+    for metric, help_text, key, metric_type in metrics:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for report in reports:
+            for stage, stats in report.get('instrumentation', {}).get('stages', {}).items():
+                lines.append(f'{metric}{{file="{report["input"]}",stage="{stage}"}} {stats[key]}')
+
+    lines.append('# HELP route_build_counter_total Build counters (decode bytes, polylines, legs, journeys)')
+    lines.append('# TYPE route_build_counter_total counter')
+    for report in reports:
+        for name, value in report.get('instrumentation', {}).get('counters', {}).items():
+            lines.append(f'route_build_counter_total{{file="{report["input"]}",counter="{name}"}} {value}')
+
+    lines.append('# HELP route_build_seconds Wall time of each file build')
+    lines.append('# TYPE route_build_seconds gauge')
+    for report in reports:
+        lines.append(f'route_build_seconds{{file="{report["input"]}"}} {report["seconds"]}')
+    return '\n'.join(lines) + '\n'
+
+def format_stage_summary(report):
+    lines = [f"{report['input']}:"]
+    for stage, stats in report['instrumentation']['stages'].items():
+        lines.append(f"  {stage:<20} {stats['seconds'] * 1000:9.2f} ms  {stats['calls']:5d} calls  "
+                     f"{stats['segmentsIn']:6d} -> {stats['segmentsOut']:6d} segments  "
+                     f"{stats['allocatedBlocks']:+9d} blocks")
+    for name, value in report['instrumentation']['counters'].items():
+        lines.append(f"  {name:<20} {value}")
+    return '\n'.join(lines)
+
+def parse_option_to_leg(option, group_name, route_id, paths=None, instrumentation=None):
+    timer = stage_timer(instrumentation, group_name, option.get('name', 'Unknown'),
+                        len(option.get('legs', [])))
+    try:
+        return build_option_leg(option, group_name, route_id, paths, timer)
+    finally:
+        timer.finish()
+
+def build_option_leg(option, group_name, route_id, paths, timer):
     name = option.get('name', 'Unknown')
     json_legs = option.get('legs', [])
 
     raw_segments = []
     for json_leg in json_legs:
-        raw_segments.append(parse_segment(json_leg, name, route_id))
+        raw_segments.append(parse_segment(json_leg, name, route_id, paths))
+
+    timer.mark('parse_segments', raw_segments)
 
     # --- Routes Parser Filtering (Short walks <= 1 min) ---
     filtered_segments = []
@@ -506,6 +562,8 @@ def parse_option_to_leg(option, group_name, route_id):
             continue
         filtered_segments.append(seg)
 
+    timer.mark('filter_short_walks', filtered_segments)
+
     # --- Routes Parser Merging (Consecutive same mode) ---
     merged_segments = []
     for seg in filtered_segments:
@@ -516,31 +574,20 @@ def parse_option_to_leg(option, group_name, route_id):
                 continue
         merged_segments.append(seg)
 
+    timer.mark('merge_same_mode', merged_segments)
+
     # --- Location detection for Pricing ---
     location = None
     for seg in merged_segments:
         if seg['mode'] == 'train' and seg.get('from'):
-            parts = seg['from'].lower().split(' ')
-            loc = parts[0]
-            if 'eastrington' in seg['from'].lower(): loc = 'eastrington'
-            location = loc
+            # Priced hubs can be anywhere in the station name, otherwise its first word
+            location = RULES.price_hub(seg['from']) or seg['from'].lower().split(' ')[0]
             break
 
     if not location:
-        lower_name = name.lower()
-        if 'brough' in lower_name: location = 'brough'
-        elif 'york' in lower_name: location = 'york'
-        elif 'beverley' in lower_name: location = 'beverley'
-        elif 'hull' in lower_name: location = 'hull'
-        elif 'eastrington' in lower_name: location = 'eastrington'
+        location = RULES.price_hub(name) or RULES.price_hub(group_name)
 
-    if not location:
-        lower_group = group_name.lower()
-        if 'brough' in lower_group: location = 'brough'
-        elif 'york' in lower_group: location = 'york'
-        elif 'beverley' in lower_group: location = 'beverley'
-        elif 'hull' in lower_group: location = 'hull'
-        elif 'eastrington' in lower_group: location = 'eastrington'
+    timer.mark('detect_location', merged_segments)
 
     # --- Routes Parser: Insert Parking Segment ---
     # We want to PRE-MERGE parking into car if possible, or insert it if it's a separate step?
@@ -566,9 +613,9 @@ def parse_option_to_leg(option, group_name, route_id):
             if connects_to_train:
                 is_uber = 'uber' in current['label'].lower()
                 if not is_uber:
-                    parking_cost = 5.00
+                    parking_cost = RULES.default_parking
                     if location and location in PRICING:
-                        parking_cost = PRICING[location].get('parking', 5.00)
+                        parking_cost = PRICING[location].get('parking', RULES.default_parking)
 
                     # Merge cost into car segment directly
                     current['cost'] += parking_cost
@@ -577,8 +624,11 @@ def parse_option_to_leg(option, group_name, route_id):
 
     merged_segments = final_segments_step1
 
-    # --- Routes Parser: Transfer Buffer for Route 2 ---
-    if route_id == 'route2' and 'Access Options' in group_name and 'train' in name.lower():
+    timer.mark('insert_parking', merged_segments)
+
+    # --- Routes Parser: Transfer Buffer (transferBuffer rules) ---
+    transfer_rule = RULES.route_rule(route_id, 'transferBuffer', name, group_name)
+    if transfer_rule:
         # Inject wait time into the previous segment or next segment?
         # Routes parser inserts a 'wait' segment.
         # DetailPage displays "10 mins transfer".
@@ -591,17 +641,19 @@ def parse_option_to_leg(option, group_name, route_id):
                 break
 
         if train_index != -1:
-            merged_segments.insert(train_index, {
+            merged_segments.insert(train_index, Segment({
                 'mode': 'wait',
                 'label': 'Transfer',
                 'lineColor': '#000000',
                 'iconId': 'clock',
-                'time': 10,
+                'time': transfer_rule['minutes'],
                 'detail': 'Transfer Buffer',
                 'cost': 0.0,
                 'distance': 0.0,
                 'co2': 0.0
-            })
+            }))
+
+    timer.mark('transfer_buffer', merged_segments)
 
     # --- Routes Parser: Apply Specific Pricing ---
     if location and location in PRICING:
@@ -617,76 +669,14 @@ def parse_option_to_leg(option, group_name, route_id):
                 seg['cost'] = 0.0 if uber_cost_applied else prices['uber']
                 uber_cost_applied = True
 
+    timer.mark('apply_pricing', merged_segments)
+
     # --- Routes Parser: Logic Overrides (St Chads, etc) ---
-    if route_id == 'route1':
-        # Drive to Leeds -> Add Parking £23
-        if 'Group 1' in group_name and 'drive' in name.lower():
-             # Find car segment and add cost
-             for seg in merged_segments:
-                 if seg['mode'] == 'car':
-                     seg['cost'] += 23.00
-                     # No parking segment added
-
-        if 'uber' in name.lower() and 'Group 1' in group_name:
-             for seg in merged_segments:
-                 if seg['mode'] == 'car' or 'uber' in seg['label'].lower():
-                     seg['cost'] = 8.97
-                     break
-
-        if 'Walk' in name and 'Train' in name:
-            train_applied = False
-            for seg in merged_segments:
-                if seg['mode'] == 'train':
-                    seg['cost'] = 0.0 if train_applied else 3.40
-                    train_applied = True
-
-        if 'Uber' in name and 'Train' in name:
-            uber_applied = False
-            train_applied = False
-            for seg in merged_segments:
-                if seg['mode'] == 'car' or 'uber' in seg['label']:
-                    seg['cost'] = 0.0 if uber_applied else 5.92
-                    uber_applied = True
-                elif seg['mode'] == 'train':
-                    seg['cost'] = 0.0 if train_applied else 3.40
-                    train_applied = True
-
-        if 'bus' in name.lower():
-            for seg in merged_segments:
-                if seg['mode'] == 'bus':
-                    seg['cost'] = get_bus_cost(seg['label'])
-
-        if 'Group 3' in group_name:
-            train_applied = False
-            for seg in merged_segments:
-                if seg['mode'] == 'train':
-                    seg['cost'] = 0.0 if train_applied else 25.70
-                    train_applied = True
-
-        if 'Group 4' in group_name:
-            if 'bus' in name.lower():
-                for seg in merged_segments:
-                    if seg['mode'] == 'bus':
-                        seg['cost'] = get_bus_cost(seg['label'])
-            if 'uber' in name.lower():
-                uber_applied = False
-                for seg in merged_segments:
-                    if seg['mode'] == 'car' or 'uber' in seg['label']:
-                        seg['cost'] = 0.0 if uber_applied else 14.89
-                        uber_applied = True
-
-    # --- Routes Parser: P&R Logic (Route 2) ---
-    if route_id == 'route2' and ('park & ride' in name.lower() or 'p&r' in name.lower()):
-        # Originally adds parking segment if missing.
-        # But we are merging parking cost into car.
-        # Is there a car segment?
-        car_segments = [s for s in merged_segments if s['mode'] == 'car']
-        if car_segments:
-            # P&R cost is 5.00 + 0.45*dist (handled in estimate_cost but also here?)
-            # The parking segment in original logic had cost 0.00 here?
-            # "mergedSegments.insert(..., Segment(..., cost: 0.00))"
-            # So no extra cost to add.
-            pass
+    # Per-route cost overrides from the rules file
+    # P&R parking is already merged into the car cost above, with no extra charge
+    apply_route_overrides(route_id, group_name, name, merged_segments)
+
+    timer.mark('route_overrides', merged_segments)
 
     # --- DetailPage: Filter out 4 mins walk between trains ---
     # Logic: if isWalk && seg.time <= 5 && prevIsTrain && nextIsTrain -> Remove and Add time to next train (as waitTime?)
@@ -738,6 +728,8 @@ def parse_option_to_leg(option, group_name, route_id):
 
     merged_segments = final_segments_step2
 
+    timer.mark('hide_walks', merged_segments)
+
     # --- Recalculate totals ---
     final_dist = 0
     final_time = 0
@@ -761,6 +753,8 @@ def parse_option_to_leg(option, group_name, route_id):
     icon_id = map_icon_id(name, merged_segments)
     line_color = map_line_color(name, merged_segments)
 
+    timer.mark('totals', merged_segments)
+
     # --- Enrich Data (Colors, Desc, Recommended) - Moved Up to Populate Segments ---
     color = None
     bg_color = None
@@ -850,28 +844,20 @@ def parse_option_to_leg(option, group_name, route_id):
             # Maybe don't overwrite existing detail?
             pass
 
-    # --- Apply Grouping ---
-    # Only group if not truncated (Route 2 Access)
-    should_group = True
-    if route_id == 'route2' and 'Access Options' in group_name:
-        # Check truncation logic later, but grouping might still be valid for what remains?
-        # Actually Route 2 Access options logic filters segments.
-        # Let's keep grouping.
-        pass
+    timer.mark('enrichment', merged_segments)
 
+    # --- Apply Grouping ---
+    # Also for options whose detail is truncated below
     merged_segments = group_segments(merged_segments, {'platform': platform, 'next_bus': next_bus_in})
+    timer.mark('grouping', merged_segments)
 
-    # Generate Detail (Truncated for Route 2 Access Options)
+    # Generate Detail (truncated at the first segment in one of the detailStops modes)
     detail_segments = merged_segments
-    if route_id == 'route2' and 'Access Options' in group_name:
+    stop_rule = RULES.route_rule(route_id, 'detailStops', name, group_name)
+    if stop_rule:
         filtered = []
-        is_pr = 'p&r' in name.lower() or 'park & ride' in name.lower()
         for seg in merged_segments:
-            if seg['mode'] == 'train':
-                break
-            if seg['mode'] == 'wait':
-                break
-            if is_pr and seg['mode'] == 'bus':
+            if seg['mode'] in stop_rule['modes']:
                 break
             filtered.append(seg)
         if filtered:
@@ -879,33 +865,24 @@ def parse_option_to_leg(option, group_name, route_id):
 
     detail = generate_detail(detail_segments)
 
-    # Standardise Labels
+    # Standardise Labels (first matching labels rule)
     final_label = name
-    if route_id == 'route1':
-        # Only rename First Mile options (Group 1)
-        if 'Group 1' in group_name:
-             if 'Drive' in name:
-                 final_label = 'Drive & Park to Leeds'
-                 id_val = 'drive_park' # Override ID to match frontend expectation
-             elif any(x in name for x in ['Bus', 'Cycle', 'Uber']):
-                 # Simplify label if it contains "to Leeds Station"
-                 final_label = name.replace(' Station', '')
-                 if 'to Leeds' not in final_label:
-                     final_label = f'{final_label} to Leeds'
-
-    elif route_id == 'route2':
-        final_label = name.replace(' + Train', '')
-        if 'p&r' in final_label.lower() or 'park & ride' in final_label.lower():
-             # Ensure "Via Leeds" is displayed by appending " to Leeds" if implied
-             # Assuming input is like "Drive to Stourton P&R" or "Drive via Stourton P&R"
-             # If we want "Via Leeds", anchor must be "Leeds".
-             # So label should be "... to Leeds".
-             # Replace " to " with " via " if needed to preserve P&R info before destination
-             if ' to ' in final_label:
-                 final_label = final_label.replace(' to ', ' via ')
-             final_label = f'{final_label} to Leeds'
-
-    return {
+    label_rule = RULES.route_rule(route_id, 'labels', name, group_name)
+    if label_rule:
+        if 'label' in label_rule:
+            final_label = label_rule['label']
+        for old, new in label_rule.get('replace', []):
+            final_label = final_label.replace(old, new)
+        # e.g. ' to Leeds', unless the label already names it
+        suffix = label_rule.get('suffix')
+        if suffix and suffix.strip() not in final_label:
+            final_label += suffix
+        # Some options are addressed by a fixed ID in the frontend
+        id_val = label_rule.get('id', id_val)
+
+    timer.mark('labels', merged_segments)
+
+    return Leg({
         'id': id_val,
         'label': final_label,
         'detail': detail,
@@ -925,7 +902,7 @@ def parse_option_to_leg(option, group_name, route_id):
         'waitTime': wait_time,
         'nextBusIn': next_bus_in,
         'platform': platform
-    }
+    })
 
 def create_journey(l1, main_leg, l3, direct_drive, buffer):
     cost = l1['cost'] + main_leg['cost'] + l3['cost']
@@ -951,7 +928,7 @@ def create_journey(l1, main_leg, l3, direct_drive, buffer):
         'text': f"Saves {savings_percent}% CO₂ vs driving" if savings > 0 else None
     }
 
-    return {
+    return Journey({
         'id': f"{l1['id']}-{l3['id']}",
         'leg1': l1,
         'leg3': l3,
@@ -960,35 +937,31 @@ def create_journey(l1, main_leg, l3, direct_drive, buffer):
         'buffer': buffer,
         'risk': risk,
         'emissions': emissions_data
-    }
+    })
 
-def generate_journeys(first_mile, main_leg, last_mile, direct_drive, route_id):
-    journeys = []
-    buffer_time = 0 if route_id == 'route2' else 10
+def journey_pairs(first_mile, last_mile, route_id):
+    # Lazily yields the (l1, l3) combinations that become journeys, in output order
+    empty_leg3 = None
 
     for l1 in first_mile:
-        # Route 2 P&R Check
-        is_route2_pnr = False
-        if route_id == 'route2':
-             label = l1.get('label', '')
-             if 'P&R' in label or 'Stourton' in label or 'Temple Green' in label or 'Elland Road' in label:
-                 is_route2_pnr = True
-
-        if is_route2_pnr:
-            empty_leg3 = {
-               'id': 'empty_last_mile',
-               'label': 'Arrived',
-               'segments': [],
-               'time': 0,
-               'cost': 0,
-               'distance': 0,
-               'riskScore': 0,
-               'iconId': 'footprints',
-               'lineColor': '#000000',
-               'co2': 0
-            }
-            # Create journey
-            journeys.append(create_journey(l1, main_leg, empty_leg3, direct_drive, buffer_time))
+        # Park & ride legs (parkAndRide rules, on the leg label) end at the destination
+        is_park_and_ride = bool(RULES.route_rules(route_id, 'parkAndRide', l1.get('label', '')))
+
+        if is_park_and_ride:
+            if empty_leg3 is None:
+                empty_leg3 = Leg({
+                   'id': 'empty_last_mile',
+                   'label': 'Arrived',
+                   'segments': [],
+                   'time': 0,
+                   'cost': 0,
+                   'distance': 0,
+                   'riskScore': 0,
+                   'iconId': 'footprints',
+                   'lineColor': '#000000',
+                   'co2': 0
+                })
+            yield l1, empty_leg3
             continue
 
         for l3 in last_mile:
@@ -1002,73 +975,294 @@ def generate_journeys(first_mile, main_leg, last_mile, direct_drive, route_id):
                  if not (is_cycle_start or is_drive_park or is_headingley_cycle):
                      continue
 
-             journeys.append(create_journey(l1, main_leg, l3, direct_drive, buffer_time))
+             yield l1, l3
 
-    return journeys
+# --- Bounded Journey Selection ---
+# 'pareto' keeps only journeys not dominated on (time, cost, risk, co2);
+# 'topk' keeps the k best by weighted score. Both work from the per-leg
+# totals and only materialize the survivors with create_journey.
 
-def process_file(input_path, output_path, route_id):
-    with open(input_path, 'r') as f:
-        data = json.load(f)
+JOURNEY_MODES = ['all', 'pareto', 'topk']
 
-    groups = data.get('groups', [])
+# Mirrors the client's smart score (cost + 0.3 * time + 20 * risk), plus CO2 in kg
+SCORE_WEIGHTS = {'time': 0.3, 'cost': 1.0, 'risk': 20.0, 'co2': 1.0}
 
-    first_mile = []
-    main_leg = None
-    last_mile = []
-    direct_drive = None
-    mock_path = []
+def journey_metrics(l1, main_leg, l3, buffer):
+    return (
+        l1['time'] + buffer + main_leg['time'] + l3['time'],
+        l1['cost'] + main_leg['cost'] + l3['cost'],
+        l1['riskScore'] + main_leg['riskScore'] + l3['riskScore'],
+        l1.get('co2', 0) + main_leg.get('co2', 0) + l3.get('co2', 0)
+    )
 
+def dominates(a, b):
+    return all(x <= y for x, y in zip(a, b)) and a != b
+
+def pareto_pairs(pairs, main_leg, buffer):
+    front = []  # (metrics, index, l1, l3)
+    for index, (l1, l3) in enumerate(pairs):
+        metrics = journey_metrics(l1, main_leg, l3, buffer)
+        if any(dominates(kept[0], metrics) for kept in front):
+            continue
+        front = [kept for kept in front if not dominates(metrics, kept[0])]
+        front.append((metrics, index, l1, l3))
+    return [(l1, l3) for _, _, l1, l3 in sorted(front, key=lambda kept: kept[1])]
+
+def top_k_pairs(pairs, main_leg, buffer, k, weights=None):
+    weights = weights or SCORE_WEIGHTS
+
+    def score(item):
+        index, (l1, l3) = item
+        time, cost, risk, co2 = journey_metrics(l1, main_leg, l3, buffer)
+        total = (weights['time'] * time + weights['cost'] * cost +
+                 weights['risk'] * risk + weights['co2'] * co2)
+        return (total, index)
+
+    best = heapq.nsmallest(k, enumerate(pairs), key=score)
+    return [pair for _, pair in sorted(best, key=lambda item: item[0])]
+
+def generate_journeys(first_mile, main_leg, last_mile, direct_drive, route_id,
+                      journey_mode='all', top_k=10, weights=None):
+    return list(iter_journeys(first_mile, main_leg, last_mile, direct_drive, route_id,
+                              journey_mode, top_k, weights))
+
+def iter_journeys(first_mile, main_leg, last_mile, direct_drive, route_id,
+                  journey_mode='all', top_k=10, weights=None):
+    # Journeys are created one at a time as they are consumed
+    buffer_time = RULES.journey_buffer(route_id)
+
+    pairs = journey_pairs(first_mile, last_mile, route_id)
+    if journey_mode == 'pareto':
+        pairs = pareto_pairs(pairs, main_leg, buffer_time)
+    elif journey_mode == 'topk':
+        pairs = top_k_pairs(pairs, main_leg, buffer_time, top_k, weights)
+
+    for l1, l3 in pairs:
+        yield create_journey(l1, main_leg, l3, direct_drive, buffer_time)
+
+def count_items(items, report, key):
+    # Passes items through, keeping report[key] at the number seen so far
+    report[key] = 0
+    for item in items:
+        report[key] += 1
+        yield item
+
+# --- Incremental Build Cache ---
+# parse_option_to_leg results are stored on disk, one file per option, keyed
+# by a hash of the option's raw JSON, its group, the route id and the rules
+# version (a hash of route_rules.json and the modules that parse legs).
+# Unchanged options are loaded instead of re-decoded and re-parsed; journeys
+# are rebuilt from the legs every run.
+
+# Modules whose code decides what a parsed leg holds
+LEG_MODULES = [route_model, route_polyline, route_rules]
+
+def rules_version():
+    digest = hashlib.sha256()
+    for path in [__file__, RULES_PATH] + [module.__file__ for module in LEG_MODULES]:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+RULES_VERSION = rules_version()
+
+def option_cache_key(option, group_name, route_id):
+    payload = json.dumps([RULES_VERSION, route_id, group_name, option], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def load_cached_leg(cache_dir, key):
+    try:
+        with open(os.path.join(cache_dir, f'{key}.json'), 'r') as f:
+            return leg_from_json(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+def store_cached_leg(cache_dir, key, leg):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f'{key}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(leg, f, separators=(',', ':'), default=to_json)
+    os.replace(path + '.tmp', path)
+
+def leg_options(groups):
+    # (group name, option) for every option that becomes a leg, in build order
     for group in groups:
         name = group.get('name', '')
         options = group.get('options', [])
+        if 'Group 1' in name or 'Group 2' in name or 'Group 4' in name:
+            for option in options:
+                yield name, option
+        elif 'Group 3' in name and options:
+            yield name, options[0]
+
+def parse_option_job(job):
+    # Worker entry point for per-option parallelism: decodes its own polylines
+    # and returns the option's stage stats alongside the leg when instrumented
+    option, group_name, route_id, instrument = job
+    paths = decode_path_batch(option_polylines([option]))
+    instrumentation = Instrumentation() if instrument else None
+    leg = parse_option_to_leg(option, group_name, route_id, paths, instrumentation)
+    return leg, instrumentation.options[0] if instrument else None
+
+def group_options(groups):
+    # (group name, option index, option) for in-memory data, like iter_route_options
+    for group in groups:
+        name = group.get('name', '')
+        for index, option in enumerate(group.get('options', [])):
+            yield name, index, option
+
+def parse_direct_drive(option):
+    # Direct Drive logic from Routes Parser
+    paths = decode_path_batch(option_polylines([option]))
+    total_duration_seconds = 0
+    total_dist_meters = 0
+    full_path = []
+
+    for leg in option.get('legs', []):
+        total_duration_seconds += leg.get('duration_value', 0)
+        total_dist_meters += leg.get('distance_value', 0)
+        poly = leg.get('polyline', '')
+        if poly:
+            full_path.append(lookup_path(poly, paths))
+
+    total_dist_miles = total_dist_meters / 1609.34
+
+    # Estimate cost
+    # _estimateCost('Direct Drive', ...) -> 0.45 * distance
+    cost = 0.45 * total_dist_miles
+
+    direct_drive = {
+        'time': round(total_duration_seconds / 60),
+        'cost': cost,
+        'distance': float(f"{total_dist_miles:.2f}"),
+        'co2': calculate_emission(total_dist_miles, ICON_IDS['car'])
+    }
+    return direct_drive, PackedPath.concat(full_path)
+
+def build_init_data(data, route_id, **options):
+    return build_init_data_stream(group_options(data.get('groups', [])), route_id, **options)
+
+def build_init_data_stream(options, route_id, cache_dir=None, report=None, executor=None,
+                           journey_mode='all', top_k=10, instrumentation=None, lazy_journeys=False,
+                           leg_cache=None):
+    # options yields (group name, option index, option) in file order and may be
+    # a streaming reader: each option is handled as it arrives, so with an
+    # executor workers start parsing while the rest of the file is being read.
+    # leg_cache is an in-memory dict of parsed options by cache key, kept
+    # between builds by watch mode; entries not used by this build are dropped
+    if report is None:
+        report = {}
+    report['cacheHits'] = 0
+    report['cacheMisses'] = 0
+    submitted = []  # (future, cache key) in option order
+    used_keys = set()
+
+    def store_leg(key, leg):
+        if key and leg_cache is not None:
+            leg_cache[key] = leg
+        if key and cache_dir:
+            store_cached_leg(cache_dir, key, leg)
+
+    def count_polylines(option):
+        if instrumentation is not None:
+            polylines = option_polylines([option])
+            instrumentation.count('polylines', len(polylines))
+            instrumentation.count('decodeBytes', sum(len(p) for p in polylines))
+
+    def start_leg(option, name):
+        # The parsed leg, or a future for it when parsing in worker processes
+        key = None
+        if cache_dir or leg_cache is not None:
+            key = option_cache_key(option, name, route_id)
+            used_keys.add(key)
+            with measure_stage(instrumentation, 'cache_lookup'):
+                leg = leg_cache.get(key) if leg_cache is not None else None
+                if leg is None and cache_dir:
+                    leg = load_cached_leg(cache_dir, key)
+                    if leg is not None and leg_cache is not None:
+                        leg_cache[key] = leg
+            if leg is not None:
+                report['cacheHits'] += 1
+                return leg
+            report['cacheMisses'] += 1
+
+        count_polylines(option)
+        if executor is not None:
+            future = executor.submit(parse_option_job, (option, name, route_id, instrumentation is not None))
+            submitted.append((future, key))
+            return future
+
+        with measure_stage(instrumentation, 'decode'):
+            paths = decode_path_batch(option_polylines([option]))
+        leg = parse_option_to_leg(option, name, route_id, paths, instrumentation)
+        store_leg(key, leg)
+        return leg
+
+    first_mile = []
+    main_leg = None
+    last_mile = []
+    direct_drive = None
+    mock_path = PackedPath()
 
+    for name, index, option in options:
         if 'Group 1' in name or 'Group 2' in name:
-            for option in options:
-                first_mile.append(parse_option_to_leg(option, name, route_id))
+            first_mile.append(start_leg(option, name))
         elif 'Group 3' in name:
-            if options:
-                main_leg = parse_option_to_leg(options[0], name, route_id)
+            if index == 0:
+                main_leg = start_leg(option, name)
         elif 'Group 4' in name:
-            for option in options:
-                last_mile.append(parse_option_to_leg(option, name, route_id))
+            last_mile.append(start_leg(option, name))
         elif 'Group 5' in name:
-            if options:
-                # Direct Drive logic from Routes Parser
-                direct_option = options[0]
-                total_duration_seconds = 0
-                total_dist_meters = 0
-                full_path = []
-                legs = direct_option.get('legs', [])
-
-                for leg in legs:
-                    total_duration_seconds += leg.get('duration_value', 0)
-                    total_dist_meters += leg.get('distance_value', 0)
-                    poly = leg.get('polyline', '')
-                    if poly:
-                        full_path.extend(decode_polyline(poly))
-
-                total_dist_miles = total_dist_meters / 1609.34
-                mock_path = full_path
-
-                # Estimate cost
-                # _estimateCost('Direct Drive', ...) -> 0.45 * distance
-                cost = 0.45 * total_dist_miles
-
-                direct_drive = {
-                    'time': round(total_duration_seconds / 60),
-                    'cost': cost,
-                    'distance': float(f"{total_dist_miles:.2f}"),
-                    'co2': calculate_emission(total_dist_miles, ICON_IDS['car'])
-                }
+            if index == 0:
+                key = None
+                if leg_cache is not None:
+                    key = option_cache_key(option, name, route_id)
+                    used_keys.add(key)
+                if key in (leg_cache or {}):
+                    direct_drive, mock_path = leg_cache[key]
+                else:
+                    count_polylines(option)
+                    with measure_stage(instrumentation, 'decode'):
+                        direct_drive, mock_path = parse_direct_drive(option)
+                    if key:
+                        leg_cache[key] = (direct_drive, mock_path)
+
+    # Collect worker results in option order so the output is deterministic
+    if submitted:
+        parsed = {}
+        with measure_stage(instrumentation, 'parse_workers'):
+            for future, key in submitted:
+                leg, option_stats = future.result()
+                parsed[future] = leg
+                if option_stats:
+                    instrumentation.add_option(option_stats)
+                store_leg(key, leg)
+        first_mile = [parsed.get(leg, leg) for leg in first_mile]
+        main_leg = parsed.get(main_leg, main_leg)
+        last_mile = [parsed.get(leg, leg) for leg in last_mile]
+
+    if leg_cache is not None:
+        for key in set(leg_cache) - used_keys:
+            del leg_cache[key]
 
     if not main_leg:
-        main_leg = {'id': 'main_placeholder', 'label': 'Main', 'segments': [], 'time': 0, 'cost': 0, 'distance': 0, 'riskScore': 0, 'iconId': 'train', 'lineColor': '#000000', 'co2': 0}
+        main_leg = Leg({'id': 'main_placeholder', 'label': 'Main', 'segments': [], 'time': 0, 'cost': 0, 'distance': 0, 'riskScore': 0, 'iconId': 'train', 'lineColor': '#000000', 'co2': 0})
 
     if not direct_drive:
         direct_drive = {'time': 0, 'cost': 0, 'distance': 0, 'co2': 0}
 
     # Generate Journeys
-    journeys = generate_journeys(first_mile, main_leg, last_mile, direct_drive, route_id)
+    # With lazy_journeys they are left as a generator for the output writer and
+    # report['journeys'] counts up as it is consumed
+    report['legs'] = len(first_mile) + len(last_mile) + 1
+    if lazy_journeys:
+        journeys = count_items(iter_journeys(first_mile, main_leg, last_mile, direct_drive, route_id,
+                                             journey_mode=journey_mode, top_k=top_k), report, 'journeys')
+    else:
+        with measure_stage(instrumentation, 'generate_journeys'):
+            journeys = generate_journeys(first_mile, main_leg, last_mile, direct_drive, route_id,
+                                         journey_mode=journey_mode, top_k=top_k)
+        report['journeys'] = len(journeys)
 
     init_data = {
         'segmentOptions': {
@@ -1080,14 +1274,428 @@ def process_file(input_path, output_path, route_id):
         'mockPath': mock_path,
         'journeys': journeys
     }
+    return init_data
+
+# --- Level-of-Detail Simplification ---
+# Each segment path gets simplified copies in 'pathLod', one per tolerance
+# (metres, coarse to fine), next to the full-resolution 'path'. Grouped
+# segments concatenate the levels of their subSegments, like their paths.
+# The app does not read the levels; it always draws the full 'path'.
+
+DEFAULT_LOD_TOLERANCES = [100.0, 20.0]
+EARTH_RADIUS_M = 6371000.0
+
+def simplify_path(path, tolerance):
+    # Douglas-Peucker over an equirectangular projection around the first point
+    if len(path) < 3:
+        return list(path)
+
+    ky = EARTH_RADIUS_M * math.pi / 180
+    kx = ky * math.cos(math.radians(path[0][0]))
+    xs = [pt[1] * kx for pt in path]
+    ys = [pt[0] * ky for pt in path]
+    tolerance_sq = tolerance * tolerance
+
+    keep = [False] * len(path)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(path) - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        dx = xs[last] - xs[first]
+        dy = ys[last] - ys[first]
+        length_sq = dx * dx + dy * dy
+
+        max_dist_sq, index = 0.0, None
+        for i in range(first + 1, last):
+            px = xs[i] - xs[first]
+            py = ys[i] - ys[first]
+            if length_sq > 0:
+                t = max(0.0, min(1.0, (px * dx + py * dy) / length_sq))
+                px -= t * dx
+                py -= t * dy
+            dist_sq = px * px + py * py
+            if dist_sq > max_dist_sq:
+                max_dist_sq, index = dist_sq, i
+
+        if index is not None and max_dist_sq > tolerance_sq:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [pt for pt, kept in zip(path, keep) if kept]
+
+def path_lods(path, tolerances):
+    return [PackedPath.from_pairs(simplify_path(path, tolerance)) for tolerance in tolerances]
+
+def segment_path(seg, level=None):
+    # level indexes 'pathLod' (0 is coarsest); None or a missing level gives the full path
+    lods = seg.get('pathLod')
+    if level is None or not lods or level >= len(lods):
+        return seg.get('path')
+    return lods[level]
+
+def apply_path_lod(init_data, tolerances, lod_cache=None):
+    # lod_cache keeps the mock path's levels between watch mode builds
+    seen = set()
+
+    def lod_segment(seg):
+        # Legs kept warm by watch mode already carry their levels
+        if id(seg) in seen or 'pathLod' in seg:
+            return
+        seen.add(id(seg))
+
+        if 'subSegments' in seg:
+            for sub in seg['subSegments']:
+                lod_segment(sub)
+            seg['pathLod'] = [
+                PackedPath.concat([sub['pathLod'][level] for sub in seg['subSegments'] if sub.get('pathLod')])
+                for level in range(len(tolerances))
+            ]
+        elif 'path' in seg:
+            seg['pathLod'] = path_lods(seg['path'] or [], tolerances)
+
+    for leg in output_legs(init_data):
+        for seg in leg.get('segments', []):
+            lod_segment(seg)
+
+    init_data['lodTolerances'] = list(tolerances)
+    mock_path = init_data['mockPath']
+    entry = lod_cache.get('mockPath') if lod_cache is not None else None
+    if entry is not None and entry[0] is mock_path:
+        init_data['mockPathLod'] = entry[1]
+    else:
+        init_data['mockPathLod'] = path_lods(mock_path, tolerances)
+        if lod_cache is not None:
+            lod_cache['mockPath'] = (mock_path, init_data['mockPathLod'])
+    return init_data
+
+# --- Spatial Index ---
+# A grid index over path chunks and stops (route_spatial.py), stored in the
+# output as 'spatialIndex'. It is built from the full-resolution paths before
+# dedupe or encoding and refers to legs by output_legs() position.
+
+def add_spatial_index(init_data, cell_size=DEFAULT_CELL_SIZE):
+    init_data['spatialIndex'] = SpatialIndex.build(output_legs(init_data), cell_size).to_json()
+    return init_data
+
+# --- Streaming Output ---
+# The output document is written container by container (write_json_stream in
+# route_stream.py) and each leg or journey is encoded on its own, so journeys
+# are created, written and dropped one at a time. With indent=2 the bytes
+# match json.dump(..., indent=2); compact drops all whitespace.
+
+def process_file(input_path, output_path, route_id, dedupe=False, lod_tolerances=None,
+                 encode_paths=False, cache_dir=None, executor=None, journey_mode='all', top_k=10,
+                 instrument=False, compact=False, output_format='json', spatial_cell_size=None,
+                 journey_index=False, delta=False, leg_cache=None, fragments=None, lod_cache=None):
+    # output_format 'binary' writes the route_binary.py container (always by
+    # reference, paths as raw coordinates) instead of JSON; 'shards' writes an
+    # index JSON at output_path and per-leg shards beside it. leg_cache,
+    # fragments and lod_cache keep parsed options, their JSON text and the
+    # mock path levels in memory between calls (see WarmBuild). delta writes
+    # the build manifest and a delta from the previous build (inline JSON only)
+    if output_format == 'binary' and encode_paths:
+        raise ValueError('encode_paths only applies to JSON output')
+    if output_format == 'shards' and dedupe:
+        raise ValueError('dedupe does not apply to sharded output')
+    if delta and (output_format != 'json' or dedupe):
+        raise ValueError('delta only applies to inline JSON output')
+    start = time.perf_counter()
+    instrumentation = Instrumentation() if instrument else None
+
+    # The input is read incrementally and each option is handled as it is reached
+    report = {'input': input_path, 'output': output_path, 'routeId': route_id}
+    with open(input_path, 'r') as f:
+        init_data = build_init_data_stream(iter_route_options(f), route_id, cache_dir=cache_dir, report=report,
+                                           executor=executor, journey_mode=journey_mode, top_k=top_k,
+                                           instrumentation=instrumentation, lazy_journeys=True,
+                                           leg_cache=leg_cache)
+    if lod_tolerances:
+        with measure_stage(instrumentation, 'lod'):
+            init_data = apply_path_lod(init_data, lod_tolerances, lod_cache)
+    if spatial_cell_size:
+        with measure_stage(instrumentation, 'spatial_index'):
+            init_data = add_spatial_index(init_data, spatial_cell_size)
+    if journey_index:
+        with measure_stage(instrumentation, 'journey_index'):
+            init_data = add_journey_index(init_data)
+    if dedupe or output_format == 'binary':
+        with measure_stage(instrumentation, 'dedupe'):
+            init_data = build_ref_output(init_data)
+    if encode_paths:
+        with measure_stage(instrumentation, 'encode_paths'):
+            init_data = encode_output_paths(init_data)
+    if output_format == 'shards':
+        with measure_stage(instrumentation, 'shards'):
+            init_data = build_shard_output(init_data, output_path, compact=compact)
+    manifest = None
+    if delta:
+        with measure_stage(instrumentation, 'delta'):
+            manifest = prepare_build_delta(init_data, output_path)
+    if fragments is not None and output_format == 'json' and not (dedupe or encode_paths):
+        register_fragments(init_data, fragments)
+
+    # Journeys are generated while writing, so write_output includes them
+    with measure_stage(instrumentation, 'write_output'):
+        if output_format == 'binary':
+            write_route_binary(output_path, init_data)
+        else:
+            # Written beside the output and renamed over it, so a reader (the
+            # app reloading its assets, route_server.py) never sees half a file
+            tmp_path = output_path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    write_json_stream(f, init_data, compact=compact, default=to_json, fragments=fragments)
+                os.replace(tmp_path, output_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    if output_format == 'shards':
+        remove_stale_shards(init_data, output_path)
+    # Last, so a client that reads the manifest finds its output and deltas
+    if manifest is not None:
+        save_build_manifest(manifest, output_path)
+        report['build'] = manifest['build']
+        report['deltas'] = manifest['deltas']
+
+    report['seconds'] = time.perf_counter() - start
+    if instrumentation is not None:
+        instrumentation.count('legs', report['legs'])
+        instrumentation.count('journeys', report['journeys'])
+        report['instrumentation'] = instrumentation.to_dict()
+    return report
+
+# --- Watch Mode ---
+# A long-running build that keeps every file's parsed options in memory. When
+# an input changes only options whose content changed are parsed, decoded and
+# simplified again; journeys are regenerated from the warm legs, which is
+# arithmetic over a few hundred legs, and the output is replaced atomically.
+# Inputs are polled rather than watched with inotify so this needs nothing
+# beyond the standard library and behaves the same on every platform.
+
+class WarmBuild:
+    def __init__(self, input_path, output_path, route_id, **options):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.route_id = route_id
+        self.options = options
+        self.legs = {}  # option cache key -> parsed leg
+        self.fragments = {}  # id(value) -> (value, JSON text)
+        self.lods = {}
+
+    def build(self):
+        return process_file(self.input_path, self.output_path, self.route_id, leg_cache=self.legs,
+                            fragments=self.fragments, lod_cache=self.lods, **self.options)
+
+    def clear(self):
+        self.legs.clear()
+        self.fragments.clear()
+        self.lods.clear()
+
+def register_fragments(init_data, fragments):
+    # Keeps the rendered text of legs and the drive geometry that survived
+    # from the last build and drops the rest. Journeys are written as dicts so
+    # their legs are written as separate values and can use it too.
+    live = {}
+    values = output_legs(init_data) + [init_data[key] for key in ['directDrive', 'mockPath', 'mockPathLod']
+                                       if key in init_data]
+    for value in values:
+        entry = fragments.get(id(value))
+        live[id(value)] = entry if entry is not None and entry[0] is value else (value, None)
+    fragments.clear()
+    fragments.update(live)
+    init_data['journeys'] = (journey.to_json() for journey in init_data['journeys'])
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def reload_rules():
+    global RULES, PRICING, RULES_VERSION
+    # Nothing is replaced unless the new rules load completely
+    rules, version = load_rules(), rules_version()
+    RULES, PRICING, RULES_VERSION = rules, rules.pricing, version
+
+def watch_routes(entries, interval=0.25, **options):
+    # Builds every entry, then rebuilds entries whose input changed (all of
+    # them when route_rules.json changes) until interrupted. A change is acted
+    # on once the file has stopped changing for one interval, so an editor's
+    # partial save is not built. An input or rules file that still fails to
+    # load or build, whatever the error, is reported and the previous output
+    # (or rules) kept.
+    builds = [WarmBuild(*entry, **options) for entry in entries]
+    watched = {build.input_path: [build] for build in builds}
+    watched.setdefault(RULES_PATH, [])
+    stamps = {path: file_stamp(path) for path in watched}
+    pending = {}  # path -> stamp seen last poll
+
+    def run(targets):
+        for build in targets:
+            try:
+                report = build.build()
+            except Exception as e:
+                print(f"{build.input_path}: build failed, keeping previous output ({type(e).__name__}: {e})")
+                continue
+            print(f"{report['seconds'] * 1000:8.1f} ms  {report['cacheMisses']} parsed  "
+                  f"{report['cacheHits']} reused  {report['journeys']} journeys  -> {build.output_path}")
+
+    run(builds)
+    print(f"Watching {len(watched)} files (Ctrl+C to stop)...")
+    try:
+        while True:
+            time.sleep(interval)
+            changed = []
+            for path in watched:
+                stamp = file_stamp(path)
+                if stamp == stamps[path]:
+                    pending.pop(path, None)
+                elif pending.get(path) == stamp:
+                    del pending[path]
+                    stamps[path] = stamp
+                    changed.append(path)
+                else:
+                    pending[path] = stamp
+            targets = [build for path in changed for build in watched[path]]
+            if RULES_PATH in changed:
+                print(f"{RULES_PATH} changed, rebuilding everything")
+                try:
+                    reload_rules()
+                except Exception as e:
+                    # Inputs that changed at the same time are still rebuilt
+                    print(f"{RULES_PATH}: not reloaded, keeping previous rules ({type(e).__name__}: {e})")
+                else:
+                    for build in builds:
+                        build.clear()
+                    targets = builds
+            if targets:
+                run(targets)
+    except KeyboardInterrupt:
+        pass
+
+OUTPUT_FORMATS = ['json', 'binary', 'shards']
 
-    with open(output_path, 'w') as f:
-        json.dump(init_data, f, indent=2)
+ROUTE_FILES = [
+    ('client/assets/routes.json', 'client/assets/routes_clean.json', 'route1'),
+    ('client/assets/routes_2.json', 'client/assets/routes_2_clean.json', 'route2'),
+]
 
 def main():
+    parser = argparse.ArgumentParser(description='Process routes JSON into app assets.')
+    parser.add_argument('--check-decoder', action='store_true',
+                        help='compare the batch polyline decoder against the reference decoder and exit')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='write legs and paths once and refer to them by index')
+    parser.add_argument('--lod', nargs='?', const=','.join(str(t) for t in DEFAULT_LOD_TOLERANCES),
+                        metavar='TOLERANCES',
+                        help='add simplified path levels, comma separated tolerances in metres '
+                             f'(default {DEFAULT_LOD_TOLERANCES})')
+    parser.add_argument('--spatial-index', nargs='?', type=float, const=DEFAULT_CELL_SIZE, metavar='CELL_SIZE',
+                        help='add a grid index over paths and stops, cell size in degrees '
+                             f'(default {DEFAULT_CELL_SIZE})')
+    parser.add_argument('--journey-index', action='store_true',
+                        help='add precomputed journey orderings, ranks, mode masks and best-under-limit tables')
+    parser.add_argument('--delta', action='store_true',
+                        help='write a build manifest and a delta from the previous build beside each output')
+    parser.add_argument('--apply-deltas', nargs=2, metavar=('CACHED', 'MANIFEST'),
+                        help='bring a cached output up to the build in MANIFEST using its deltas and exit')
+    parser.add_argument('--encode-paths', action='store_true',
+                        help='write paths as encoded polyline strings')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='json',
+                        help='JSON assets, the binary container read by route_binary.py (written as .bin), '
+                             'or a JSON index with per-leg shards in <output>_shards/')
+    parser.add_argument('--compact', action='store_true',
+                        help='write output without indentation or spaces')
+    parser.add_argument('--cache', nargs='?', const='client/.route_cache', metavar='DIR',
+                        help='reuse parsed legs of unchanged options from DIR (default client/.route_cache)')
+    parser.add_argument('--journeys', choices=JOURNEY_MODES, default='all',
+                        help='all combinations, the Pareto front over time/cost/risk/CO2, or the top k by score')
+    parser.add_argument('--top-k', type=int, default=10,
+                        help='journeys kept with --journeys topk (default 10)')
+    parser.add_argument('--instrument', action='store_true',
+                        help='record per-stage timings and counters and print a summary per file')
+    parser.add_argument('--metrics-out', metavar='FILE',
+                        help='write instrumentation as Prometheus text (implies --instrument)')
+    parser.add_argument('--report-out', metavar='FILE',
+                        help='write the build reports, including per-option stage stats, as JSON')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='JSON list of {"input", "output", "routeId"} entries to build instead of the app routes')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='worker processes for building files in parallel (default: CPU count)')
+    parser.add_argument('--option-jobs', type=int, default=None,
+                        help='build files one at a time and parse their options across this many processes')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and rebuild outputs when an input or route_rules.json changes')
+    parser.add_argument('--watch-interval', type=float, default=0.25, metavar='SECONDS',
+                        help='how often --watch polls the inputs (default 0.25)')
+    args = parser.parse_args()
+
+    entries = load_manifest(args.manifest) if args.manifest else ROUTE_FILES
+    if args.format == 'binary':
+        if args.encode_paths:
+            parser.error('--encode-paths only applies to JSON output')
+        entries = [(i, os.path.splitext(o)[0] + '.bin', r) for i, o, r in entries]
+    if args.format == 'shards' and args.dedupe:
+        parser.error('--dedupe does not apply to sharded output')
+    if args.delta and (args.format != 'json' or args.dedupe):
+        parser.error('--delta only applies to inline JSON output')
+    if args.watch and args.encode_paths:
+        # Encoding rewrites the legs' paths in place, which the warm legs cannot survive
+        parser.error('--watch does not support --encode-paths')
+
+    if args.check_decoder:
+        for input_path, _, _ in entries:
+            with open(input_path, 'r') as f:
+                groups = json.load(f).get('groups', [])
+            mismatches = check_batch_decoder(collect_polylines(groups))
+            print(f"{input_path}: {len(mismatches)} mismatched polylines")
+        return
+
+    if args.apply_deltas:
+        cached_path, manifest_path = args.apply_deltas
+        applied = update_cached_output(cached_path, manifest_path, compact=args.compact)
+        if applied is None:
+            print(f"{cached_path}: no delta path to the current build, fetch the full output")
+        else:
+            print(f"{cached_path}: applied {applied} deltas")
+        return
+
+    lod_tolerances = None
+    if args.lod:
+        lod_tolerances = sorted((float(t) for t in args.lod.split(',')), reverse=True)
+
+    if args.watch:
+        watch_routes(entries, interval=args.watch_interval,
+                     dedupe=args.dedupe, lod_tolerances=lod_tolerances,
+                     spatial_cell_size=args.spatial_index, journey_index=args.journey_index,
+                     delta=args.delta, cache_dir=args.cache, compact=args.compact,
+                     output_format=args.format, journey_mode=args.journeys, top_k=args.top_k)
+        return
+
     print("Processing routes...")
-    process_file('client/assets/routes.json', 'client/assets/routes_clean.json', 'route1')
-    process_file('client/assets/routes_2.json', 'client/assets/routes_2_clean.json', 'route2')
+    reports = build_routes(process_file, entries, jobs=args.jobs, option_jobs=args.option_jobs,
+                           dedupe=args.dedupe, lod_tolerances=lod_tolerances,
+                           spatial_cell_size=args.spatial_index, journey_index=args.journey_index,
+                           delta=args.delta, encode_paths=args.encode_paths, cache_dir=args.cache, compact=args.compact,
+                           output_format=args.format,
+                           journey_mode=args.journeys, top_k=args.top_k,
+                           instrument=args.instrument or bool(args.metrics_out))
+    if args.cache:
+        for report in reports:
+            print(f"{report['input']}: {report['cacheHits']} cached legs, {report['cacheMisses']} rebuilt")
+    print(format_build_summary(reports))
+    if args.instrument:
+        for report in reports:
+            print(format_stage_summary(report))
+    if args.metrics_out:
+        with open(args.metrics_out, 'w') as f:
+            f.write(format_prometheus(reports))
+    if args.report_out:
+        with open(args.report_out, 'w') as f:
+            json.dump(reports, f, indent=2)
     print("Done.")
 
 if __name__ == '__main__':
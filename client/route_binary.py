@@ -0,0 +1,479 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Binary route asset container, written by process_routes.py --format binary.
+#
+# Layout (little-endian, every section 8-byte aligned):
+#
+#   header     magic 'RTEB', version u16, reserved u16, section count u32, pad u32
+#   directory  per section: name 4s, offset u64, byte size u64, item count u64
+#   STRO/STRD  string table: u32 offsets (count + 1) into UTF-8 data
+#   COOR       every path's lat, lng pairs as one contiguous f64 array
+#   PATH       u32 point offsets (count + 1) of each path in COOR
+#   REFS       u32 path indices referenced by segments (their 'pathRefs')
+#   SEGS       segment records; subSegments are stored as a contiguous range
+#   LEGS       leg records, each owning a range of SEGS
+#   JRNY       journey records pointing at LEGS by index
+#   META       JSON: segmentOptions leg indices, directDrive, mockPath and LOD refs
+#
+# Records are fixed-size structs: a u32 bitmask of which fields are present,
+# one column per schema field (strings are string table indices), the
+# structural columns and an 'extra' string holding any remaining keys as JSON.
+# Null strings, ints and bools use out-of-range sentinels; every float is a
+# valid value (NaN included), so null floats go to 'extra' instead.
+# RouteAsset reads the file through mmap and parses META on first use, so
+# opening only reads the header and directory; paths and record tables come
+# back as zero-copy memoryview/NumPy views.
+
+MAGIC = b'RTEB'
+# 2: null floats moved from a NaN column value to 'extra'
+VERSION = 2
+
+HEADER = struct.Struct('<4sHHII')
+SECTION = struct.Struct('<4sQQQ')
+
+NULL_STR = 0xFFFFFFFF
+NULL_INT = -0x80000000
+NULL_BOOL = -1
+
+KIND_FORMATS = {'str': 'I', 'int': 'i', 'float': 'd', 'bool': 'b'}
+
+SEGMENT_SCHEMA = [
+    ('mode', 'str'), ('label', 'str'), ('lineColor', 'str'), ('iconId', 'str'), ('time', 'int'),
+    ('distance', 'float'), ('co2', 'float'), ('from', 'str'), ('to', 'str'), ('cost', 'float'),
+    ('numStops', 'int'), ('waitTime', 'int'), ('detail', 'str'),
+]
+SEGMENT_LINKS = ['refFirst', 'refCount', 'subFirst', 'subCount']
+
+LEG_SCHEMA = [
+    ('id', 'str'), ('label', 'str'), ('detail', 'str'), ('time', 'int'), ('cost', 'float'),
+    ('distance', 'float'), ('riskScore', 'int'), ('riskReason', 'str'), ('iconId', 'str'),
+    ('lineColor', 'str'), ('co2', 'float'), ('color', 'str'), ('bgColor', 'str'), ('desc', 'str'),
+    ('recommended', 'bool'), ('waitTime', 'int'), ('nextBusIn', 'int'), ('platform', 'int'),
+]
+LEG_LINKS = ['segFirst', 'segCount']
+
+JOURNEY_SCHEMA = [
+    ('id', 'str'), ('cost', 'float'), ('time', 'int'), ('buffer', 'int'), ('risk', 'int'),
+    ('emissions.val', 'float'), ('emissions.percent', 'int'), ('emissions.text', 'str'),
+]
+JOURNEY_LINKS = ['leg1', 'leg3']
+
+# Flag bits above the schema bits: the segment had a path, the segment had
+# subSegments or the leg had a segments list
+HAS_PATH = 31
+HAS_CHILDREN = 30
+
+def record_struct(schema, links):
+    return struct.Struct('<I' + ''.join(KIND_FORMATS[kind] for _, kind in schema) + 'I' * len(links) + 'I')
+
+def record_dtype(schema, links):
+    # Packed NumPy dtype matching record_struct, for zero-copy column access
+    kinds = {'str': '<u4', 'int': '<i4', 'float': '<f8', 'bool': 'i1'}
+    fields = [('present', '<u4')] + [(key, kinds[kind]) for key, kind in schema]
+    return np.dtype(fields + [(link, '<u4') for link in links] + [('extra', '<u4')])
+
+SEGMENT_RECORD = record_struct(SEGMENT_SCHEMA, SEGMENT_LINKS)
+LEG_RECORD = record_struct(LEG_SCHEMA, LEG_LINKS)
+JOURNEY_RECORD = record_struct(JOURNEY_SCHEMA, JOURNEY_LINKS)
+
+def get_field(obj, key):
+    # Dotted keys reach into nested dicts ('emissions.val')
+    for part in key.split('.'):
+        if part not in obj:
+            return False, None
+        obj = obj[part]
+    return True, obj
+
+def fits(kind, value):
+    if value is None:
+        return kind != 'float'
+    if kind == 'str':
+        return isinstance(value, str)
+    if kind == 'bool':
+        return isinstance(value, bool)
+    if kind == 'int':
+        return isinstance(value, int) and not isinstance(value, bool) and NULL_INT < value < 0x80000000
+    return isinstance(value, float)
+
+# --- Writer ---
+
+class StringTable:
+    def __init__(self):
+        self.index = {}
+        self.data = bytearray()
+        self.offsets = array('I', [0])
+
+    def add(self, value):
+        if value is None:
+            return NULL_STR
+        if value not in self.index:
+            self.index[value] = len(self.offsets) - 1
+            self.data += value.encode('utf-8')
+            self.offsets.append(len(self.data))
+        return self.index[value]
+
+def little_endian(values):
+    # array -> bytes in file byte order
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+class RouteBinaryWriter:
+    def __init__(self):
+        self.strings = StringTable()
+        self.coords = array('d')
+        self.path_offsets = array('I', [0])
+        self.refs = array('I')
+        self.segments = []
+        self.legs = []
+        self.journeys = []
+
+    def add_path(self, path):
+        coords = getattr(path, 'coords', None)
+        if coords is None:
+            coords = array('d', [c for pt in path for c in pt])
+        self.coords.extend(coords)
+        self.path_offsets.append(len(self.coords) // 2)
+        return len(self.path_offsets) - 2
+
+    def pack(self, obj, schema, skip):
+        # (present bits, column values, extra) for one record
+        present = 0
+        values = []
+        stored = set()
+        for bit, (key, kind) in enumerate(schema):
+            found, value = get_field(obj, key)
+            if found and fits(kind, value):
+                present |= 1 << bit
+                stored.add(key)
+            else:
+                value = None  # missing, or kept in 'extra' when of another type
+            if kind == 'str':
+                values.append(self.strings.add(value))
+            elif kind == 'int':
+                values.append(NULL_INT if value is None else value)
+            elif kind == 'float':
+                # Not read back unless the present bit is set
+                values.append(float('nan') if value is None else value)
+            else:
+                values.append(NULL_BOOL if value is None else int(value))
+
+        extra = {}
+        for key, value in obj.items():
+            if key in skip or key in stored:
+                continue
+            if isinstance(value, dict):
+                # Parts of nested dicts not stored in dotted columns
+                value = {k: v for k, v in value.items() if f'{key}.{k}' not in stored} if value else value
+                if not value and obj[key]:
+                    continue
+            extra[key] = value
+        return present, values, extra
+
+    def add_segments(self, segments):
+        # Segments of one parent go to a contiguous range; returns (first, count)
+        first = len(self.segments)
+        self.segments.extend([None] * len(segments))
+        for i, seg in enumerate(segments):
+            present, values, extra = self.pack(seg, SEGMENT_SCHEMA, {'pathRefs', 'subSegments'})
+            refs = seg.get('pathRefs') or []
+            ref_first = len(self.refs)
+            self.refs.extend(refs)
+            if 'pathRefs' in seg:
+                present |= 1 << HAS_PATH
+            sub_first = sub_count = 0
+            if 'subSegments' in seg:
+                present |= 1 << HAS_CHILDREN
+                sub_first, sub_count = self.add_segments(seg['subSegments'])
+            self.segments[first + i] = (present, values, [ref_first, len(refs), sub_first, sub_count], extra)
+        return first, len(segments)
+
+    def add_leg(self, leg):
+        present, values, extra = self.pack(leg, LEG_SCHEMA, {'segments'})
+        seg_first = seg_count = 0
+        if 'segments' in leg:
+            present |= 1 << HAS_CHILDREN
+            seg_first, seg_count = self.add_segments(leg['segments'])
+        self.legs.append((present, values, [seg_first, seg_count], extra))
+
+    def add_journey(self, journey):
+        present, values, extra = self.pack(journey, JOURNEY_SCHEMA, {'leg1', 'leg3'})
+        self.journeys.append((present, values, [journey['leg1'], journey['leg3']], extra))
+
+    def encode_records(self, record, rows):
+        out = bytearray(record.size * len(rows))
+        for i, (present, values, links, extra) in enumerate(rows):
+            extra_ref = self.strings.add(json.dumps(extra, separators=(',', ':'))) if extra else NULL_STR
+            record.pack_into(out, i * record.size, present, *values, *links, extra_ref)
+        return bytes(out)
+
+    def write(self, f, ref_data):
+        # ref_data is build_ref_output() output: shared 'paths' and 'legs' tables
+        # and journeys pointing at legs by index
+        for path in ref_data['paths']:
+            self.add_path(path)
+        for leg in ref_data['legs']:
+            self.add_leg(leg)
+        for journey in ref_data['journeys']:
+            self.add_journey(journey)
+
+        meta = {key: value for key, value in ref_data.items()
+                if key not in ['format', 'paths', 'legs', 'journeys', 'mockPath', 'mockPathLod']}
+        meta['mockPath'] = self.add_path(ref_data['mockPath'])
+        if 'mockPathLod' in ref_data:
+            meta['mockPathLod'] = [self.add_path(p) for p in ref_data['mockPathLod']]
+        meta = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+
+        # Records first: their 'extra' JSON goes into the string table
+        segments = self.encode_records(SEGMENT_RECORD, self.segments)
+        legs = self.encode_records(LEG_RECORD, self.legs)
+        journeys = self.encode_records(JOURNEY_RECORD, self.journeys)
+        sections = [
+            (b'META', meta, len(meta)),
+            (b'STRO', little_endian(self.strings.offsets), len(self.strings.offsets) - 1),
+            (b'STRD', bytes(self.strings.data), len(self.strings.data)),
+            (b'COOR', little_endian(self.coords), len(self.coords) // 2),
+            (b'PATH', little_endian(self.path_offsets), len(self.path_offsets) - 1),
+            (b'REFS', little_endian(self.refs), len(self.refs)),
+            (b'SEGS', segments, len(self.segments)),
+            (b'LEGS', legs, len(self.legs)),
+            (b'JRNY', journeys, len(self.journeys)),
+        ]
+
+        position = HEADER.size + SECTION.size * len(sections)
+        offset = align(position)
+        directory = []
+        for name, data, count in sections:
+            directory.append((name, offset, len(data), count))
+            offset = align(offset + len(data))
+
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(sections), 0))
+        for entry in directory:
+            f.write(SECTION.pack(*entry))
+        for (_, data, _), (_, start, _, _) in zip(sections, directory):
+            f.write(b'\0' * (start - position))
+            f.write(data)
+            position = start + len(data)
+
+def align(offset, boundary=8):
+    return (offset + boundary - 1) // boundary * boundary
+
+def write_route_binary(output_path, ref_data):
+    with open(output_path + '.tmp', 'wb') as f:
+        RouteBinaryWriter().write(f, ref_data)
+    os.replace(output_path + '.tmp', output_path)
+
+# --- Reader ---
+
+class RouteAsset:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.buf)
+
+        magic, version, _, count, _ = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a route asset')
+        if version != VERSION:
+            raise ValueError(f'{path} has format version {version}, expected {VERSION}')
+        self.sections = {}
+        for i in range(count):
+            name, offset, size, items = SECTION.unpack_from(self.buf, HEADER.size + i * SECTION.size)
+            self.sections[name.decode('ascii')] = (offset, size, items)
+
+        self._meta = None
+        self.string_offsets = self.array('STRO', 'I', extra=1)
+        self.path_offsets = self.array('PATH', 'I', extra=1)
+        self.refs = self.array('REFS', 'I')
+        self.coords = self.array('COOR', 'd', items_scale=2)
+        self.strings = {}
+
+    def close(self):
+        # Views handed out by path(), path_array() and table() must be dropped first
+        for name in ['string_offsets', 'path_offsets', 'refs', 'coords', 'view']:
+            getattr(self, name).release()
+        self.buf.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = json.loads(bytes(self.section('META')).decode('utf-8'))
+        return self._meta
+
+    def section(self, name):
+        offset, size, _ = self.sections[name]
+        return self.view[offset:offset + size]
+
+    def array(self, name, fmt, extra=0, items_scale=1):
+        offset, _, items = self.sections[name]
+        size = struct.calcsize(fmt) * (items * items_scale + extra)
+        view = self.view[offset:offset + size]
+        if sys.byteorder == 'big':
+            values = array(fmt, view)
+            values.byteswap()
+            return memoryview(values)
+        return view.cast(fmt)
+
+    @property
+    def leg_count(self):
+        return self.sections['LEGS'][2]
+
+    @property
+    def journey_count(self):
+        return self.sections['JRNY'][2]
+
+    @property
+    def path_count(self):
+        return self.sections['PATH'][2]
+
+    def string(self, index):
+        if index == NULL_STR:
+            return None
+        value = self.strings.get(index)
+        if value is None:
+            data_offset = self.sections['STRD'][0]
+            start, end = self.string_offsets[index], self.string_offsets[index + 1]
+            value = bytes(self.view[data_offset + start:data_offset + end]).decode('utf-8')
+            self.strings[index] = value
+        return value
+
+    def path(self, index):
+        # Flat lat, lng doubles of one path; a zero-copy view into the file
+        start, end = self.path_offsets[index], self.path_offsets[index + 1]
+        return self.coords[2 * start:2 * end]
+
+    def path_array(self, index):
+        # (n, 2) NumPy view of one path, also zero-copy
+        if np is None:
+            raise RuntimeError('path_array needs NumPy')
+        return np.frombuffer(self.path(index), dtype='<f8').reshape(-1, 2)
+
+    def table(self, name):
+        # Structured NumPy view over a record section, e.g. table('JRNY')['cost']
+        if np is None:
+            raise RuntimeError('table needs NumPy')
+        schema, links = {'SEGS': (SEGMENT_SCHEMA, SEGMENT_LINKS), 'LEGS': (LEG_SCHEMA, LEG_LINKS),
+                         'JRNY': (JOURNEY_SCHEMA, JOURNEY_LINKS)}[name]
+        offset, _, items = self.sections[name]
+        return np.frombuffer(self.buf, dtype=record_dtype(schema, links), count=items, offset=offset)
+
+    def record(self, name, record, schema, index):
+        offset = self.sections[name][0] + index * record.size
+        fields = record.unpack_from(self.buf, offset)
+        present = fields[0]
+        out = {}
+        for bit, (key, kind) in enumerate(schema):
+            if not present >> bit & 1:
+                continue
+            value = fields[1 + bit]
+            if kind == 'str':
+                value = self.string(value)
+            elif kind == 'int':
+                value = None if value == NULL_INT else value
+            elif kind == 'bool':
+                value = None if value == NULL_BOOL else bool(value)
+            target = out
+            parts = key.split('.')
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+        links = fields[1 + len(schema):-1]
+        extra = self.string(fields[-1])
+        if extra:
+            for key, value in json.loads(extra).items():
+                if isinstance(value, dict) and isinstance(out.get(key), dict):
+                    out[key].update(value)
+                else:
+                    out[key] = value
+        return present, out, links
+
+    def leg(self, index, segments=True):
+        present, leg, (seg_first, seg_count) = self.record('LEGS', LEG_RECORD, LEG_SCHEMA, index)
+        if segments and present >> HAS_CHILDREN & 1:
+            leg['segments'] = [self.segment(seg_first + i) for i in range(seg_count)]
+        return leg
+
+    def segment(self, index):
+        present, seg, (ref_first, ref_count, sub_first, sub_count) = self.record(
+            'SEGS', SEGMENT_RECORD, SEGMENT_SCHEMA, index)
+        if present >> HAS_PATH & 1:
+            seg['pathRefs'] = list(self.refs[ref_first:ref_first + ref_count])
+        if present >> HAS_CHILDREN & 1:
+            seg['subSegments'] = [self.segment(sub_first + i) for i in range(sub_count)]
+        return seg
+
+    def journey(self, index):
+        _, journey, (leg1, leg3) = self.record('JRNY', JOURNEY_RECORD, JOURNEY_SCHEMA, index)
+        journey['leg1'] = leg1
+        journey['leg3'] = leg3
+        return journey
+
+    def path_points(self, index):
+        coords = self.path(index)
+        return [[coords[i], coords[i + 1]] for i in range(0, len(coords), 2)]
+
+    def resolve_segment(self, seg):
+        # Inline pathRefs/pathLodRefs as 'path'/'pathLod', like the app's resolveRouteRefs
+        if 'subSegments' in seg:
+            seg['subSegments'] = [self.resolve_segment(s) for s in seg['subSegments']]
+        if 'pathRefs' in seg:
+            seg['path'] = [pt for ref in seg.pop('pathRefs') for pt in self.path_points(ref)]
+        if 'pathLodRefs' in seg:
+            seg['pathLod'] = [[pt for ref in level for pt in self.path_points(ref)]
+                              for level in seg.pop('pathLodRefs')]
+        return seg
+
+    def to_init_data(self):
+        # The whole asset as the app's inline JSON shape (paths as coordinate pairs)
+        legs = []
+        for i in range(self.leg_count):
+            leg = self.leg(i)
+            if 'segments' in leg:
+                leg['segments'] = [self.resolve_segment(s) for s in leg['segments']]
+            legs.append(leg)
+
+        options = self.meta['segmentOptions']
+        init_data = {
+            'segmentOptions': {
+                'firstMile': [legs[i] for i in options['firstMile']],
+                'mainLeg': legs[options['mainLeg']],
+                'lastMile': [legs[i] for i in options['lastMile']],
+            },
+            'directDrive': self.meta['directDrive'],
+            'mockPath': self.path_points(self.meta['mockPath']),
+            'journeys': [],
+        }
+        for i in range(self.journey_count):
+            journey = self.journey(i)
+            journey['leg1'] = legs[journey['leg1']]
+            journey['leg3'] = legs[journey['leg3']]
+            init_data['journeys'].append(journey)
+        if 'lodTolerances' in self.meta:
+            init_data['lodTolerances'] = self.meta['lodTolerances']
+        for key in ['spatialIndex', 'journeyIndex']:
+            if key in self.meta:
+                init_data[key] = self.meta[key]
+        if 'mockPathLod' in self.meta:
+            init_data['mockPathLod'] = [self.path_points(i) for i in self.meta['mockPathLod']]
+        return init_data
+
+def open_route_asset(path):
+    return RouteAsset(path)
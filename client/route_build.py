@@ -0,0 +1,39 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+# Multi-route build driver for process_routes.py.
+#
+# A manifest is a JSON list of {"input", "output", "routeId"} entries. Files
+# are spread across a process pool (jobs), or, with option_jobs, built one at
+# a time with their options spread across the pool instead. Reports come back
+# in manifest order either way. build is the per-file build function
+# (process_routes.process_file), called as build(input, output, route_id,
+# **options), and must be importable by the worker processes.
+
+def load_manifest(manifest_path):
+    with open(manifest_path, 'r') as f:
+        entries = json.load(f)
+    return [(e['input'], e['output'], e['routeId']) for e in entries]
+
+def build_entry(job):
+    build, (input_path, output_path, route_id), options = job
+    return build(input_path, output_path, route_id, **options)
+
+def build_routes(build, entries, jobs=None, option_jobs=None, **options):
+    if option_jobs:
+        with ProcessPoolExecutor(max_workers=option_jobs) as executor:
+            return [build(*entry, executor=executor, **options) for entry in entries]
+
+    if jobs == 1 or len(entries) <= 1:
+        return [build(*entry, **options) for entry in entries]
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(build_entry, [(build, entry, options) for entry in entries]))
+
+def format_build_summary(reports):
+    lines = []
+    for report in reports:
+        lines.append(f"{report['seconds']:8.3f}s  {report['legs']:5d} legs  {report['journeys']:6d} journeys  "
+                     f"{report['input']} -> {report['output']}")
+    lines.append(f"{sum(r['seconds'] for r in reports):8.3f}s  total ({len(reports)} files)")
+    return '\n'.join(lines)
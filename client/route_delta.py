@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+
+from route_model import to_json
+from route_output import leg_keys
+
+# Build deltas for process_routes.py --delta.
+#
+# With --delta each build records a manifest beside the output
+# (<output>.manifest.json) holding a content hash for every leg, journey and
+# other top-level value, and a build id over all of them that is also written
+# into the output as 'build'. The next build that differs writes
+# <output>_deltas/<from>-<to>.json with only what changed, so a client holding
+# the previous output downloads kilobytes instead of the whole file:
+#   legs      added / changed (full legs) and removed, by leg key
+#   journeys  added / changed (legs as leg keys) and removed, by journey key,
+#             plus the new order when it is not the old one minus removals
+#             followed by additions
+#   values    added / changed and removed top-level values (mockPath, ...)
+#   segmentOptions  the new lists of leg keys, always (they are small)
+#   keys      the output's top-level key order
+# Leg ids are not unique, so legs use the leg_keys scheme: slot and position
+# ('firstMile/0', 'mainLeg', 'lastMile/2') and 'journey/<n>' for journey legs
+# outside the segment options (empty_last_mile). Journey ids repeat when leg
+# ids do, so later repeats of an id get '#1', '#2', ... as journey keys. The
+# manifest keeps the last DELTA_HISTORY deltas so clients a few builds behind
+# can chain them.
+
+DELTA_HISTORY = 10
+DELTA_STRUCTURE_KEYS = {'segmentOptions', 'journeys', 'build'}
+
+def content_hash(value):
+    text = json.dumps(value, separators=(',', ':'), default=to_json)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+def build_manifest_path(output_path):
+    return os.path.splitext(output_path)[0] + '.manifest.json'
+
+def delta_dir_for(output_path):
+    return os.path.splitext(output_path)[0] + '_deltas'
+
+def journey_keys(journeys):
+    # Journey ids, with '#<n>' added to the nth repeat of an id
+    seen = {}
+    keys = []
+    for journey in journeys:
+        n = seen.get(journey['id'], 0)
+        seen[journey['id']] = n + 1
+        keys.append(f"{journey['id']}#{n}" if n else journey['id'])
+    return keys
+
+def delta_legs(data):
+    # ({leg key: leg}, {journey key: (journey, (leg1 key, leg3 key))}) of an inline output
+    legs, journey_legs = leg_keys(data)
+    journeys = zip(journey_keys(data['journeys']), data['journeys'], journey_legs)
+    return legs, {key: (journey, keys) for key, journey, keys in journeys}
+
+def journey_summary(journey, leg_keys):
+    return dict(journey.items(), leg1=leg_keys[0], leg3=leg_keys[1])
+
+def delta_options(data):
+    options = data['segmentOptions']
+    return {
+        'firstMile': [f'firstMile/{i}' for i in range(len(options['firstMile']))],
+        'mainLeg': 'mainLeg',
+        'lastMile': [f'lastMile/{i}' for i in range(len(options['lastMile']))]
+    }
+
+def build_manifest(init_data):
+    legs, journeys = delta_legs(init_data)
+    manifest = {
+        'format': 'manifest',
+        'legs': {key: content_hash(leg) for key, leg in legs.items()},
+        'journeys': [[key, content_hash(journey_summary(*journey))] for key, journey in journeys.items()],
+        'values': {key: content_hash(value) for key, value in init_data.items()
+                   if key not in DELTA_STRUCTURE_KEYS},
+        'segmentOptions': delta_options(init_data)
+    }
+    manifest['build'] = content_hash(manifest)
+    return manifest
+
+def diff_tables(old, new, content):
+    # old and new map key -> hash; content(key) gives the new value
+    return {
+        'added': {key: content(key) for key in new if key not in old},
+        'changed': {key: content(key) for key in new if key in old and old[key] != new[key]},
+        'removed': [key for key in old if key not in new]
+    }
+
+def build_delta(previous, manifest, init_data):
+    legs, journeys = delta_legs(init_data)
+    old_journeys = dict(previous['journeys'])
+    new_journeys = dict(manifest['journeys'])
+
+    journey_diff = diff_tables(old_journeys, new_journeys,
+                               lambda key: journey_summary(*journeys[key]))
+    order = [key for key, _ in manifest['journeys']]
+    implied = [key for key, _ in previous['journeys'] if key in new_journeys] + list(journey_diff['added'])
+    if order != implied:
+        journey_diff['order'] = order
+
+    return {
+        'format': 'delta',
+        'from': previous['build'],
+        'to': manifest['build'],
+        'keys': list(init_data),
+        'segmentOptions': manifest['segmentOptions'],
+        'legs': diff_tables(previous['legs'], manifest['legs'], legs.__getitem__),
+        'journeys': journey_diff,
+        'values': diff_tables(previous['values'], manifest['values'], init_data.__getitem__)
+    }
+
+def load_build_manifest(output_path):
+    path = build_manifest_path(output_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def prepare_build_delta(init_data, output_path):
+    # Adds 'build' to init_data and writes the delta from the previous build;
+    # returns the manifest to save once the output is in place
+    init_data['journeys'] = list(init_data['journeys'])
+    manifest = build_manifest(init_data)
+    init_data['build'] = manifest['build']
+
+    previous = load_build_manifest(output_path)
+    deltas = previous.get('deltas', []) if previous is not None else []
+    if previous is not None and previous.get('build') != manifest['build']:
+        delta_dir = delta_dir_for(output_path)
+        os.makedirs(delta_dir, exist_ok=True)
+        name = f"{previous['build']}-{manifest['build']}.json"
+        path = os.path.join(delta_dir, name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(build_delta(previous, manifest, init_data), f, separators=(',', ':'), default=to_json)
+        os.replace(path + '.tmp', path)
+        # Relative to the manifest's directory, like shard references
+        deltas = deltas + [{'from': previous['build'], 'to': manifest['build'],
+                            'path': os.path.basename(delta_dir) + '/' + name, 'bytes': os.path.getsize(path)}]
+        deltas = deltas[-DELTA_HISTORY:]
+    manifest['deltas'] = deltas
+    manifest['output'] = os.path.basename(output_path)
+    return manifest
+
+def save_build_manifest(manifest, output_path):
+    # Deltas that dropped out of the history are removed
+    delta_dir = delta_dir_for(output_path)
+    if os.path.isdir(delta_dir):
+        kept = {os.path.basename(d['path']) for d in manifest['deltas']}
+        for name in os.listdir(delta_dir):
+            if name not in kept:
+                os.remove(os.path.join(delta_dir, name))
+    path = build_manifest_path(output_path)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+# --- Applying Deltas ---
+
+def apply_delta(data, delta):
+    # data is an output document as written (a cached copy of an earlier
+    # build); returns the document of the delta's build
+    if data.get('build') != delta['from']:
+        raise ValueError(f"Delta {delta['from']} -> {delta['to']} does not apply to build {data.get('build')}")
+
+    def patch(table, diff):
+        for key in diff['removed']:
+            del table[key]
+        table.update(diff['added'])
+        table.update(diff['changed'])
+        return table
+
+    legs, journey_legs = delta_legs(data)
+    patch(legs, delta['legs'])
+    journey_diff = delta['journeys']
+    removed = set(journey_diff['removed'])
+    order = journey_diff.get('order') or (
+        [key for key in journey_legs if key not in removed] + list(journey_diff['added']))
+    journeys = patch({key: journey_summary(*journey) for key, journey in journey_legs.items()}, journey_diff)
+    values = patch({key: value for key, value in data.items() if key not in DELTA_STRUCTURE_KEYS}, delta['values'])
+
+    options = delta['segmentOptions']
+    values['segmentOptions'] = {
+        'firstMile': [legs[key] for key in options['firstMile']],
+        'mainLeg': legs[options['mainLeg']],
+        'lastMile': [legs[key] for key in options['lastMile']]
+    }
+    values['journeys'] = [dict(journeys[key], leg1=legs[journeys[key]['leg1']], leg3=legs[journeys[key]['leg3']])
+                          for key in order]
+    values['build'] = delta['to']
+    return {key: values[key] for key in delta['keys']}
+
+def update_cached_output(cached_path, manifest_path, compact=False):
+    # Brings a cached copy of a build up to the manifest's build by applying
+    # its deltas in turn. Returns how many were applied, or None when the
+    # cached build is not covered by the delta history and the full output
+    # has to be fetched instead.
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    with open(cached_path, 'r') as f:
+        data = json.load(f)
+    deltas = {d['from']: d for d in manifest['deltas']}
+    applied = 0
+    while data.get('build') != manifest['build']:
+        entry = deltas.get(data.get('build'))
+        if entry is None or applied == len(deltas):
+            return None
+        with open(os.path.join(os.path.dirname(manifest_path), entry['path']), 'r') as f:
+            data = apply_delta(data, json.load(f))
+        applied += 1
+    if applied:
+        with open(cached_path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=None if compact else 2, separators=(',', ':') if compact else None)
+        os.replace(cached_path + '.tmp', cached_path)
+    return applied
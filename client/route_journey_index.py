@@ -0,0 +1,88 @@
+# Journey index for process_routes.py --journey-index.
+#
+# Precomputed orderings of the journeys, stored in the output as
+# 'journeyIndex', so a client switching sort tabs or limits reads an index
+# instead of sorting. All entries refer to journeys by output position:
+#   order[key]    journey positions best first (stable, ties keep output order)
+#   rank[key]     each journey's place in order[key]
+#   modes         modes a journey can be filtered on; modeMasks[i] has bit b
+#                 set when journey i uses modes[b]
+#   buckets[m]    for each limit on metric m, how many journeys are within it
+#                 and the best one within it by each sort key ('best': {key:
+#                 [position or None per limit]}), e.g. the cheapest under 60 min
+
+# 'emissions' is lowest CO2 first: emissions.val is the CO2 saved against the
+# direct drive, which is the same for every journey, so the most saved is the
+# least emitted. 'smart' is the app's score without its minRisk offset, which
+# is the same for every journey and does not change the order
+JOURNEY_SORT_KEYS = {
+    'time': lambda j: j['time'],
+    'cost': lambda j: j['cost'],
+    'risk': lambda j: j['risk'],
+    'emissions': lambda j: -j['emissions']['val'],
+    'smart': lambda j: j['cost'] + j['time'] * 0.3 + j['risk'] * 20.0 + j['emissions']['val'],
+}
+
+JOURNEY_BUCKETS = {
+    'time': [30, 45, 60, 90, 120, 180],
+    'cost': [5, 10, 20, 40, 80],
+    'risk': [1, 2, 3, 5],
+}
+
+# Modes the app never filters on
+UNFILTERED_MODES = {'walk', 'wait'}
+
+def segment_modes(segments, modes):
+    for seg in segments:
+        if seg.get('subSegments'):
+            segment_modes(seg['subSegments'], modes)
+        elif seg['mode'] not in UNFILTERED_MODES:
+            modes.add(seg['mode'])
+    return modes
+
+def build_journey_index(init_data):
+    journeys = init_data['journeys']
+    positions = range(len(journeys))
+    index = {'order': {}, 'rank': {}}
+    for key, metric in JOURNEY_SORT_KEYS.items():
+        values = [metric(j) for j in journeys]
+        order = sorted(positions, key=values.__getitem__)
+        rank = [0] * len(order)
+        for place, i in enumerate(order):
+            rank[i] = place
+        index['order'][key] = order
+        index['rank'][key] = rank
+
+    # Legs are shared between journeys, so each leg's modes are found once
+    leg_modes = {}
+
+    def modes_of(leg):
+        if id(leg) not in leg_modes:
+            leg_modes[id(leg)] = segment_modes(leg.get('segments', []), set())
+        return leg_modes[id(leg)]
+
+    main_modes = modes_of(init_data['segmentOptions']['mainLeg'])
+    journey_modes = [main_modes | modes_of(j['leg1']) | modes_of(j['leg3']) for j in journeys]
+    modes = sorted(set().union(*journey_modes)) if journeys else sorted(main_modes)
+    bits = {mode: 1 << b for b, mode in enumerate(modes)}
+    index['modes'] = modes
+    index['modeMasks'] = [sum(bits[m] for m in used) for used in journey_modes]
+
+    index['buckets'] = {}
+    for metric, limits in JOURNEY_BUCKETS.items():
+        values = [JOURNEY_SORT_KEYS[metric](j) for j in journeys]
+        index['buckets'][metric] = {
+            'limits': limits,
+            'count': [sum(1 for v in values if v <= limit) for limit in limits],
+            'best': {
+                key: [next((i for i in order if values[i] <= limit), None) for limit in limits]
+                for key, order in index['order'].items()
+            }
+        }
+    return index
+
+def add_journey_index(init_data):
+    # Journeys are generated lazily; the index needs them all up front
+    init_data['journeys'] = list(init_data['journeys'])
+    init_data['journeyIndex'] = build_journey_index(init_data)
+    return init_data
@@ -0,0 +1,207 @@
+import keyword
+from array import array
+
+# Route model for process_routes.py.
+#
+# Segments, legs and journeys are slotted records instead of dicts, and
+# segment paths are PackedPath buffers (flat lat, lng doubles). Records keep
+# the dict-style access the pipeline passes use (seg['mode'], seg.get(...),
+# 'detail' in seg); an unset field behaves like a missing key. Fields are
+# kept in the order they were set, like dict keys, so the JSON written at the
+# output boundary through to_json has the same key order as the dicts did.
+
+class PackedPath:
+    __slots__ = ('coords',)
+
+    def __init__(self, coords=None):
+        self.coords = coords if coords is not None else array('d')
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        coords = array('d')
+        for lat, lng in pairs:
+            coords.append(lat)
+            coords.append(lng)
+        return cls(coords)
+
+    @classmethod
+    def concat(cls, paths):
+        coords = array('d')
+        for path in paths:
+            if not path:
+                continue
+            if isinstance(path, (PackedPath, PathView)):
+                coords.extend(path.coords)
+            else:
+                coords.extend(PackedPath.from_pairs(path).coords)
+        return cls(coords)
+
+    def __len__(self):
+        return len(self.coords) // 2
+
+    def __bool__(self):
+        return len(self.coords) > 0
+
+    def __iter__(self):
+        coords = self.coords
+        for i in range(0, len(coords), 2):
+            yield [coords[i], coords[i + 1]]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PackedPath.from_pairs(list(self)[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('PackedPath index out of range')
+        return [self.coords[2 * index], self.coords[2 * index + 1]]
+
+    def __add__(self, other):
+        return PackedPath.concat([self, other])
+
+    def __radd__(self, other):
+        return PackedPath.concat([other, self])
+
+    def __eq__(self, other):
+        if isinstance(other, PackedPath):
+            return self.coords == other.coords
+        return list(self) == list(other)
+
+    __hash__ = None
+
+    def to_json(self):
+        return list(self)
+
+class PathView:
+    # Read-only concatenation of several paths without copying their points;
+    # grouped segments use it for the combined path of their subSegments
+    __slots__ = ('parts',)
+
+    def __init__(self, parts):
+        self.parts = [part for part in parts if part]
+
+    @property
+    def coords(self):
+        return PackedPath.concat(self.parts).coords
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def __bool__(self):
+        return bool(self.parts)
+
+    def __iter__(self):
+        for part in self.parts:
+            yield from part
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PackedPath.concat(self.parts)[index]
+        if index < 0:
+            index += len(self)
+        for part in self.parts:
+            if index < len(part):
+                return part[index]
+            index -= len(part)
+        raise IndexError('PathView index out of range')
+
+    def __add__(self, other):
+        return PackedPath.concat([self, other])
+
+    def __radd__(self, other):
+        return PackedPath.concat([other, self])
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    __hash__ = None
+
+    def to_json(self):
+        return list(self)
+
+class _Record:
+    __slots__ = ('_keys',)
+    ATTRS = {}
+
+    def __init__(self, values=None):
+        self._keys = []
+        if values:
+            self.update(values)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self.ATTRS[key])
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        attr = self.ATTRS[key]
+        if not hasattr(self, attr):
+            self._keys.append(key)
+        setattr(self, attr, value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, self.ATTRS[key])
+        except AttributeError:
+            raise KeyError(key) from None
+        self._keys.remove(key)
+
+    def __contains__(self, key):
+        return key in self.ATTRS and hasattr(self, self.ATTRS[key])
+
+    def get(self, key, default=None):
+        return getattr(self, self.ATTRS[key], default) if key in self.ATTRS else default
+
+    def keys(self):
+        return list(self._keys)
+
+    def items(self):
+        return [(key, getattr(self, self.ATTRS[key])) for key in self.keys()]
+
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
+
+    def copy(self):
+        return type(self)(self)
+
+    def to_json(self):
+        return dict(self.items())
+
+def _record_class(name, fields):
+    # JSON keys that are Python keywords (e.g. 'from') get a trailing underscore
+    attrs = {key: f'{key}_' if keyword.iskeyword(key) else key for key in fields}
+    return type(name, (_Record,), {'__slots__': tuple(attrs.values()), 'ATTRS': attrs})
+
+Segment = _record_class('Segment', [
+    'mode', 'label', 'lineColor', 'iconId', 'time', 'path', 'distance', 'co2', 'from', 'to',
+    'cost', 'numStops', 'stops', 'stopPoints', 'waitTime', 'detail', 'subSegments', 'pathLod'
+])
+
+Leg = _record_class('Leg', [
+    'id', 'label', 'detail', 'time', 'cost', 'distance', 'riskScore', 'riskReason', 'iconId',
+    'lineColor', 'segments', 'co2', 'color', 'bgColor', 'desc', 'recommended', 'waitTime',
+    'nextBusIn', 'platform'
+])
+
+Journey = _record_class('Journey', ['id', 'leg1', 'leg3', 'cost', 'time', 'buffer', 'risk', 'emissions'])
+
+def segment_from_json(values):
+    seg = Segment(values)
+    if seg.get('path') is not None and not isinstance(seg['path'], str):
+        seg['path'] = PackedPath.from_pairs(seg['path'])
+    if 'subSegments' in seg:
+        seg['subSegments'] = [segment_from_json(sub) for sub in seg['subSegments']]
+    return seg
+
+def leg_from_json(values):
+    leg = Leg(values)
+    leg['segments'] = [segment_from_json(seg) for seg in leg.get('segments', [])]
+    return leg
+
+def to_json(obj):
+    # json.dump default hook for the route model
+    if isinstance(obj, (_Record, PackedPath, PathView)):
+        return obj.to_json()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
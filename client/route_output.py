@@ -0,0 +1,342 @@
+import hashlib
+import json
+import os
+
+from route_binary import open_route_asset
+from route_model import PackedPath, to_json
+from route_polyline import decode_polyline, encode_polyline
+from route_spatial import SpatialIndex
+
+# Output documents of process_routes.py: the reference-deduplicated and
+# sharded layouts, encoded paths, and reading any format back into the inline
+# layout. init_data is the inline document build_init_data returns, with legs
+# inside segmentOptions and journeys.
+
+def output_legs(init_data):
+    # Every journey leg is one of these or the segment-less empty_last_mile leg,
+    # so path passes never need to walk the (possibly lazy) journeys
+    segment_options = init_data['segmentOptions']
+    return segment_options['firstMile'] + [segment_options['mainLeg']] + segment_options['lastMile']
+
+def leg_keys(init_data):
+    # Leg ids repeat between first and last mile (and can within one), so legs
+    # are addressed by slot and position: 'firstMile/0', 'mainLeg',
+    # 'lastMile/2'. A journey leg is the first leg of its slot that it is, or
+    # equals (inline outputs hold copies); legs only journeys use
+    # (empty_last_mile) are 'journey/0', 'journey/1', ... in order of first use.
+    # Returns ({key: leg}, [(leg1 key, leg3 key) per journey]).
+    segment_options = init_data['segmentOptions']
+    keys = {'mainLeg': segment_options['mainLeg']}
+    slots = {'firstMile': [], 'lastMile': [], 'journey': []}
+    for slot in ['firstMile', 'lastMile']:
+        for i, leg in enumerate(segment_options[slot]):
+            keys[f'{slot}/{i}'] = leg
+            slots[slot].append((f'{slot}/{i}', leg))
+
+    def key_of(leg, slot):
+        for candidates in [slots[slot], slots['journey']]:
+            for key, other in candidates:
+                if other is leg:
+                    return key
+            for key, other in candidates:
+                if other.get('id') == leg.get('id') and other == leg:
+                    return key
+        key = f"journey/{len(slots['journey'])}"
+        keys[key] = leg
+        slots['journey'].append((key, leg))
+        return key
+
+    journey_keys = [(key_of(j['leg1'], 'firstMile'), key_of(j['leg3'], 'lastMile'))
+                    for j in init_data['journeys']]
+    return keys, journey_keys
+
+# --- Reference-Deduplicated Output ---
+# Journeys point at legs by index into a shared 'legs' table and segments point
+# at decoded paths by index into a shared 'paths' table ('pathRefs', whose
+# concatenation is the segment path). Grouped segments reuse the refs of their
+# subSegments, so each decoded polyline is written once.
+
+def build_ref_output(init_data):
+    paths = []
+    path_index = {}
+    legs = []
+    leg_index = {}
+
+    def intern_path(path):
+        key = path.coords.tobytes() if isinstance(path, PackedPath) else tuple(tuple(pt) for pt in path)
+        if key not in path_index:
+            path_index[key] = len(paths)
+            paths.append(path)
+        return path_index[key]
+
+    def ref_segment(seg):
+        out = {k: v for k, v in seg.items() if k not in ['path', 'pathLod', 'subSegments']}
+        if 'subSegments' in seg:
+            subs = [ref_segment(s) for s in seg['subSegments']]
+            out['subSegments'] = subs
+            out['pathRefs'] = [r for s in subs for r in s.get('pathRefs', [])]
+            if 'pathLod' in seg:
+                out['pathLodRefs'] = [
+                    [r for s in subs if 'pathLodRefs' in s for r in s['pathLodRefs'][level]]
+                    for level in range(len(seg['pathLod']))
+                ]
+        elif 'path' in seg:
+            out['pathRefs'] = [intern_path(seg['path'])] if seg['path'] else []
+            if 'pathLod' in seg:
+                out['pathLodRefs'] = [[intern_path(p)] if p else [] for p in seg['pathLod']]
+        return out
+
+    def ref_leg(leg):
+        if id(leg) not in leg_index:
+            leg_index[id(leg)] = len(legs)
+            out = dict(leg)
+            out['segments'] = [ref_segment(s) for s in leg.get('segments', [])]
+            legs.append(out)
+        return leg_index[id(leg)]
+
+    segment_options = init_data['segmentOptions']
+    ref_options = {
+        'firstMile': [ref_leg(l) for l in segment_options['firstMile']],
+        'mainLeg': ref_leg(segment_options['mainLeg']),
+        'lastMile': [ref_leg(l) for l in segment_options['lastMile']]
+    }
+
+    journeys = []
+    for journey in init_data['journeys']:
+        out = dict(journey)
+        out['leg1'] = ref_leg(journey['leg1'])
+        out['leg3'] = ref_leg(journey['leg3'])
+        journeys.append(out)
+
+    ref_data = {
+        'format': 'refs',
+        'paths': paths,
+        'legs': legs,
+        'segmentOptions': ref_options,
+        'directDrive': init_data['directDrive'],
+        'mockPath': init_data['mockPath'],
+        'journeys': journeys
+    }
+    for key in ['lodTolerances', 'mockPathLod', 'spatialIndex', 'journeyIndex']:
+        if key in init_data:
+            ref_data[key] = init_data[key]
+    return ref_data
+
+# --- Sharded Output ---
+# An index file with every leg's summary (no segments) and the journeys and
+# segmentOptions as leg indices, plus one shard file per leg holding its
+# segments and geometry. Shards are named by a hash of their content, so they
+# can be cached indefinitely and unchanged legs are not rewritten; shards no
+# longer referenced by the index are removed once the new index is in place.
+
+def shard_dir_for(output_path):
+    return os.path.splitext(output_path)[0] + '_shards'
+
+def write_shard(shard_dir, prefix, content, compact=False):
+    # Writes content to <prefix>-<hash>.json unless it exists, returns the file name
+    text = json.dumps(content, indent=None if compact else 2,
+                      separators=(',', ':') if compact else None, default=to_json)
+    name = f"{prefix}-{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}.json"
+    path = os.path.join(shard_dir, name)
+    if not os.path.exists(path):
+        with open(path + '.tmp', 'w') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+    return name
+
+def build_shard_output(init_data, output_path, compact=False):
+    shard_dir = shard_dir_for(output_path)
+    os.makedirs(shard_dir, exist_ok=True)
+    # Shard references are relative to the index file's directory
+    shard_prefix = os.path.basename(shard_dir) + '/'
+    legs = []
+    leg_index = {}
+
+    def shard(prefix, content):
+        return shard_prefix + write_shard(shard_dir, prefix, content, compact)
+
+    def shard_leg(leg):
+        if id(leg) not in leg_index:
+            leg_index[id(leg)] = len(legs)
+            summary = {k: v for k, v in leg.items() if k != 'segments'}
+            summary['shard'] = shard('leg', {'segments': leg.get('segments', [])})
+            legs.append(summary)
+        return leg_index[id(leg)]
+
+    segment_options = init_data['segmentOptions']
+    shard_options = {
+        'firstMile': [shard_leg(l) for l in segment_options['firstMile']],
+        'mainLeg': shard_leg(segment_options['mainLeg']),
+        'lastMile': [shard_leg(l) for l in segment_options['lastMile']]
+    }
+
+    journeys = []
+    for journey in init_data['journeys']:
+        out = dict(journey)
+        out['leg1'] = shard_leg(journey['leg1'])
+        out['leg3'] = shard_leg(journey['leg3'])
+        journeys.append(out)
+
+    geometry = {key: init_data[key] for key in ['mockPath', 'mockPathLod'] if key in init_data}
+    shard_data = {
+        'format': 'shards',
+        'legs': legs,
+        'segmentOptions': shard_options,
+        'directDrive': init_data['directDrive'],
+        'mockPathShard': shard('path', geometry),
+        'journeys': journeys
+    }
+    for key in ['lodTolerances', 'pathEncoding', 'spatialIndex', 'journeyIndex']:
+        if key in init_data:
+            shard_data[key] = init_data[key]
+    return shard_data
+
+def remove_stale_shards(shard_data, output_path):
+    # Run once the new index has replaced the old one, which may still point
+    # at these files until then
+    shard_dir = shard_dir_for(output_path)
+    referenced = {os.path.basename(leg['shard']) for leg in shard_data['legs']}
+    referenced.add(os.path.basename(shard_data['mockPathShard']))
+    for name in os.listdir(shard_dir):
+        if name not in referenced:
+            os.remove(os.path.join(shard_dir, name))
+
+# --- Encoded Path Output ---
+# Paths ('path', 'pathLod' levels, mockPath and the shared paths table in
+# --dedupe mode) are written as encoded polyline strings instead of
+# coordinate pairs. Merged and grouped paths are re-encoded from their points.
+
+def encode_output_paths(init_data):
+    if 'paths' in init_data:
+        init_data['paths'] = [encode_polyline(p) for p in init_data['paths']]
+    else:
+        seen = set()
+
+        def encode_segment(seg):
+            if id(seg) in seen:
+                return
+            seen.add(id(seg))
+            for sub in seg.get('subSegments', []):
+                encode_segment(sub)
+            if 'path' in seg:
+                seg['path'] = encode_polyline(seg['path'] or [])
+            if 'pathLod' in seg:
+                seg['pathLod'] = [encode_polyline(p) for p in seg['pathLod']]
+
+        for leg in output_legs(init_data):
+            for seg in leg.get('segments', []):
+                encode_segment(seg)
+
+    init_data['mockPath'] = encode_polyline(init_data['mockPath'])
+    if 'mockPathLod' in init_data:
+        init_data['mockPathLod'] = [encode_polyline(p) for p in init_data['mockPathLod']]
+    init_data['pathEncoding'] = 'polyline'
+    return init_data
+
+# --- Reading Processed Output ---
+# load_output reads any output format back into the inline shape (legs inside
+# segmentOptions and journeys, paths as coordinate pairs), for tools that
+# consume a finished build rather than routes.json.
+
+def decode_output_paths(data):
+    # Inverse of encode_output_paths
+    if data.pop('pathEncoding', None) != 'polyline':
+        return data
+
+    def decode(path):
+        return decode_polyline(path) if isinstance(path, str) else path
+
+    if 'paths' in data:
+        data['paths'] = [decode(p) for p in data['paths']]
+    else:
+        seen = set()
+
+        def decode_segment(seg):
+            if id(seg) in seen:
+                return
+            seen.add(id(seg))
+            for sub in seg.get('subSegments', []):
+                decode_segment(sub)
+            if 'path' in seg:
+                seg['path'] = decode(seg['path'])
+            if 'pathLod' in seg:
+                seg['pathLod'] = [decode(p) for p in seg['pathLod']]
+
+        legs = output_legs(data) + [j[key] for j in data['journeys'] for key in ['leg1', 'leg3']]
+        for leg in legs:
+            for seg in leg.get('segments', []):
+                decode_segment(seg)
+
+    data['mockPath'] = decode(data['mockPath'])
+    if 'mockPathLod' in data:
+        data['mockPathLod'] = [decode(p) for p in data['mockPathLod']]
+    return data
+
+def inline_legs(data, legs):
+    # Rebuilds the inline layout from a leg table and index-based references
+    options = data['segmentOptions']
+    init_data = {
+        'segmentOptions': {
+            'firstMile': [legs[i] for i in options['firstMile']],
+            'mainLeg': legs[options['mainLeg']],
+            'lastMile': [legs[i] for i in options['lastMile']]
+        },
+        'directDrive': data['directDrive'],
+        'mockPath': data.get('mockPath', []),
+        'journeys': [dict(j, leg1=legs[j['leg1']], leg3=legs[j['leg3']]) for j in data['journeys']]
+    }
+    for key in ['lodTolerances', 'mockPathLod', 'pathEncoding', 'spatialIndex', 'journeyIndex']:
+        if key in data:
+            init_data[key] = data[key]
+    return init_data
+
+def resolve_ref_output(ref_data):
+    paths = ref_data['paths']
+
+    def resolve_segment(seg):
+        seg = dict(seg)
+        if 'subSegments' in seg:
+            seg['subSegments'] = [resolve_segment(s) for s in seg['subSegments']]
+        if 'pathRefs' in seg:
+            seg['path'] = [pt for ref in seg.pop('pathRefs') for pt in paths[ref]]
+        if 'pathLodRefs' in seg:
+            seg['pathLod'] = [[pt for ref in level for pt in paths[ref]] for level in seg.pop('pathLodRefs')]
+        return seg
+
+    legs = [dict(leg, segments=[resolve_segment(s) for s in leg.get('segments', [])])
+            for leg in ref_data['legs']]
+    return inline_legs(ref_data, legs)
+
+def resolve_shard_output(shard_data, base_dir):
+    def read_shard(name):
+        with open(os.path.join(base_dir, name), 'r') as f:
+            return json.load(f)
+
+    legs = []
+    for leg in shard_data['legs']:
+        leg = dict(leg)
+        leg['segments'] = read_shard(leg.pop('shard'))['segments']
+        legs.append(leg)
+    init_data = inline_legs(shard_data, legs)
+    init_data.update(read_shard(shard_data['mockPathShard']))
+    return init_data
+
+def load_output(path):
+    if path.endswith('.bin'):
+        with open_route_asset(path) as asset:
+            return asset.to_init_data()
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if data.get('format') == 'shards':
+        data = resolve_shard_output(data, os.path.dirname(path))
+    data = decode_output_paths(data)
+    if data.get('format') == 'refs':
+        data = resolve_ref_output(data)
+    return data
+
+def load_spatial_index(path):
+    # The output's spatial index with exact path distances
+    init_data = load_output(path)
+    if 'spatialIndex' not in init_data:
+        raise ValueError(f"{path} has no spatial index (build with --spatial-index)")
+    return SpatialIndex(init_data['spatialIndex'], output_legs(init_data))
@@ -0,0 +1,159 @@
+from array import array
+
+from route_model import PackedPath
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Encoded polylines (Google's format, 5 decimal places) for process_routes.py.
+#
+# decode_polyline is the reference path. The batch decoder takes every
+# polyline of a routes file at once and returns flat coordinate buffers:
+# coords holds lat, lng, lat, lng, ... and the points of polylines[i] are
+# coords[2 * offsets[i]:2 * offsets[i + 1]]. It uses NumPy when it is
+# installed and a pure Python loop over array buffers otherwise.
+
+def decode_polyline(polyline_str):
+    index, lat, lng = 0, 0, 0
+    coordinates = []
+    changes = {'latitude': 0, 'longitude': 0}
+
+    while index < len(polyline_str):
+        for unit in ['latitude', 'longitude']:
+            shift, result = 0, 0
+
+            while True:
+                byte = ord(polyline_str[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if not byte >= 0x20:
+                    break
+
+            if (result & 1):
+                changes[unit] = ~(result >> 1)
+            else:
+                changes[unit] = (result >> 1)
+
+        lat += changes['latitude']
+        lng += changes['longitude']
+
+        coordinates.append([lat / 100000.0, lng / 100000.0])
+
+    return coordinates
+
+def _encode_value(value, chunks):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+def encode_polyline(path):
+    chunks = []
+    prev_lat, prev_lng = 0, 0
+    for lat, lng in path:
+        lat = int(round(lat * 100000))
+        lng = int(round(lng * 100000))
+        _encode_value(lat - prev_lat, chunks)
+        _encode_value(lng - prev_lng, chunks)
+        prev_lat, prev_lng = lat, lng
+    return ''.join(chunks)
+
+# --- Batch Decoding ---
+
+def decode_polylines(polylines):
+    if np is not None:
+        return _decode_polylines_numpy(polylines)
+    return _decode_polylines_array(polylines)
+
+def _decode_polylines_numpy(polylines):
+    encoded = [p.encode('ascii') for p in polylines]
+    byte_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=byte_offsets[1:])
+
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.int64) - 63
+    if data.size == 0:
+        return np.zeros(0), np.zeros(len(encoded) + 1, dtype=np.int64)
+
+    # Varint decode: a value ends on every byte without the continuation bit
+    end_idx = np.flatnonzero((data & 0x20) == 0)
+    start_idx = np.empty_like(end_idx)
+    start_idx[0] = 0
+    start_idx[1:] = end_idx[:-1] + 1
+    value_of_byte = np.repeat(np.arange(end_idx.size), end_idx - start_idx + 1)
+    shifts = 5 * (np.arange(data.size) - start_idx[value_of_byte])
+    values = np.add.reduceat((data & 0x1f) << shifts, start_idx)
+
+    # Zigzag decode, then split into (lat, lng) deltas
+    deltas = ((values >> 1) ^ -(values & 1)).reshape(-1, 2)
+
+    # Cumulative sum over everything, rebased at the start of each polyline
+    offsets = np.searchsorted(end_idx, byte_offsets) // 2
+    totals = np.cumsum(deltas, axis=0)
+    bases = np.zeros((len(encoded), 2), dtype=np.int64)
+    has_base = offsets[:-1] > 0
+    bases[has_base] = totals[offsets[:-1][has_base] - 1]
+    totals -= np.repeat(bases, np.diff(offsets), axis=0)
+
+    return (totals / 100000.0).ravel(), offsets
+
+def _decode_polylines_array(polylines):
+    coords = array('d')
+    offsets = array('q', [0])
+
+    for polyline_str in polylines:
+        lat, lng = 0, 0
+        shift, result = 0, 0
+        is_lng = False
+
+        for byte in polyline_str.encode('ascii'):
+            byte -= 63
+            result |= (byte & 0x1f) << shift
+            shift += 5
+            if byte < 0x20:
+                delta = ~(result >> 1) if result & 1 else result >> 1
+                if is_lng:
+                    lng += delta
+                    coords.append(lat / 100000.0)
+                    coords.append(lng / 100000.0)
+                else:
+                    lat += delta
+                is_lng = not is_lng
+                shift, result = 0, 0
+
+        offsets.append(len(coords) // 2)
+
+    return coords, offsets
+
+def decode_polyline_batch(polylines):
+    # Same output as decode_polyline, keyed by polyline string
+    unique = list(dict.fromkeys(polylines))
+    coords, offsets = decode_polylines(unique)
+    coords = coords.tolist()
+    offsets = offsets.tolist()
+
+    paths = {}
+    for i, polyline_str in enumerate(unique):
+        flat = coords[2 * offsets[i]:2 * offsets[i + 1]]
+        paths[polyline_str] = [flat[j:j + 2] for j in range(0, len(flat), 2)]
+    return paths
+
+def decode_path_batch(polylines):
+    # Batch decode into PackedPath buffers sliced straight from the coordinate buffer
+    unique = list(dict.fromkeys(polylines))
+    coords, offsets = decode_polylines(unique)
+    if not isinstance(coords, array):
+        packed = array('d')
+        packed.frombytes(coords.astype('float64').tobytes())
+        coords = packed
+    offsets = offsets.tolist()
+    return {polyline_str: PackedPath(coords[2 * offsets[i]:2 * offsets[i + 1]])
+            for i, polyline_str in enumerate(unique)}
+
+def check_batch_decoder(polylines):
+    # Compare the batch decoder against the reference decoder, returns mismatches
+    paths = decode_polyline_batch(polylines)
+    return [p for p in dict.fromkeys(polylines) if paths[p] != decode_polyline(p)]
@@ -0,0 +1,156 @@
+import re
+
+# Rule matching for route_rules.json.
+#
+# All keywords in the rules file are compiled into one Aho-Corasick automaton,
+# so a name is scanned once into a keyword bitmask. Each rule table then
+# resolves a (name mask, group mask) pair once and remembers the result.
+# process_routes.py loads the file and applies the rules it returns.
+
+class KeywordAutomaton:
+    def __init__(self, keywords):
+        # keywords: {keyword: bit}
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [0]
+        for word, bit in keywords.items():
+            node = 0
+            for ch in word:
+                if ch not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(0)
+                    self.goto[node][ch] = len(self.goto) - 1
+                node = self.goto[node][ch]
+            self.out[node] |= 1 << bit
+
+        queue = list(self.goto[0].values())
+        while queue:
+            node = queue.pop(0)
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                self.out[child] |= self.out[self.fail[child]]
+
+    def scan(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        node = mask = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            mask |= out[node]
+        return mask
+
+class RuleTable:
+    def __init__(self, rules, keyword_bit, hubs=None):
+        self.rules = [(self.compile_when(rule.get('when', {}), keyword_bit), rule) for rule in rules]
+        self.hubs = hubs or []
+        self.decisions = {}
+
+    @staticmethod
+    def compile_when(when, keyword_bit):
+        # {field: [keyword or [alternatives]]} -> {field: [mask, ...]}, each mask must be hit
+        compiled = {}
+        for field in ['name', 'group']:
+            compiled[field] = [
+                sum(1 << keyword_bit[word] for word in ([term] if isinstance(term, str) else term))
+                for term in when.get(field, [])
+            ]
+        compiled['hub'] = when.get('hub', False)
+        return compiled
+
+    def match(self, name_mask, group_mask=0):
+        key = (name_mask, group_mask)
+        if key not in self.decisions:
+            hub = next((word for word, bit in self.hubs if name_mask >> bit & 1), None)
+            self.decisions[key] = next(
+                ((rule, hub) for when, rule in self.rules
+                 if all(name_mask & m for m in when['name'])
+                 and all(group_mask & m for m in when['group'])
+                 and (hub or not when['hub'])),
+                (None, hub))
+        return self.decisions[key]
+
+    def match_all(self, name_mask, group_mask=0):
+        key = ('all', name_mask, group_mask)
+        if key not in self.decisions:
+            self.decisions[key] = [
+                rule for when, rule in self.rules
+                if all(name_mask & m for m in when['name']) and all(group_mask & m for m in when['group'])
+            ]
+        return self.decisions[key]
+
+# Rule tables under each entry of "routes" in route_rules.json
+ROUTE_TABLES = ['overrides', 'transferBuffer', 'detailStops', 'labels', 'parkAndRide']
+
+def rule_keywords(rules):
+    for rule in rules:
+        for field in ['name', 'group']:
+            for term in rule.get('when', {}).get(field, []):
+                yield from [term] if isinstance(term, str) else term
+
+class RouteRules:
+    def __init__(self, data):
+        self.data = data
+        self.pricing = data['pricing']
+        self.default_parking = data['defaultParking']
+        self.bus_fares = [(re.compile(r['pattern']), r['cost']) for r in data['busFares']['rules']]
+        self.default_bus_fare = data['busFares']['default']
+        self.bus_fare_cache = {}
+
+        routes = data.get('routes', {})
+        route_rules = [r for cfg in routes.values() for table in ROUTE_TABLES for r in cfg.get(table, [])]
+        all_rules = data['ids'] + data['risk'] + data['icons'] + route_rules
+        words = list(dict.fromkeys(list(rule_keywords(all_rules)) + data['idHubs'] + list(self.pricing)))
+        keyword_bit = {word: bit for bit, word in enumerate(words)}
+        self.keyword_bit = keyword_bit
+        self.lower_keywords = KeywordAutomaton({w: b for w, b in keyword_bit.items() if w == w.lower()})
+        self.exact_keywords = KeywordAutomaton({w: b for w, b in keyword_bit.items() if w != w.lower()})
+        self.masks = {}
+
+        self.ids = RuleTable(data['ids'], keyword_bit, [(h, keyword_bit[h]) for h in data['idHubs']])
+        self.risk = RuleTable(data['risk'], keyword_bit)
+        self.icons = RuleTable(data['icons'], keyword_bit)
+        self.route_tables = {
+            route: {table: RuleTable(cfg.get(table, []), keyword_bit) for table in ROUTE_TABLES}
+            for route, cfg in routes.items()
+        }
+        self.journey_buffers = {route: cfg.get('journeyBuffer', data['journeyBuffer']) for route, cfg in routes.items()}
+        self.default_journey_buffer = data['journeyBuffer']
+        self.price_hubs = [(h, keyword_bit[h]) for h in self.pricing]
+
+    def mask(self, text):
+        mask = self.masks.get(text)
+        if mask is None:
+            mask = self.lower_keywords.scan(text.lower()) | self.exact_keywords.scan(text)
+            self.masks[text] = mask
+        return mask
+
+    def route_rules(self, route_id, table, name, group_name=''):
+        # Every matching rule of a per-route table, in file order
+        tables = self.route_tables.get(route_id)
+        if not tables:
+            return []
+        return tables[table].match_all(self.mask(name), self.mask(group_name))
+
+    def route_rule(self, route_id, table, name, group_name=''):
+        return next(iter(self.route_rules(route_id, table, name, group_name)), None)
+
+    def journey_buffer(self, route_id):
+        return self.journey_buffers.get(route_id, self.default_journey_buffer)
+
+    def price_hub(self, text):
+        mask = self.mask(text)
+        return next((hub for hub, bit in self.price_hubs if mask >> bit & 1), None)
+
+    def bus_fare(self, label):
+        fare = self.bus_fare_cache.get(label)
+        if fare is None:
+            lower = label.lower()
+            fare = next((cost for pattern, cost in self.bus_fares if pattern.search(lower)), self.default_bus_fare)
+            self.bus_fare_cache[label] = fare
+        return fare
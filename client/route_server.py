@@ -0,0 +1,336 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import process_routes as pr
+from route_build import load_manifest
+from route_journey_index import JOURNEY_SORT_KEYS, segment_modes
+from route_output import leg_keys, load_output
+
+# Local journey query service over processed routes.
+#
+# Each route's processed output (any process_routes.py format) is loaded once
+# at startup. Journey searches are filtered by excluded modes and limits,
+# sorted by one metric and paged. Response bodies are cached in an LRU keyed
+# by the normalised query, along with their gzip encoding and ETag, so a
+# repeated query costs a dictionary lookup. Clients that send If-None-Match
+# get a 304.
+#
+#   GET /health
+#   GET /api/routes
+#   GET /api/routes/<routeId>/journeys?sort=&exclude=&maxTime=&maxCost=&maxRisk=&offset=&limit=&view=
+#   GET /api/routes/<routeId>/legs/<legKey>   (legKey as in journeys' leg1Key, e.g. firstMile/0)
+
+SORT_KEYS = JOURNEY_SORT_KEYS
+
+FILTERS = {'maxTime': 'time', 'maxCost': 'cost', 'maxRisk': 'risk'}
+
+VIEWS = ['summary', 'full']
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+GZIP_MIN_BYTES = 512
+
+class QueryError(ValueError):
+    pass
+
+class NotFound(LookupError):
+    pass
+
+# --- Route Data ---
+
+def file_version(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+class RouteData:
+    def __init__(self, route_id, path):
+        self.route_id = route_id
+        self.path = path
+        self.version = file_version(path)
+        self.init_data = load_output(path)
+
+        main_leg = self.init_data['segmentOptions']['mainLeg']
+        main_modes = segment_modes(main_leg.get('segments', []), set())
+        # Legs by key ('firstMile/0', 'mainLeg', ...); ids are not unique
+        self.legs, journey_keys = leg_keys(self.init_data)
+        # (journey with its leg keys, modes used) in output order
+        self.journeys = []
+        for journey, (leg1_key, leg3_key) in zip(self.init_data['journeys'], journey_keys):
+            modes = set(main_modes)
+            for key in ['leg1', 'leg3']:
+                segment_modes(journey[key].get('segments', []), modes)
+            journey = dict(journey, leg1Key=leg1_key, leg3Key=leg3_key)
+            self.journeys.append((journey, frozenset(modes)))
+        # Outputs built with --journey-index come with every order precomputed
+        self.orders = self.init_data.get('journeyIndex', {}).get('order', {})
+
+    def search(self, query):
+        order = self.orders.get(query['sort'])
+        candidates = [self.journeys[i] for i in order] if order else self.journeys
+        results = []
+        for journey, modes in candidates:
+            if modes & query['exclude']:
+                continue
+            if any(journey[field] > query[name] for name, field in FILTERS.items() if query[name] is not None):
+                continue
+            results.append(journey)
+        if not order:
+            # Stable, so ties keep output order, as in the precomputed orders
+            results.sort(key=SORT_KEYS[query['sort']])
+        page = results[query['offset']:query['offset'] + query['limit']]
+        if query['view'] == 'summary':
+            page = [dict(j, leg1=j['leg1Key'], leg3=j['leg3Key']) for j in page]
+        return {
+            'routeId': self.route_id,
+            'version': self.version,
+            'sort': query['sort'],
+            'total': len(results),
+            'offset': query['offset'],
+            'journeys': page
+        }
+
+def load_routes(entries):
+    # Routes that have not been built yet are skipped
+    routes = {}
+    for _, output_path, route_id in entries:
+        if not os.path.exists(output_path):
+            print(f"Skipping {route_id}: {output_path} not found (run process_routes.py)")
+            continue
+        routes[route_id] = RouteData(route_id, output_path)
+    if not routes:
+        raise SystemExit('No processed routes to serve')
+    return routes
+
+def parse_query(params):
+    def single(name, default=None):
+        values = params.get(name)
+        return values[-1] if values else default
+
+    def number(name, cast, default=None):
+        value = single(name)
+        if value is None:
+            return default
+        try:
+            return cast(value)
+        except ValueError:
+            raise QueryError(f"{name} must be a number")
+
+    query = {
+        'sort': single('sort', 'smart'),
+        'view': single('view', 'summary'),
+        'exclude': frozenset(m for v in params.get('exclude', []) for m in v.split(',') if m),
+        'offset': number('offset', int, 0),
+        'limit': number('limit', int, DEFAULT_LIMIT),
+    }
+    for name in FILTERS:
+        query[name] = number(name, float)
+
+    if query['sort'] not in SORT_KEYS:
+        raise QueryError(f"sort must be one of {', '.join(SORT_KEYS)}")
+    if query['view'] not in VIEWS:
+        raise QueryError(f"view must be one of {', '.join(VIEWS)}")
+    if query['offset'] < 0 or not 0 < query['limit'] <= MAX_LIMIT:
+        raise QueryError(f"offset must be >= 0 and limit between 1 and {MAX_LIMIT}")
+    return query
+
+def query_key(route, query):
+    # Same results for any parameter order or spelling of the exclude list
+    return (route.route_id, route.version) + tuple(
+        tuple(sorted(query['exclude'])) if name == 'exclude' else query[name] for name in sorted(query))
+
+# --- Response Cache ---
+
+class Response:
+    __slots__ = ('body', 'etag', '_gzipped')
+
+    def __init__(self, value):
+        self.body = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:16]}"'
+        self._gzipped = None
+
+    def gzipped(self):
+        # Compressed on first use; a race only compresses twice
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self._gzipped
+
+class ResponseCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        with self.lock:
+            response = self.entries.get(key)
+            if response is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return response, True
+            self.misses += 1
+        response = Response(build())
+        if self.max_entries:
+            with self.lock:
+                self.entries[key] = response
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return response, False
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'maxEntries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses}
+
+# --- HTTP Handler ---
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # Weak comparison, as for GET
+    return etag in [tag.strip().removeprefix('W/') for tag in header.split(',')]
+
+class RouteRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'RouteServer/1'
+    # Headers and body go out in separate writes; with Nagle on, keep-alive
+    # clients wait out a delayed ACK (~40 ms) on every response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(p) for p in url.path.strip('/').split('/')]
+        routes = self.server.routes
+        try:
+            if parts == ['health']:
+                self.send_json(lambda: {'status': 'ok', 'cache': self.server.cache.stats()}, cache=False)
+            elif parts == ['api', 'routes']:
+                self.send_json(lambda: {'routes': [{'routeId': r.route_id, 'version': r.version,
+                                                    'journeys': len(r.journeys)} for r in routes.values()]},
+                               cache=False)
+            elif len(parts) == 4 and parts[:2] == ['api', 'routes'] and parts[3] == 'journeys':
+                route = self.route(parts[2])
+                query = parse_query(parse_qs(url.query))
+                self.send_json(lambda: route.search(query), key=query_key(route, query))
+            elif len(parts) >= 5 and parts[:2] == ['api', 'routes'] and parts[3] == 'legs':
+                route = self.route(parts[2])
+                # Keys contain a slash, sent as is or escaped
+                leg_key = '/'.join(parts[4:])
+                if leg_key not in route.legs:
+                    raise NotFound(f"Unknown leg {leg_key}")
+                self.send_json(lambda: dict(route.legs[leg_key], key=leg_key),
+                               key=(route.route_id, route.version, 'leg', leg_key))
+            else:
+                raise NotFound('Not found')
+        except QueryError as e:
+            self.send_error_json(400, str(e))
+        except NotFound as e:
+            self.send_error_json(404, str(e))
+        except Exception:
+            # A bug, not a bad request: log it and answer rather than drop the
+            # connection; it is closed after, as a response may be half written
+            print(f"Error handling GET {self.path}:", file=sys.stderr)
+            traceback.print_exc()
+            self.close_connection = True
+            self.send_error_json(500, 'Internal server error')
+
+    def route(self, route_id):
+        if route_id not in self.server.routes:
+            raise NotFound(f"Unknown route {route_id}")
+        return self.server.routes[route_id]
+
+    def send_json(self, build, key=None, cache=True):
+        if cache:
+            response, hit = self.server.cache.get(key, build)
+        else:
+            response, hit = Response(build()), False
+
+        headers = {
+            'ETag': response.etag,
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding',
+            'X-Cache': 'HIT' if hit else 'MISS',
+        }
+        if etag_matches(self.headers.get('If-None-Match'), response.etag):
+            self.send_body(304, b'', headers)
+            return
+
+        body = response.body
+        if len(body) >= GZIP_MIN_BYTES and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = response.gzipped()
+            headers['Content-Encoding'] = 'gzip'
+        headers['Content-Type'] = 'application/json'
+        self.send_body(200, body, headers)
+
+    def send_error_json(self, status, message):
+        body = json.dumps({'error': message}).encode('utf-8')
+        self.send_body(status, body, {'Content-Type': 'application/json'})
+
+    def send_body(self, status, body, headers):
+        self.send_response(status)
+        # The app is served from another local port in development
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class RouteServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, routes, cache_size=256, verbose=False):
+        super().__init__(address, RouteRequestHandler)
+        self.routes = routes
+        self.cache = ResponseCache(cache_size)
+        self.verbose = verbose
+
+def create_server(entries, host='127.0.0.1', port=8080, cache_size=256, verbose=False):
+    return RouteServer((host, port), load_routes(entries), cache_size, verbose)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve journey searches over processed routes.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='process_routes.py manifest whose outputs to serve instead of the app routes')
+    parser.add_argument('--cache-size', type=int, default=256,
+                        help='query responses kept in the LRU cache, 0 to disable (default 256)')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    entries = load_manifest(args.manifest) if args.manifest else pr.ROUTE_FILES
+    server = create_server(entries, args.host, args.port, args.cache_size, args.verbose)
+    for route in server.routes.values():
+        print(f"{route.route_id}: {len(route.journeys)} journeys from {route.path} ({route.version})")
+    print(f"Listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+import math
+from array import array
+
+# Spatial index over processed routes: uniform grids over path chunks and
+# stops.
+#
+# Each top-level segment path is cut into chunks of up to CHUNK_POINTS points
+# (neighbouring chunks share their boundary point), and every chunk's bounding
+# box is entered in each grid cell it overlaps. Stops are the named stopPoints
+# of transit segments plus the departure and arrival ends of transit paths, so
+# stations are indexed before stop coordinates are filled in. Grids are kept
+# sparse: only occupied cells are stored, as sorted cell keys with offsets
+# into one item list (CSR).
+#
+# Legs are referred to by their position in output_legs() order (firstMile,
+# mainLeg, lastMile), which every output format preserves; leg ids are not
+# unique across groups. Distances are metres on an equirectangular projection
+# around the query point.
+
+DEFAULT_CELL_SIZE = 0.01  # degrees, ~1.1 km north-south
+CHUNK_POINTS = 32
+EARTH_RADIUS_M = 6371000.0
+METRES_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180
+
+# Stop coordinates are merged when they round to the same 5 decimal places
+STOP_PRECISION = 5
+
+def path_pairs(path):
+    return [[pt[0], pt[1]] for pt in path] if path else []
+
+def bbox_of(points):
+    lats = [pt[0] for pt in points]
+    lngs = [pt[1] for pt in points]
+    return [min(lats), min(lngs), max(lats), max(lngs)]
+
+def stop_cell_size(stops, cell_size):
+    # Stops are sparse next to path points; cells sized for about one stop
+    # each keep nearest-stop searches from walking rings of empty cells
+    if len(stops) < 2:
+        return cell_size
+    lat_span = max(s[1] for s in stops) - min(s[1] for s in stops)
+    lng_span = max(s[2] for s in stops) - min(s[2] for s in stops)
+    return max(cell_size, math.sqrt(lat_span * lng_span / len(stops)))
+
+class Grid:
+    # Sparse uniform grid; cell (row, col) has key row * cols + col
+    def __init__(self, data):
+        self.cell_size = data['cellSize']
+        self.origin = data['origin']
+        self.rows = data['rows']
+        self.cols = data['cols']
+        self.keys = data['keys']
+        self.offsets = data['offsets']
+        self.items = data['items']
+        self.cells = {key: (self.offsets[i], self.offsets[i + 1]) for i, key in enumerate(self.keys)}
+
+    @classmethod
+    def build(cls, bboxes, cell_size):
+        # The grid covers the boxes, aligned to multiples of cell_size
+        origin, rows, cols = [0.0, 0.0], 0, 0
+        if bboxes:
+            origin = [math.floor(min(b[0] for b in bboxes) / cell_size) * cell_size,
+                      math.floor(min(b[1] for b in bboxes) / cell_size) * cell_size]
+            rows = cls.cell_of(origin, cell_size, max(b[2] for b in bboxes), 0)[0] + 1
+            cols = cls.cell_of(origin, cell_size, 0, max(b[3] for b in bboxes))[1] + 1
+
+        cells = {}
+        for item, (min_lat, min_lng, max_lat, max_lng) in enumerate(bboxes):
+            r0, c0 = cls.cell_of(origin, cell_size, min_lat, min_lng)
+            r1, c1 = cls.cell_of(origin, cell_size, max_lat, max_lng)
+            for r in range(r0, r1 + 1):
+                for c in range(c0, c1 + 1):
+                    cells.setdefault(r * cols + c, []).append(item)
+
+        keys = sorted(cells)
+        offsets = [0]
+        items = []
+        for key in keys:
+            items.extend(cells[key])
+            offsets.append(len(items))
+        return cls({'cellSize': cell_size, 'origin': origin, 'rows': rows, 'cols': cols,
+                    'keys': keys, 'offsets': offsets, 'items': items})
+
+    @staticmethod
+    def cell_of(origin, cell_size, lat, lng):
+        return (int(math.floor((lat - origin[0]) / cell_size)),
+                int(math.floor((lng - origin[1]) / cell_size)))
+
+    def to_json(self):
+        return {'cellSize': self.cell_size, 'origin': self.origin, 'rows': self.rows, 'cols': self.cols,
+                'keys': self.keys, 'offsets': self.offsets, 'items': self.items}
+
+    def cell_items(self, row, col):
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return ()
+        span = self.cells.get(row * self.cols + col)
+        return self.items[span[0]:span[1]] if span else ()
+
+    def query_bbox(self, min_lat, min_lng, max_lat, max_lng):
+        # Items in the cells the box overlaps, each once, in first-seen order
+        r0, c0 = Grid.cell_of(self.origin, self.cell_size, min_lat, min_lng)
+        r1, c1 = Grid.cell_of(self.origin, self.cell_size, max_lat, max_lng)
+        r0, c0 = max(r0, 0), max(c0, 0)
+        r1, c1 = min(r1, self.rows - 1), min(c1, self.cols - 1)
+        if r0 == r1 and c0 == c1:
+            # Most small boxes fall in one cell, which holds each item once
+            return self.cell_items(r0, c0)
+        # dict.fromkeys drops repeats without a Python-level loop per item
+        cells, items, cols = self.cells, self.items, self.cols
+        found = {}
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                span = cells.get(r * cols + c)
+                if span:
+                    found.update(dict.fromkeys(items[span[0]:span[1]]))
+        return list(found)
+
+    def rings(self, lat, lng):
+        # Cells in rings of growing Chebyshev distance around the point's
+        # cell, as (ring, items); stops once the grid is covered
+        row, col = Grid.cell_of(self.origin, self.cell_size, lat, lng)
+        # Rings that miss the grid entirely are skipped
+        first = max(0, -row, row - (self.rows - 1), -col, col - (self.cols - 1))
+        last = max(row, self.rows - 1 - row, col, self.cols - 1 - col)
+        for ring in range(first, last + 1):
+            items = []
+            for r in range(max(row - ring, 0), min(row + ring, self.rows - 1) + 1):
+                if ring and r not in (row - ring, row + ring):
+                    cols = (col - ring, col + ring)
+                else:
+                    cols = range(max(col - ring, 0), min(col + ring, self.cols - 1) + 1)
+                for c in cols:
+                    items.extend(self.cell_items(r, c))
+            yield ring, items
+
+class Projection:
+    # Equirectangular metres around a reference latitude
+    __slots__ = ('kx', 'ky')
+
+    def __init__(self, lat):
+        self.ky = METRES_PER_DEGREE
+        self.kx = METRES_PER_DEGREE * math.cos(math.radians(lat))
+
+    def point_distance(self, lat, lng, lat2, lng2):
+        return math.hypot((lng2 - lng) * self.kx, (lat2 - lat) * self.ky)
+
+    def polyline_distance(self, lat, lng, coords, limit=math.inf):
+        # coords is flat [lat, lng, lat, lng, ...]. Distances beyond limit
+        # come back as inf: a segment with both ends past the limit on the
+        # same side is skipped without projecting onto it, and the limit
+        # shrinks to the closest segment found so far.
+        kx, ky = self.kx, self.ky
+        ax = (coords[1] - lng) * kx
+        ay = (coords[0] - lat) * ky
+        if len(coords) == 2:
+            distance = math.hypot(ax, ay)
+            return distance if distance <= limit else math.inf
+        best = limit * limit
+        found = False
+        for i in range(2, len(coords), 2):
+            bx = (coords[i + 1] - lng) * kx
+            by = (coords[i] - lat) * ky
+            if ((ax > limit and bx > limit) or (ax < -limit and bx < -limit) or
+                    (ay > limit and by > limit) or (ay < -limit and by < -limit)):
+                ax, ay = bx, by
+                continue
+            dx, dy = bx - ax, by - ay
+            length_sq = dx * dx + dy * dy
+            t = 0.0 if length_sq == 0 else -(ax * dx + ay * dy) / length_sq
+            t = 0.0 if t < 0.0 else (1.0 if t > 1.0 else t)
+            px, py = ax + t * dx, ay + t * dy
+            dist_sq = px * px + py * py
+            if dist_sq <= best:
+                best = dist_sq
+                found = True
+                limit = math.sqrt(best)
+            ax, ay = bx, by
+        return math.sqrt(best) if found else math.inf
+
+    def cell_metres(self, cell_size):
+        # Shortest side of a cell
+        return cell_size * min(self.kx, self.ky)
+
+class SpatialIndex:
+    def __init__(self, data, legs=None):
+        # data is to_json() output; with the output's legs (output_legs order)
+        # path queries are exact, otherwise they use chunk bounding boxes
+        self.segments = data['segments']
+        self.stops = data['stops']
+        self.segment_grid = Grid(data['segmentGrid'])
+        self.stop_grid = Grid(data['stopGrid'])
+        self.chunks = None
+        if legs is not None:
+            self.chunks = [self.chunk_coords(legs, entry) for entry in self.segments]
+
+    @staticmethod
+    def chunk_coords(legs, entry):
+        leg_index, seg_index, start, end = entry[:4]
+        path = legs[leg_index]['segments'][seg_index].get('path') or []
+        coords = array('d')
+        for i in range(start, end + 1):
+            pt = path[i]
+            coords.append(pt[0])
+            coords.append(pt[1])
+        return coords
+
+    @classmethod
+    def build(cls, legs, cell_size=DEFAULT_CELL_SIZE, chunk_points=CHUNK_POINTS):
+        segments = []
+        stops = {}
+
+        def add_stop(name, point, leg_index):
+            if not point:
+                return
+            key = (name, round(point[0], STOP_PRECISION), round(point[1], STOP_PRECISION))
+            stop = stops.setdefault(key, [name, point[0], point[1], []])
+            if leg_index not in stop[3]:
+                stop[3].append(leg_index)
+
+        for leg_index, leg in enumerate(legs):
+            for seg_index, seg in enumerate(leg.get('segments', [])):
+                path = path_pairs(seg.get('path'))
+                for start in range(0, max(len(path) - 1, 1), chunk_points - 1):
+                    end = min(start + chunk_points - 1, len(path) - 1)
+                    if end < start:
+                        continue
+                    segments.append([leg_index, seg_index, start, end] + bbox_of(path[start:end + 1]))
+
+                for sub in seg.get('subSegments') or [seg]:
+                    if sub.get('mode') not in ('train', 'bus'):
+                        continue
+                    sub_path = path_pairs(sub.get('path'))
+                    if sub_path:
+                        add_stop(sub.get('from'), sub_path[0], leg_index)
+                        add_stop(sub.get('to'), sub_path[-1], leg_index)
+                    names = sub.get('stops') or []
+                    for i, point in enumerate(sub.get('stopPoints') or []):
+                        add_stop(names[i] if i < len(names) else None, point, leg_index)
+
+        stops = list(stops.values())
+        data = {
+            'segments': segments,
+            'stops': stops,
+            'segmentGrid': Grid.build([entry[4:] for entry in segments], cell_size).to_json(),
+            'stopGrid': Grid.build([[lat, lng, lat, lng] for _, lat, lng, _ in stops],
+                                   stop_cell_size(stops, cell_size)).to_json()
+        }
+        return cls(data, legs)
+
+    def to_json(self):
+        return {
+            'segments': self.segments,
+            'stops': self.stops,
+            'segmentGrid': self.segment_grid.to_json(),
+            'stopGrid': self.stop_grid.to_json()
+        }
+
+    def stop(self, index):
+        name, lat, lng, legs = self.stops[index]
+        return {'name': name, 'lat': lat, 'lng': lng, 'legs': legs}
+
+    def stops_in_bbox(self, min_lat, min_lng, max_lat, max_lng):
+        return [self.stop(i) for i in self.stop_grid.query_bbox(min_lat, min_lng, max_lat, max_lng)
+                if min_lat <= self.stops[i][1] <= max_lat and min_lng <= self.stops[i][2] <= max_lng]
+
+    def segments_in_bbox(self, min_lat, min_lng, max_lat, max_lng):
+        # (leg index, segment index) of segments with a path chunk overlapping the box
+        found = []
+        seen = set()
+        for i in self.segment_grid.query_bbox(min_lat, min_lng, max_lat, max_lng):
+            entry = self.segments[i]
+            if entry[4] > max_lat or entry[6] < min_lat or entry[5] > max_lng or entry[7] < min_lng:
+                continue
+            key = (entry[0], entry[1])
+            if key not in seen:
+                seen.add(key)
+                found.append(key)
+        return found
+
+    def nearest_stops(self, lat, lng, k=1, max_distance=None):
+        # The k closest stops as (metres, stop), nearest first
+        projection = Projection(lat)
+        cell_metres = projection.cell_metres(self.stop_grid.cell_size)
+        best = []
+        for ring, items in self.stop_grid.rings(lat, lng):
+            for i in items:
+                _, stop_lat, stop_lng, _ = self.stops[i]
+                best.append((projection.point_distance(lat, lng, stop_lat, stop_lng), i))
+            best.sort()
+            del best[k:]
+            # Anything in a further ring is at least this far away
+            reach = ring * cell_metres
+            if max_distance is not None and reach > max_distance:
+                break
+            if len(best) == k and best[-1][0] <= reach:
+                break
+        return [(d, self.stop(i)) for d, i in best if max_distance is None or d <= max_distance]
+
+    def legs_near(self, lat, lng, radius):
+        # Legs whose path passes within radius metres, as (metres, leg index),
+        # nearest first
+        projection = Projection(lat)
+        kx, ky = projection.kx, projection.ky
+        dlat = radius / ky
+        dlng = radius / kx if kx else 180.0
+        segments = self.segments
+        radius_sq = radius * radius
+        candidates = []
+        for i in self.segment_grid.query_bbox(lat - dlat, lng - dlng, lat + dlat, lng + dlng):
+            # Distance to the chunk's bounding box, inline as it runs for every chunk in range
+            _, _, _, _, min_lat, min_lng, max_lat, max_lng = segments[i]
+            dy = (min_lat - lat if min_lat > lat else lat - max_lat if lat > max_lat else 0.0) * ky
+            dx = (min_lng - lng if min_lng > lng else lng - max_lng if lng > max_lng else 0.0) * kx
+            distance_sq = dx * dx + dy * dy
+            if distance_sq <= radius_sq:
+                candidates.append((math.sqrt(distance_sq), i))
+        # Closest boxes first, so chunks that cannot beat a leg's best are skipped
+        candidates.sort()
+        nearest = {}
+        for distance, i in candidates:
+            leg_index = segments[i][0]
+            best = nearest.get(leg_index, math.inf)
+            if distance >= best:
+                continue
+            if self.chunks is not None:
+                distance = projection.polyline_distance(lat, lng, self.chunks[i], min(best, radius))
+                if distance > radius:
+                    continue
+            if distance < best:
+                nearest[leg_index] = distance
+        return sorted((d, leg) for leg, d in nearest.items())
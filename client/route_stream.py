@@ -0,0 +1,226 @@
+import json
+
+# Incremental JSON reading and writing for routes files.
+#
+# read_json_stream reads a document in chunks and hands back lazy views of the
+# parts named in a spec; everything else is decoded whole with json's
+# raw_decode. For routes files only one option is decoded at a time, so memory
+# is bounded by the largest option rather than the whole file. Lazy views must
+# be consumed in document order (a view that is skipped is drained when the
+# next sibling is read).
+#
+# write_json_stream writes dicts, lists, generators and lazy views container
+# by container; with indent the bytes match json.dump(..., indent=2).
+# fragments maps id(value) -> (value, text or None) for values the caller
+# knows are unchanged since the last write; their text is rendered once and
+# re-indented on later writes.
+
+# Stream the groups array and each group's options array, decode options whole
+ROUTES_SPEC = {'groups': [{'options': [None]}]}
+
+WHITESPACE = ' \t\r\n'
+NUMBER_CHARS = '0123456789+-.eE'
+
+class JsonStream:
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size=0):
+        # Drop consumed text and append at least one more chunk
+        if self.pos:
+            self.offset += self.pos
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        chunk = self.f.read(max(size, self.chunk_size))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def peek(self):
+        # Next non-whitespace character, or '' at the end of the input
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise ValueError(f"Expected one of {chars!r} at offset {self.offset + self.pos}, found {ch!r}")
+        self.pos += 1
+        return ch
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                # Value continues past the buffer; at least double what is held
+                self.fill(len(self.buf) - self.pos)
+                continue
+            if not self.eof and (end == len(self.buf) or
+                                 isinstance(value, (int, float)) and not self.buf[end:].strip(NUMBER_CHARS)):
+                # A number at the end of the buffer may continue in the next
+                # chunk, including one cut after its '.' or exponent
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        # Yields each key of an object; the caller reads its value before resuming
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        # Yields once per array element; the caller reads it before resuming
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(',]') == ']':
+                return
+
+    def read(self, spec):
+        # A dict spec streams an object, [spec] streams an array, None decodes the
+        # value whole and a callable is applied to the decoded value
+        if isinstance(spec, dict):
+            return StreamObject(self, spec)
+        if isinstance(spec, list):
+            return StreamArray(self, spec[0])
+        value = self.value()
+        return spec(value) if callable(spec) else value
+
+class StreamObject:
+    __slots__ = ('stream', 'spec', '_iter')
+
+    def __init__(self, stream, spec):
+        self.stream = stream
+        self.spec = spec
+        self._iter = None
+
+    def _items(self):
+        for key in self.stream.members():
+            value = self.stream.read(self.spec.get(key))
+            yield key, value
+            drain(value)
+
+    def items(self):
+        if self._iter is None:
+            self._iter = self._items()
+        return self._iter
+
+class StreamArray:
+    __slots__ = ('stream', 'spec', '_iter')
+
+    def __init__(self, stream, spec):
+        self.stream = stream
+        self.spec = spec
+        self._iter = None
+
+    def _elements(self):
+        for _ in self.stream.elements():
+            value = self.stream.read(self.spec)
+            yield value
+            drain(value)
+
+    def __iter__(self):
+        if self._iter is None:
+            self._iter = self._elements()
+        return self._iter
+
+def drain(value):
+    if isinstance(value, StreamObject):
+        for _, item in value.items():
+            drain(item)
+    elif isinstance(value, StreamArray):
+        for item in value:
+            drain(item)
+
+def read_json_stream(f, spec=ROUTES_SPEC, chunk_size=1 << 16):
+    return JsonStream(f, chunk_size).read(spec)
+
+def iter_route_options(f, chunk_size=1 << 16):
+    # (group name, option index, option) for every option in a routes file, in
+    # file order; group keys before "options" (the name) are known by then
+    doc = read_json_stream(f, ROUTES_SPEC, chunk_size)
+    for key, groups in doc.items():
+        if key != 'groups':
+            continue
+        for group in groups:
+            name = ''
+            for group_key, value in group.items():
+                if group_key == 'name':
+                    name = value
+                elif group_key == 'options':
+                    for index, option in enumerate(value):
+                        yield name, index, option
+
+def is_stream_object(value):
+    return isinstance(value, (dict, StreamObject))
+
+def is_stream_array(value):
+    return isinstance(value, (list, StreamArray)) or hasattr(value, '__next__')
+
+def write_json_stream(f, value, compact=False, default=None, level=0, max_depth=3, fragments=None):
+    separators = (',', ':') if compact else (',', ': ')
+    indent = None if compact else 2
+    newline = '' if compact else '\n' + ' ' * (2 * (level + 1))
+    closing = '' if compact else '\n' + ' ' * (2 * level)
+
+    entry = fragments.get(id(value)) if fragments is not None else None
+    if entry is not None and entry[0] is value:
+        # Written whole, which gives the same bytes as streaming it
+        text = entry[1]
+        if text is None:
+            text = json.dumps(value, indent=indent, separators=separators, default=default)
+            fragments[id(value)] = (value, text)
+        f.write(text if compact else text.replace('\n', closing))
+        return
+
+    # Past max_depth plain containers are written whole; lazy views and
+    # generators cannot be, so they are still streamed
+    if not (is_stream_object(value) or is_stream_array(value)) or level >= max_depth and isinstance(value, (dict, list)):
+        text = json.dumps(value, indent=indent, separators=separators, default=default)
+        f.write(text if compact else text.replace('\n', closing))
+        return
+
+    is_object = is_stream_object(value)
+    items = value.items() if is_object else value
+    first = True
+    for item in items:
+        f.write(('{' if is_object else '[') + newline if first else ',' + newline)
+        first = False
+        if is_object:
+            key, item = item
+            f.write(json.dumps(key) + separators[1])
+        write_json_stream(f, item, compact, default, level + 1, max_depth, fragments)
+
+    if first:
+        f.write('{}' if is_object else '[]')
+    else:
+        f.write(closing + ('}' if is_object else ']'))
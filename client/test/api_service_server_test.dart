@@ -0,0 +1,94 @@
+import 'dart:convert';
+
+import 'package:flutter_test/flutter_test.dart';
+import 'package:http/http.dart' as http;
+import 'package:http/testing.dart';
+import 'package:client/services/api_service.dart';
+
+void main() {
+  Map<String, dynamic> leg(String id, String label, String mode) => {
+        'id': id,
+        'label': label,
+        'detail': '',
+        'time': 10,
+        'cost': 1.0,
+        'distance': 1.0,
+        'riskScore': 0,
+        'iconId': mode,
+        'lineColor': '#000000',
+        'co2': 0.1,
+        'segments': [
+          {
+            'mode': mode,
+            'label': label,
+            'lineColor': '#000000',
+            'iconId': mode,
+            'time': 10,
+            'cost': 1.0,
+            'path': [
+              [53.8, -1.5],
+            ],
+          },
+        ],
+      };
+
+  Map<String, dynamic> journey(String id, String hub, double cost, int time) => {
+        'id': id,
+        'leg1': leg(id, 'Bus to $hub Station then Train', 'bus'),
+        'leg3': leg('uber', 'Uber to Destination', 'car'),
+        'cost': cost,
+        'time': time,
+        'buffer': 10,
+        'risk': 0,
+        'emissions': {'val': 1.0, 'percent': 10, 'text': null},
+      };
+
+  test('searchJourneys queries the route server when a base URL is set',
+      () async {
+    late Uri requested;
+    final client = MockClient((request) async {
+      requested = request.url;
+      return http.Response(
+          jsonEncode({
+            'routeId': 'route2',
+            'sort': 'cost',
+            'total': 2,
+            'offset': 0,
+            'journeys': [
+              journey('york-uber', 'York', 12.0, 90),
+              journey('hull-uber', 'Hull', 15.0, 80),
+            ],
+          }),
+          200);
+    });
+
+    final apiService =
+        ApiService(baseUrl: 'http://127.0.0.1:8080', client: client);
+    final results = await apiService.searchJourneys(
+      tab: 'cheapest',
+      selectedModes: {'train': true, 'bus': true, 'taxi': false, 'car': false},
+      routeId: 'route2',
+    );
+
+    expect(requested.path, '/api/routes/route2/journeys');
+    expect(requested.queryParameters['sort'], 'cost');
+    expect(requested.queryParameters['view'], 'full');
+    expect(requested.queryParameters['exclude'], 'car,taxi');
+    expect(results.map((j) => j.id), ['york-uber', 'hull-uber']);
+    expect(results.first.leg1.segments.single.path!.single.latitude,
+        closeTo(53.8, 0.00001));
+  });
+
+  test('searchJourneys reports server errors', () async {
+    final client = MockClient((request) async =>
+        http.Response('{"error": "Unknown route route9"}', 404));
+    final apiService =
+        ApiService(baseUrl: 'http://127.0.0.1:8080', client: client);
+
+    expect(
+      apiService.searchJourneys(
+          tab: 'smart', selectedModes: {}, routeId: 'route9'),
+      throwsException,
+    );
+  });
+}
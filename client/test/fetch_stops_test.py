@@ -0,0 +1,309 @@
+import json
+import os
+import shutil
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fetch_stops as fs
+
+ROUTES_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'routes.json')
+
+START = {'lat': 53.79, 'lng': -1.54}
+END = {'lat': 53.80, 'lng': -1.55}
+
+
+class StubDirections(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        self.server.requests.append((url.path, params))
+        if self.server.drop_next:
+            # Hang up without answering, like a server timing out a keep-alive connection
+            self.server.drop_next = False
+            self.close_connection = True
+            return
+        if params.get('key') != 'test-key':
+            body = b'denied'
+            self.send_response(403)
+        else:
+            body = json.dumps({
+                'status': 'OK',
+                'routes': [{'legs': [{'steps': [
+                    {'travel_mode': 'WALKING'},
+                    {'travel_mode': 'TRANSIT', 'transit_details': {'num_stops': 7}},
+                ]}]}],
+            }).encode()
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubDirections)
+    httpd.daemon_threads = True
+    httpd.requests = []
+    httpd.drop_next = False
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def client_for(server, api_key='test-key', **kwargs):
+    host, port = server.server_address
+    return fs.DirectionsClient(api_key, base_url=f'http://{host}:{port}/directions/json', **kwargs)
+
+
+def test_fetches_transit_details_over_one_connection(server):
+    client = client_for(server)
+    try:
+        for _ in range(3):
+            assert fs.request_transit_details(START, END, None, client) == {'num_stops': 7, 'stops': []}
+        # Keep-alive: every request from this thread reuses the same connection
+        assert len(client.connections) == 1
+    finally:
+        client.close()
+    path, params = server.requests[0]
+    assert path == '/directions/json'
+    assert params['mode'] == 'transit'
+    assert params['origin'] == '53.79,-1.54'
+
+
+def test_reconnects_when_the_server_drops_the_connection(server):
+    client = client_for(server)
+    try:
+        assert client.get_json(fs.transit_params(START, END))['status'] == 'OK'
+        server.drop_next = True
+        assert client.get_json(fs.transit_params(START, END))['status'] == 'OK'
+        assert len(client.connections) == 1
+        assert len(server.requests) == 3
+    finally:
+        client.close()
+
+
+def test_http_errors_are_not_cached(server, tmp_path):
+    client = client_for(server, api_key='wrong-key')
+    cache = fs.ResponseCache(str(tmp_path / 'cache.sqlite'))
+    try:
+        assert fs.fetch_transit_details(START, END, None, client, cache) is None
+        assert cache.get(cache.key(START, END, 'transit')) is None
+    finally:
+        client.close()
+        cache.close()
+
+
+def test_close_shuts_every_thread_connection(server):
+    client = client_for(server, rate_limiter=fs.TokenBucket(1000))
+    jobs = [({'lat': 53.0 + i / 100, 'lng': -1.5}, END) for i in range(16)]
+    results = fs.fetch_all(client, jobs, concurrency=4)
+    assert [r['num_stops'] for r in results] == [7] * 16
+    connections = list(client.connections)
+    assert len(connections) > 1
+    client.close()
+    assert client.connections == []
+    assert all(conn.sock is None for conn in connections)
+
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValueError):
+        fs.TokenBucket(0)
+
+
+class StubResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+class StubConnection:
+    # Stands in for http.client.HTTPConnection, answering every request itself
+    body = json.dumps({'status': 'OK', 'routes': [{'legs': [{'steps': [
+        {'travel_mode': 'TRANSIT', 'transit_details': {'num_stops': 7}}]}]}]}).encode()
+
+    def __init__(self, netloc, timeout=None):
+        self.netloc = netloc
+        self.requests = []
+        self.closed = False
+
+    def request(self, method, path, headers=None):
+        assert not self.closed
+        self.requests.append((method, path, headers))
+
+    def getresponse(self):
+        return StubResponse(200, self.body)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def stub_connections(monkeypatch):
+    opened = []
+
+    def connect(netloc, timeout=None):
+        conn = StubConnection(netloc, timeout)
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(fs.http.client, 'HTTPConnection', connect)
+    monkeypatch.setattr(fs.http.client, 'HTTPSConnection', connect)
+    return opened
+
+
+class StubClock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_allows_a_burst_then_paces_requests(monkeypatch):
+    clock = StubClock()
+    monkeypatch.setattr(fs, 'time', clock)
+    bucket = fs.TokenBucket(2, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5), pytest.approx(0.5)]
+
+    # Idle time refills the bucket, but never past its capacity
+    clock.now += 60
+    clock.sleeps = []
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_stubbed_connection_is_kept_alive_and_closed(stub_connections):
+    client = fs.DirectionsClient('test-key')
+    for _ in range(3):
+        assert client.get_json(fs.transit_params(START, END))['status'] == 'OK'
+    assert len(stub_connections) == 1
+    conn = stub_connections[0]
+    assert conn.netloc == 'maps.googleapis.com'
+    assert [headers['Connection'] for _, _, headers in conn.requests] == ['keep-alive'] * 3
+    assert all('key=test-key' in path for _, path, _ in conn.requests)
+
+    client.close()
+    assert conn.closed and client.connections == []
+    # A later request starts over on a new connection
+    client.get_json(fs.transit_params(START, END))
+    assert len(stub_connections) == 2 and not stub_connections[1].closed
+    client.close()
+    assert stub_connections[1].closed
+
+
+def test_process_file_still_takes_an_api_key(stub_connections, tmp_path):
+    path = str(tmp_path / 'routes.json')
+    shutil.copy(ROUTES_JSON, path)
+    fs.process_file(path, 'test-key', concurrency=2)
+
+    assert stub_connections and all(conn.closed for conn in stub_connections)
+    paths = [path for conn in stub_connections for _, path, _ in conn.requests]
+    jobs, _ = fs.plan_fetches(fs.scan_transit_legs(ROUTES_JSON))
+    assert len(paths) == len(jobs) and all('key=test-key' in p for p in paths)
+    with open(path) as f:
+        data = json.load(f)
+    assert {leg['transit_details']['num_stops'] for _, leg in fs.transit_legs(data)} == {7}
+
+
+class CountingClient:
+    # Answers like the directions API and counts the requests made
+    api_key = 'test-key'
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get_json(self, params):
+        with self.lock:
+            self.calls.append((params['origin'], params['destination']))
+        return json.loads(StubConnection.body)
+
+
+def copies(tmp_path, count):
+    paths = [str(tmp_path / f'routes_{n}.json') for n in range(count)]
+    for path in paths:
+        shutil.copy(ROUTES_JSON, path)
+    return paths
+
+
+def stop_counts(path):
+    with open(path) as f:
+        return [leg.get('transit_details', {}).get('num_stops') for _, leg in fs.transit_legs(json.load(f))]
+
+
+def test_plan_fetches_keeps_one_job_per_leg_endpoints():
+    legs = [{'start_location': START, 'end_location': END},
+            {'start_location': END, 'end_location': START},
+            {'start_location': dict(START), 'end_location': {'lat': 53.800001, 'lng': -1.55}}]
+    jobs, leg_jobs = fs.plan_fetches(legs)
+    assert jobs == [(START, END), (END, START)]
+    assert leg_jobs == [0, 1, 0]
+
+
+def test_identical_legs_across_files_are_fetched_once(tmp_path):
+    paths = copies(tmp_path, 3)
+    client = CountingClient()
+    fs.process_files(paths, client, concurrency=4)
+    jobs, leg_jobs = fs.plan_fetches(fs.scan_transit_legs(ROUTES_JSON))
+    assert len(jobs) < len(leg_jobs)
+    assert len(client.calls) == len(set(client.calls)) == len(jobs)
+    assert all(stop_counts(path) == [7] * len(leg_jobs) for path in paths)
+
+
+def test_offline_build_from_a_warm_cache_makes_no_calls(tmp_path):
+    cache = fs.ResponseCache(str(tmp_path / 'cache.sqlite'))
+    try:
+        first, second = copies(tmp_path, 2)
+        fs.process_files([first], CountingClient(), cache=cache)
+        client = CountingClient()
+        fs.process_files([second], client, cache=cache, offline=True)
+        assert client.calls == []
+        assert stop_counts(second) == stop_counts(first)
+    finally:
+        cache.close()
+
+
+def test_expired_cache_entries_are_fetched_again(tmp_path):
+    cache = fs.ResponseCache(str(tmp_path / 'cache.sqlite'), ttl=3600)
+    try:
+        path, = copies(tmp_path, 1)
+        warm = CountingClient()
+        fs.process_files([path], warm, cache=cache)
+        client = CountingClient()
+        fs.process_files([path], client, cache=cache)
+        assert warm.calls and client.calls == []
+
+        # Age one entry past the TTL
+        with cache.lock:
+            cache.db.execute("UPDATE responses SET created = created - 7200 WHERE key = "
+                             "(SELECT key FROM responses ORDER BY key LIMIT 1)")
+            cache.db.commit()
+        fs.process_files([path], client, cache=cache)
+        assert len(client.calls) == 1
+    finally:
+        cache.close()
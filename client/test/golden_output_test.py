@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+import process_routes as pr
+from route_model import Segment
+
+CLIENT_DIR = os.path.dirname(pr.RULES_PATH)
+FIXTURES = os.path.join(CLIENT_DIR, 'test', 'fixtures')
+
+# (input, golden output, route id). The shipped asset is its own golden file;
+# routes_2_small is a few route2 options with thinned polylines, and its
+# golden file was written by the dict-based script the records replaced.
+GOLDEN = [
+    (os.path.join(CLIENT_DIR, 'assets', 'routes.json'), os.path.join(CLIENT_DIR, 'assets', 'routes_clean.json'), 'route1'),
+    (os.path.join(FIXTURES, 'routes_2_small.json'), os.path.join(FIXTURES, 'routes_2_small_clean.json'), 'route2'),
+]
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('input_path, golden_path, route_id', GOLDEN)
+def test_default_output_matches_golden_file(tmp_path, input_path, golden_path, route_id):
+    output = str(tmp_path / 'routes_clean.json')
+    pr.process_file(input_path, output, route_id)
+    assert read_bytes(output) == read_bytes(golden_path)
+
+
+def test_records_keep_keys_in_the_order_they_were_set():
+    seg = Segment({'mode': 'walk', 'time': 3})
+    seg['detail'] = 'Platform 4'
+    seg['waitTime'] = 2
+    seg['label'] = 'Walk'
+    assert list(seg.to_json()) == ['mode', 'time', 'detail', 'waitTime', 'label']
+    # Setting a field again keeps its place, deleting it drops it
+    seg['time'] = 4
+    del seg['detail']
+    assert list(seg.copy().to_json()) == ['mode', 'time', 'waitTime', 'label']
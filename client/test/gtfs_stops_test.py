@@ -0,0 +1,83 @@
+import os
+import shutil
+
+import pytest
+
+import gtfs_stops
+from gtfs_stops import GtfsFeed
+
+FEED = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'gtfs_tiny')
+
+# Leeds to York: the Coastliner bus stops are nearest both ends, Leeds
+# Platform 17 (Northern) is nearer than Leeds (TransPennine)
+START = {'lat': 53.7952, 'lng': -1.5480}
+END = {'lat': 53.9582, 'lng': -1.0930}
+FAR = {'lat': 51.5074, 'lng': -0.1278}
+
+TPE_STOPS = ['Garforth', 'Church Fenton']
+NT_STOPS = ['Church Fenton']
+BUS_STOPS = ['Tadcaster']
+
+
+@pytest.fixture
+def feed_path(tmp_path):
+    path = str(tmp_path / 'feed')
+    shutil.copytree(FEED, path)
+    return path
+
+
+@pytest.fixture
+def feed(feed_path, tmp_path):
+    feed = GtfsFeed.open(feed_path, str(tmp_path / 'gtfs.sqlite'))
+    yield feed
+    feed.close()
+
+
+def test_import_is_reused_while_the_feed_is_unchanged(feed_path, tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'gtfs.sqlite')
+    GtfsFeed.open(feed_path, db_path).close()
+    reads = []
+    read_feed_table = gtfs_stops.read_feed_table
+    monkeypatch.setattr(gtfs_stops, 'read_feed_table', lambda *args: reads.append(args) or read_feed_table(*args))
+
+    feed = GtfsFeed.open(feed_path, db_path)
+    assert reads == [] and len(feed.stops) == 8
+    feed.close()
+
+    with open(os.path.join(feed_path, 'stops.txt'), 'a') as f:
+        f.write('selby,Selby,53.7830,-1.0640\n')
+    feed = GtfsFeed.open(feed_path, db_path)
+    assert len(reads) == len(gtfs_stops.FEED_TABLES) and len(feed.stops) == 9
+    feed.close()
+
+
+def test_nearest_trip_without_a_line(feed):
+    assert feed.match(START, END)['stops'] == BUS_STOPS
+
+
+def test_family_match_beats_a_nearer_stop(feed):
+    # Both rail trips start further away than the bus; the nearer rail stop wins
+    result = feed.match(START, END, {'name': None, 'agency': None, 'family': 'rail'})
+    assert result == {'num_stops': 2, 'stops': NT_STOPS, 'stop_points': [[53.827, -1.228]]}
+
+
+def test_name_match_beats_a_nearer_stop(feed):
+    assert feed.match(START, END, {'name': 'TP', 'agency': None, 'family': None})['stops'] == TPE_STOPS
+    assert feed.match(START, END, {'name': None, 'agency': 'TransPennine Express', 'family': 'rail'})['stops'] == TPE_STOPS
+    # A name no trip has is ignored, leaving the family and distance
+    assert feed.match(START, END, {'name': 'X99', 'agency': None, 'family': 'rail'})['stops'] == NT_STOPS
+
+
+def test_no_stops_in_range(feed):
+    assert feed.match(START, FAR) is None
+    assert feed.match(FAR, END) is None
+    # Stops in range at both ends, but no trip from one to the other
+    assert feed.match(END, START) is None
+
+
+def test_match_all_returns_one_result_per_job_in_order(feed):
+    rail = {'name': None, 'agency': None, 'family': 'rail'}
+    jobs = [(START, END, None), (START, FAR, None), (START, END, rail), (START, END, None)]
+    results = feed.match_all(jobs)
+    assert len(results) == len(jobs)
+    assert [r and r['stops'] for r in results] == [BUS_STOPS, None, NT_STOPS, BUS_STOPS]
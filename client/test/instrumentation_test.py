@@ -0,0 +1,64 @@
+import json
+import os
+
+import pytest
+
+import process_routes as pr
+
+ROUTES_JSON = os.path.join(os.path.dirname(pr.RULES_PATH), 'assets', 'routes.json')
+
+
+@pytest.fixture(scope='module')
+def option():
+    with open(ROUTES_JSON) as f:
+        group = json.load(f)['groups'][0]
+    return group['name'], group['options'][0]
+
+
+def test_option_stats_cover_every_stage(option):
+    group_name, opt = option
+    instrumentation = pr.Instrumentation()
+    pr.parse_option_to_leg(opt, group_name, 'route1', instrumentation=instrumentation)
+    assert len(instrumentation.options) == 1
+    stats = instrumentation.options[0]
+    assert stats['option'] == opt['name']
+    assert list(stats['stages'])[0] == 'parse_segments'
+    assert list(stats['stages'])[-1] == 'labels'
+
+
+def test_option_stats_are_kept_when_a_stage_fails(option, monkeypatch):
+    group_name, opt = option
+
+    def fail(segments, leg_context):
+        raise RuntimeError('grouping failed')
+
+    monkeypatch.setattr(pr, 'group_segments', fail)
+    instrumentation = pr.Instrumentation()
+    with pytest.raises(RuntimeError):
+        pr.parse_option_to_leg(opt, group_name, 'route1', instrumentation=instrumentation)
+    assert len(instrumentation.options) == 1
+    stages = instrumentation.options[0]['stages']
+    assert 'enrichment' in stages
+    assert 'grouping' not in stages
+    assert instrumentation.stages['enrichment']['calls'] == 1
+
+
+def test_prometheus_allocated_blocks_is_a_gauge():
+    report = {
+        'input': 'routes.json',
+        'seconds': 0.5,
+        'instrumentation': {
+            'stages': {'labels': {'seconds': 0.1, 'calls': 2, 'allocatedBlocks': -40,
+                                  'segmentsIn': 3, 'segmentsOut': 3}},
+            'counters': {},
+            'options': [],
+        },
+    }
+    text = pr.format_prometheus([report])
+    assert '# TYPE route_stage_allocated_blocks gauge' in text
+    assert 'route_stage_allocated_blocks{file="routes.json",stage="labels"} -40' in text
+    assert 'route_stage_allocated_blocks_total' not in text
+    # Everything left typed as a counter only goes up
+    for line in text.splitlines():
+        if line.startswith('# TYPE') and line.endswith(' counter'):
+            assert line.split()[2].endswith('_total')
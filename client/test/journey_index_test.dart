@@ -0,0 +1,114 @@
+import 'package:flutter_test/flutter_test.dart';
+import 'package:client/models.dart';
+import 'package:client/utils/journey_index.dart';
+import 'package:client/utils/route_refs.dart';
+import 'package:client/utils/route_selector.dart';
+
+JourneyResult journey(String id, String label, int time, double cost) {
+  Leg leg(String legId, String legLabel) => Leg(
+      id: legId,
+      label: legLabel,
+      time: 0, cost: 0, distance: 0, riskScore: 0, iconId: '', lineColor: '', segments: []);
+  return JourneyResult(
+    id: id,
+    leg1: leg('$id-leg1', label),
+    leg3: leg('$id-leg3', 'leg3'),
+    time: time,
+    cost: cost,
+    risk: 0,
+    buffer: 0,
+    emissions: Emissions(val: 0, percent: 0),
+  );
+}
+
+void main() {
+  // As written by process_routes.py --journey-index for the journeys below
+  final indexJson = <String, dynamic>{
+    'order': {
+      'time': [1, 2, 0],
+      'cost': [0, 2, 1],
+      'smart': [0, 2, 1],
+    },
+    'rank': {
+      'time': [2, 0, 1],
+      'cost': [0, 2, 1],
+      'smart': [0, 2, 1],
+    },
+    'modes': ['bus', 'car', 'train'],
+    'modeMasks': [5, 6, 4],
+    'buckets': {
+      'time': {
+        'limits': [30, 60],
+        'count': [1, 2],
+        'best': {
+          'time': [1, 1],
+          'cost': [1, 2],
+        },
+      },
+    },
+  };
+
+  final journeys = [
+    journey('bus', 'Bus to Leeds Station', 70, 5),
+    journey('taxi', 'Taxi to York Station', 25, 30),
+    journey('walk', 'Walk to Leeds Station', 45, 8),
+  ];
+
+  group('JourneyIndex', () {
+    final index = JourneyIndex.fromJson(indexJson);
+
+    test('orders journeys for each tab', () {
+      expect(index.select(journeys, 'fastest', {})!.map((j) => j.id),
+          ['taxi', 'walk', 'bus']);
+      expect(index.select(journeys, 'cheapest', {})!.map((j) => j.id),
+          ['bus', 'walk', 'taxi']);
+      expect(index.select(journeys, 'smart', {})!.map((j) => j.id),
+          ['bus', 'walk', 'taxi']);
+    });
+
+    test('filters excluded modes by mask', () {
+      expect(index.excludedMask({'bus': false, 'car': true}), 1);
+      expect(index.select(journeys, 'fastest', {'bus': false})!.map((j) => j.id),
+          ['taxi', 'walk']);
+      expect(index.select(journeys, 'fastest', {'train': false}), isEmpty);
+      // Modes the index does not know about never filter anything
+      expect(index.select(journeys, 'fastest', {'bike': false})!.length, 3);
+    });
+
+    test('looks up the best journey within a limit', () {
+      expect(index.bestWithin('time', 60, 'cost'), 2);
+      expect(index.bestWithin('time', 30, 'cost'), 1);
+      expect(index.bestWithin('time', 45, 'cost'), isNull);
+      expect(index.bestWithin('cost', 10, 'time'), isNull);
+    });
+
+    test('does not apply to a different journey list', () {
+      expect(index.select(journeys.sublist(1), 'fastest', {}), isNull);
+    });
+
+    test('presorted selection matches sorting in the selector', () {
+      final indexed = index.select(journeys, 'fastest', {})!;
+      final sorted = RouteSelector.selectJourneys(journeys, 'fastest');
+      expect(
+          RouteSelector.selectJourneys(indexed, 'fastest', presorted: true)
+              .map((j) => j.id),
+          sorted.map((j) => j.id));
+    });
+  });
+
+  test('resolveRouteRefs keeps the journey index', () {
+    final resolved = resolveRouteRefs({
+      'format': 'refs',
+      'paths': [],
+      'legs': [
+        {'id': 'main', 'segments': []},
+      ],
+      'segmentOptions': {'firstMile': [], 'mainLeg': 0, 'lastMile': []},
+      'directDrive': {},
+      'mockPath': [],
+      'journeys': [],
+      'journeyIndex': indexJson,
+    });
+    expect(resolved['journeyIndex'], same(indexJson));
+  });
+}
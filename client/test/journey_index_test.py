@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+import process_routes as pr
+from route_journey_index import JOURNEY_SORT_KEYS
+from route_output import load_output
+
+ROUTES_JSON = os.path.join(os.path.dirname(pr.RULES_PATH), 'assets', 'routes.json')
+
+
+@pytest.fixture(scope='module')
+def built(tmp_path_factory):
+    output = str(tmp_path_factory.mktemp('routes') / 'routes_clean.json')
+    pr.process_file(ROUTES_JSON, output, 'route1', journey_index=True)
+    return load_output(output)
+
+
+def total_co2(data, journey):
+    main_leg = data['segmentOptions']['mainLeg']
+    return journey['leg1'].get('co2', 0) + main_leg.get('co2', 0) + journey['leg3'].get('co2', 0)
+
+
+def test_emissions_order_is_lowest_total_co2_first(built):
+    journeys = built['journeys']
+    index = built['journeyIndex']
+    co2 = [total_co2(built, j) for j in journeys]
+    # Explicit sort by total CO2, ties in output order; rounding noise between
+    # the saving and the sum is below a gram
+    expected = sorted(range(len(journeys)), key=lambda i: (round(co2[i], 6), i))
+    assert index['order']['emissions'] == expected
+    assert co2[expected[0]] < co2[expected[-1]]
+    for place, i in enumerate(index['order']['emissions']):
+        assert index['rank']['emissions'][i] == place
+
+
+def test_best_within_limits_uses_the_same_orders(built):
+    journeys = built['journeys']
+    index = built['journeyIndex']
+    co2 = [total_co2(built, j) for j in journeys]
+    for metric, bucket in index['buckets'].items():
+        for n, limit in enumerate(bucket['limits']):
+            within = [i for i in range(len(journeys)) if JOURNEY_SORT_KEYS[metric](journeys[i]) <= limit]
+            assert bucket['count'][n] == len(within)
+            greenest = min(within, key=lambda i: (round(co2[i], 6), i)) if within else None
+            assert bucket['best']['emissions'][n] == greenest
+            for key, order in index['order'].items():
+                assert bucket['best'][key][n] == next((i for i in order if i in within), None)
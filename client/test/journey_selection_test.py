@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+import process_routes as pr
+
+MAIN_LEG = {'time': 60, 'cost': 20.0, 'riskScore': 1, 'co2': 2.0}
+BUFFER = 10
+
+
+def make_pairs(count, seed):
+    # Small integer metrics so that ties and exact duplicates are common
+    rng = random.Random(seed)
+
+    def leg(name):
+        return {'id': name, 'time': rng.randint(0, 6), 'cost': rng.randint(0, 4),
+                'riskScore': rng.randint(0, 2), 'co2': rng.randint(0, 3)}
+
+    return [(leg(f'l1-{i}'), leg(f'l3-{i}')) for i in range(count)]
+
+
+def metrics(pair):
+    return pr.journey_metrics(pair[0], MAIN_LEG, pair[1], BUFFER)
+
+
+def score(pair, weights):
+    time, cost, risk, co2 = metrics(pair)
+    return weights['time'] * time + weights['cost'] * cost + weights['risk'] * risk + weights['co2'] * co2
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_pareto_keeps_exactly_the_non_dominated_pairs_in_input_order(seed):
+    pairs = make_pairs(60, seed)
+    kept = pr.pareto_pairs(pairs, MAIN_LEG, BUFFER)
+    expected = [pair for pair in pairs
+                if not any(pr.dominates(metrics(other), metrics(pair)) for other in pairs)]
+    assert kept == expected
+    assert len(kept) < len(pairs)
+
+
+def test_pareto_keeps_duplicates_and_handles_empty_input():
+    pair = make_pairs(1, 0)[0]
+    worse = ({**pair[0], 'time': pair[0]['time'] + 1}, pair[1])
+    assert pr.pareto_pairs([worse, pair, pair], MAIN_LEG, BUFFER) == [pair, pair]
+    assert pr.pareto_pairs([], MAIN_LEG, BUFFER) == []
+
+
+@pytest.mark.parametrize('weights', [None, {'time': 0.0, 'cost': 0.0, 'risk': 0.0, 'co2': 1.0},
+                                     {'time': 1.0, 'cost': 2.0, 'risk': 0.5, 'co2': 0.0}])
+@pytest.mark.parametrize('k', [0, 1, 7, 60, 100])
+def test_top_k_keeps_the_k_best_with_ties_in_input_order(k, weights):
+    pairs = make_pairs(60, 1)
+    kept = pr.top_k_pairs(pairs, MAIN_LEG, BUFFER, k, weights)
+    by_score = sorted(range(len(pairs)), key=lambda i: (score(pairs[i], weights or pr.SCORE_WEIGHTS), i))
+    assert kept == [pairs[i] for i in sorted(by_score[:k])]
+    assert len(kept) == min(k, len(pairs))
+
+
+def test_top_k_breaks_ties_by_input_order():
+    pair = make_pairs(1, 2)[0]
+    tied = [(dict(pair[0], id=f'l1-{i}'), pair[1]) for i in range(4)]
+    assert pr.top_k_pairs(tied, MAIN_LEG, BUFFER, 2) == tied[:2]
@@ -0,0 +1,83 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import process_routes as pr
+
+ROUTES_JSON = os.path.join(os.path.dirname(pr.RULES_PATH), 'assets', 'routes.json')
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def edit_json(path, edit):
+    with open(path) as f:
+        data = json.load(f)
+    edit(data)
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+@pytest.fixture
+def cached(tmp_path, monkeypatch):
+    input_path = str(tmp_path / 'routes.json')
+    output_path = str(tmp_path / 'routes_clean.json')
+    rules_path = str(tmp_path / 'route_rules.json')
+    cache_dir = str(tmp_path / 'cache')
+    shutil.copy(ROUTES_JSON, input_path)
+    shutil.copy(pr.RULES_PATH, rules_path)
+    monkeypatch.setattr(pr, 'RULES_PATH', rules_path)
+    load_rules = pr.load_rules
+    monkeypatch.setattr(pr, 'load_rules', lambda: load_rules(rules_path))
+    # reload_rules replaces these, keep the module's own for the other tests
+    monkeypatch.setattr(pr, 'RULES', pr.RULES)
+    monkeypatch.setattr(pr, 'PRICING', pr.PRICING)
+    monkeypatch.setattr(pr, 'RULES_VERSION', pr.RULES_VERSION)
+
+    def build():
+        return pr.process_file(input_path, output_path, 'route1', cache_dir=cache_dir)
+
+    first = build()
+    assert first['cacheHits'] == 0 and first['cacheMisses'] == first['legs'] > 1
+    return build, input_path, output_path, rules_path
+
+
+def test_second_build_reuses_every_leg(cached):
+    build, _, output_path, _ = cached
+    expected = read_bytes(output_path)
+    report = build()
+    assert (report['cacheHits'], report['cacheMisses']) == (report['legs'], 0)
+    assert read_bytes(output_path) == expected
+
+
+def test_edited_option_is_parsed_again(cached):
+    build, input_path, output_path, _ = cached
+
+    def edit(data):
+        group = next(g for g in data['groups'] if 'Group 1' in g['name'])
+        group['options'][0]['legs'][0]['duration_value'] += 600
+
+    edit_json(input_path, edit)
+    report = build()
+    assert (report['cacheHits'], report['cacheMisses']) == (report['legs'] - 1, 1)
+
+    # The same as a build without the cache
+    uncached_path = output_path + '.uncached.json'
+    pr.process_file(input_path, uncached_path, 'route1')
+    assert read_bytes(output_path) == read_bytes(uncached_path)
+
+
+def test_edited_rules_parse_every_leg_again(cached):
+    build, _, _, rules_path = cached
+
+    def edit(rules):
+        rules['pricing']['york']['parking'] += 1
+
+    edit_json(rules_path, edit)
+    pr.reload_rules()
+    report = build()
+    assert (report['cacheHits'], report['cacheMisses']) == (0, report['legs'])
@@ -0,0 +1,100 @@
+import json
+import math
+import os
+
+import pytest
+
+import process_routes as pr
+
+CLIENT_DIR = os.path.dirname(pr.RULES_PATH)
+INPUTS = [
+    (os.path.join(CLIENT_DIR, 'assets', 'routes.json'), 'route1'),
+    (os.path.join(CLIENT_DIR, 'assets', 'routes_2.json'), 'route2'),
+]
+TOLERANCES = [100.0, 20.0, 5.0]
+
+
+def segment_distance(point, a, b, kx, ky):
+    # Metres from point to the segment a-b, in the projection simplify_path uses
+    px, py = (point[1] - a[1]) * kx, (point[0] - a[0]) * ky
+    dx, dy = (b[1] - a[1]) * kx, (b[0] - a[0]) * ky
+    length_sq = dx * dx + dy * dy
+    t = max(0.0, min(1.0, (px * dx + py * dy) / length_sq)) if length_sq > 0 else 0.0
+    return math.hypot(px - t * dx, py - t * dy)
+
+
+def kept_indices(part, whole):
+    # Positions in whole of the points of part, matched in order; None if part
+    # is not a subsequence of whole
+    indices = []
+    i = 0
+    for pt in part:
+        while i < len(whole) and whole[i] != pt:
+            i += 1
+        if i == len(whole):
+            return None
+        indices.append(i)
+        i += 1
+    return indices
+
+
+def check_level(path, level, tolerance):
+    indices = kept_indices(level, path)
+    assert indices is not None
+    if not path:
+        assert level == []
+        return
+    assert indices[0] == 0 and indices[-1] == len(path) - 1
+    # Every dropped point is within tolerance of the line that replaced it
+    ky = pr.EARTH_RADIUS_M * math.pi / 180
+    kx = ky * math.cos(math.radians(path[0][0]))
+    for first, last in zip(indices, indices[1:]):
+        for point in path[first + 1:last]:
+            assert segment_distance(point, path[first], path[last], kx, ky) <= tolerance + 1e-6
+
+
+def segments(data):
+    for leg in [data['segmentOptions']['mainLeg']] + data['segmentOptions']['firstMile'] + \
+            data['segmentOptions']['lastMile']:
+        for seg in leg['segments']:
+            yield seg
+            yield from seg.get('subSegments', [])
+
+
+@pytest.fixture(scope='module', params=INPUTS, ids=['route1', 'route2'])
+def built(request, tmp_path_factory):
+    input_path, route_id = request.param
+    output = str(tmp_path_factory.mktemp('lod') / 'routes_clean.json')
+    pr.process_file(input_path, output, route_id, lod_tolerances=TOLERANCES)
+    with open(output) as f:
+        return json.load(f)
+
+
+def test_levels_are_subsets_within_tolerance(built):
+    checked = 0
+    for seg in segments(built):
+        if 'path' not in seg:
+            continue
+        assert len(seg['pathLod']) == len(TOLERANCES)
+        for level, tolerance in zip(seg['pathLod'], TOLERANCES):
+            check_level(seg['path'], level, tolerance)
+        # Coarse to fine
+        assert [len(level) for level in seg['pathLod']] == sorted(len(level) for level in seg['pathLod'])
+        checked += 1
+    assert checked > 10
+
+
+def test_mock_path_levels(built):
+    assert built['lodTolerances'] == TOLERANCES
+    for level, tolerance in zip(built['mockPathLod'], TOLERANCES):
+        check_level(built['mockPath'], level, tolerance)
+    assert len(built['mockPathLod'][0]) < len(built['mockPath'])
+
+
+def test_short_paths_are_kept_whole():
+    assert pr.simplify_path([], 100) == []
+    assert pr.simplify_path([[53.8, -1.5]], 100) == [[53.8, -1.5]]
+    assert pr.simplify_path([[53.8, -1.5], [53.9, -1.4]], 100) == [[53.8, -1.5], [53.9, -1.4]]
+    # A closed loop keeps its far point
+    loop = [[53.8, -1.5], [53.81, -1.5], [53.8, -1.5]]
+    assert pr.simplify_path(loop, 100) == loop
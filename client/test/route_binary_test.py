@@ -0,0 +1,59 @@
+import math
+
+import pytest
+
+from route_binary import VERSION, open_route_asset, write_route_binary
+
+
+def ref_data():
+    return {
+        'format': 'refs',
+        'paths': [[[53.8, -1.5], [53.9, -1.4]]],
+        'legs': [{
+            'id': 'walk', 'label': 'Walk', 'cost': None, 'distance': float('nan'), 'co2': 0.25,
+            'segments': [{'mode': 'walk', 'co2': None, 'cost': float('nan'), 'pathRefs': [0]}],
+        }],
+        'segmentOptions': {'firstMile': [0], 'mainLeg': 0, 'lastMile': [0]},
+        'directDrive': {'time': 50},
+        'mockPath': [[53.8, -1.5]],
+        'journeys': [{'id': 'walk-walk', 'leg1': 0, 'leg3': 0, 'cost': float('nan'),
+                      'emissions': {'val': None, 'percent': 10, 'text': None}}],
+    }
+
+
+@pytest.fixture
+def asset_path(tmp_path):
+    path = str(tmp_path / 'routes.bin')
+    write_route_binary(path, ref_data())
+    return path
+
+
+def test_null_and_nan_floats_are_told_apart(asset_path):
+    with open_route_asset(asset_path) as asset:
+        leg = asset.leg(0)
+        assert leg['cost'] is None
+        assert math.isnan(leg['distance'])
+        assert leg['co2'] == 0.25
+        segment = leg['segments'][0]
+        assert segment['co2'] is None
+        assert math.isnan(segment['cost'])
+        journey = asset.journey(0)
+        assert math.isnan(journey['cost'])
+        assert journey['emissions'] == {'val': None, 'percent': 10, 'text': None}
+
+
+def test_meta_is_parsed_on_first_use(asset_path):
+    with open_route_asset(asset_path) as asset:
+        assert asset._meta is None
+        assert asset.leg(0)['id'] == 'walk'
+        assert asset._meta is None
+        assert asset.to_init_data()['directDrive'] == {'time': 50}
+        assert asset._meta is not None
+
+
+def test_older_versions_are_rejected(asset_path):
+    with open(asset_path, 'r+b') as f:
+        f.seek(4)
+        f.write((VERSION - 1).to_bytes(2, 'little'))
+    with pytest.raises(ValueError, match='format version'):
+        open_route_asset(asset_path)
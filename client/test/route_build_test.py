@@ -0,0 +1,45 @@
+import json
+import os
+
+import pytest
+
+import process_routes as pr
+from route_build import build_routes, load_manifest
+
+CLIENT_DIR = os.path.dirname(pr.RULES_PATH)
+INPUTS = [
+    (os.path.join(CLIENT_DIR, 'assets', 'routes.json'), 'route1'),
+    (os.path.join(CLIENT_DIR, 'test', 'fixtures', 'routes_2_small.json'), 'route2'),
+    (os.path.join(CLIENT_DIR, 'assets', 'routes_2.json'), 'route2'),
+]
+
+
+def entries_in(directory):
+    return [(input_path, str(directory / f'{n}_clean.json'), route_id)
+            for n, (input_path, route_id) in enumerate(INPUTS)]
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture(scope='module')
+def serial(tmp_path_factory):
+    entries = entries_in(tmp_path_factory.mktemp('serial'))
+    build_routes(pr.process_file, entries, jobs=1)
+    return [read_bytes(output) for _, output, _ in entries]
+
+
+@pytest.mark.parametrize('pool', [{'jobs': 2}, {'option_jobs': 2}])
+def test_parallel_output_matches_the_serial_build(tmp_path, serial, pool):
+    entries = entries_in(tmp_path)
+    reports = build_routes(pr.process_file, entries, **pool)
+    assert [r['output'] for r in reports] == [output for _, output, _ in entries]
+    assert [read_bytes(output) for _, output, _ in entries] == serial
+
+
+def test_load_manifest(tmp_path):
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps([{'input': 'in.json', 'output': 'out.json', 'routeId': 'route1'}]))
+    assert load_manifest(str(path)) == [('in.json', 'out.json', 'route1')]
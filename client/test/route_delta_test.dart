@@ -0,0 +1,185 @@
+import 'dart:convert';
+
+import 'package:flutter_test/flutter_test.dart';
+import 'package:client/models.dart';
+import 'package:client/utils/route_delta.dart';
+
+void main() {
+  group('applyRouteDelta', () {
+    Map<String, dynamic> leg(String id, double cost) => {
+          'id': id,
+          'label': id,
+          'detail': '',
+          'time': 10,
+          'cost': cost,
+          'distance': 1.0,
+          'riskScore': 0,
+          'iconId': 'bus',
+          'lineColor': '#000000',
+          'co2': 0.1,
+          'segments': [],
+        };
+
+    Map<String, dynamic> journey(Map<String, dynamic> leg1, Map<String, dynamic> leg3) => {
+          'id': '${leg1['id']}-${leg3['id']}',
+          'leg1': leg1,
+          'leg3': leg3,
+          'cost': (leg1['cost'] as double) + (leg3['cost'] as double),
+          'time': 60,
+          'buffer': 10,
+          'risk': 0,
+          'emissions': {'val': 1.0, 'percent': 10, 'text': null},
+        };
+
+    // Leg ids repeat between first and last mile, as in the real assets
+    final firstBus = leg('bus', 2.0);
+    final firstCar = leg('car', 8.0);
+    final lastBus = leg('bus', 3.0);
+    final main = leg('train', 20.0);
+    final cached = <String, dynamic>{
+      'segmentOptions': {
+        'firstMile': [firstBus, firstCar],
+        'mainLeg': main,
+        'lastMile': [lastBus],
+      },
+      'directDrive': {'time': 50, 'cost': 30.0, 'distance': 40.0},
+      'mockPath': [
+        [53.8, -1.5],
+      ],
+      'journeys': [journey(firstBus, lastBus), journey(firstCar, lastBus)],
+      'build': 'aaaa',
+    };
+
+    final cheaperCar = leg('car', 5.0);
+    final bike = leg('bike', 0.0);
+    final delta = <String, dynamic>{
+      'format': 'delta',
+      'from': 'aaaa',
+      'to': 'bbbb',
+      'keys': ['segmentOptions', 'directDrive', 'mockPath', 'journeys', 'build'],
+      // Legs are keyed by position, so the bike takes the bus's place
+      'segmentOptions': {
+        'firstMile': ['firstMile/0', 'firstMile/1'],
+        'mainLeg': 'mainLeg',
+        'lastMile': ['lastMile/0'],
+      },
+      'legs': {
+        'added': <String, dynamic>{},
+        'changed': {'firstMile/0': bike, 'firstMile/1': cheaperCar},
+        'removed': [],
+      },
+      'journeys': {
+        'added': {
+          'bike-bus': {...journey(bike, lastBus), 'leg1': 'firstMile/0', 'leg3': 'lastMile/0'},
+        },
+        'changed': {
+          'car-bus': {...journey(cheaperCar, lastBus), 'leg1': 'firstMile/1', 'leg3': 'lastMile/0'},
+        },
+        'removed': ['bus-bus'],
+        'order': ['bike-bus', 'car-bus'],
+      },
+      'values': {
+        'added': <String, dynamic>{},
+        'changed': {
+          'mockPath': [
+            [53.8, -1.5],
+            [53.9, -1.4],
+          ],
+        },
+        'removed': [],
+      },
+    };
+
+    test('applies added, changed and removed legs and journeys', () {
+      final updated = applyRouteDelta(cached, delta);
+      expect(updated['build'], 'bbbb');
+      expect(updated.keys.toList(), delta['keys']);
+
+      final options = updated['segmentOptions'] as Map<String, dynamic>;
+      expect((options['firstMile'] as List).map((l) => l['id']), ['bike', 'car']);
+      expect((options['firstMile'] as List)[1]['cost'], 5.0);
+      expect(options['lastMile'][0], same(lastBus));
+
+      final journeys = updated['journeys'] as List;
+      expect(journeys.map((j) => j['id']), ['bike-bus', 'car-bus']);
+      expect(journeys[1]['leg1'], same(cheaperCar));
+      expect(journeys[1]['cost'], 8.0);
+      expect((updated['mockPath'] as List).length, 2);
+      expect(updated['directDrive'], same(cached['directDrive']));
+
+      // The result is a regular inline asset
+      final initData = InitData.fromJson(updated);
+      expect(initData.journeys.length, 2);
+      expect(initData.segmentOptions.firstMile.first.id, 'bike');
+    });
+
+    test('keeps unchanged journeys in order without an explicit order', () {
+      final empty = <String, dynamic>{};
+      final update = <String, dynamic>{
+        ...delta,
+        'journeys': {'added': empty, 'changed': empty, 'removed': []},
+        'legs': {'added': empty, 'changed': empty, 'removed': []},
+        'segmentOptions': {
+          'firstMile': ['firstMile/0', 'firstMile/1'],
+          'mainLeg': 'mainLeg',
+          'lastMile': ['lastMile/0'],
+        },
+      };
+      final updated = applyRouteDelta(cached, update);
+      final journeys = updated['journeys'] as List;
+      expect(journeys.map((j) => j['id']), ['bus-bus', 'car-bus']);
+      expect(journeys[0]['leg3'], same(lastBus));
+    });
+
+    test('tells apart legs and journeys with repeated ids', () {
+      // Read back from JSON, so journeys hold copies of the option legs.
+      // The delta is as written by process_routes.py --delta.
+      final repeated = jsonDecode(jsonEncode({
+        'segmentOptions': {
+          'firstMile': [leg('bus', 2.0), leg('bus', 3.0)],
+          'mainLeg': main,
+          'lastMile': [lastBus],
+        },
+        'journeys': [journey(leg('bus', 2.0), lastBus), journey(leg('bus', 3.0), lastBus)],
+        'build': 'aaaa',
+      })) as Map<String, dynamic>;
+      final update = jsonDecode(jsonEncode({
+        'format': 'delta',
+        'from': 'aaaa',
+        'to': 'bbbb',
+        'keys': ['segmentOptions', 'journeys', 'build'],
+        'segmentOptions': {
+          'firstMile': ['firstMile/0', 'firstMile/1'],
+          'mainLeg': 'mainLeg',
+          'lastMile': ['lastMile/0'],
+        },
+        'legs': {
+          'added': {},
+          'changed': {'firstMile/1': leg('bus', 4.0)},
+          'removed': [],
+        },
+        'journeys': {
+          'added': {},
+          'changed': {
+            'bus-bus#1': {...journey(leg('bus', 4.0), lastBus), 'leg1': 'firstMile/1', 'leg3': 'lastMile/0'},
+          },
+          'removed': [],
+        },
+        'values': {'added': {}, 'changed': {}, 'removed': []},
+      })) as Map<String, dynamic>;
+
+      final updated = applyRouteDelta(repeated, update);
+      final options = updated['segmentOptions'] as Map<String, dynamic>;
+      expect((options['firstMile'] as List).map((l) => l['cost']), [2.0, 4.0]);
+      final journeys = updated['journeys'] as List;
+      expect(journeys.map((j) => j['id']), ['bus-bus', 'bus-bus']);
+      expect(journeys.map((j) => j['leg1']['cost']), [2.0, 4.0]);
+      expect(journeys[1]['cost'], 7.0);
+    });
+
+    test('rejects a delta for another build', () {
+      expect(() => applyRouteDelta({...cached, 'build': 'cccc'}, delta),
+          throwsStateError);
+    });
+  });
+}
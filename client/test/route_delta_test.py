@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import route_delta
+
+
+def leg(leg_id, cost):
+    return {'id': leg_id, 'label': leg_id, 'time': 10, 'cost': cost, 'segments': []}
+
+
+def journey(leg1, leg3):
+    return {'id': f"{leg1['id']}-{leg3['id']}", 'leg1': leg1, 'leg3': leg3,
+            'cost': leg1['cost'] + leg3['cost']}
+
+
+def output(first_mile, last_mile, pairs):
+    return {
+        'segmentOptions': {'firstMile': first_mile, 'mainLeg': leg('train', 20.0), 'lastMile': last_mile},
+        'mockPath': [[53.8, -1.5]],
+        'journeys': [journey(first_mile[i], last_mile[k]) for i, k in pairs],
+    }
+
+
+def roundtrip(old, new):
+    # Inline outputs are read back from JSON, so journeys hold copies of their legs
+    old, new = json.loads(json.dumps(old)), json.loads(json.dumps(new))
+    previous = route_delta.build_manifest(old)
+    manifest = route_delta.build_manifest(new)
+    old['build'], new['build'] = previous['build'], manifest['build']
+    delta = route_delta.build_delta(previous, manifest, new)
+    return delta, route_delta.apply_delta(old, delta), new
+
+
+def test_legs_with_repeated_ids_in_a_slot():
+    # Two first-mile legs share an id, as do their journeys
+    old = output([leg('bus', 2.0), leg('bus', 3.0)], [leg('bus', 1.0)], [(0, 0), (1, 0)])
+    new = output([leg('bus', 2.0), leg('bus', 4.0)], [leg('bus', 1.0)], [(0, 0), (1, 0)])
+    delta, applied, new = roundtrip(old, new)
+    assert list(delta['legs']['changed']) == ['firstMile/1']
+    assert list(delta['journeys']['changed']) == ['bus-bus#1']
+    assert applied == new
+
+
+def test_journey_only_legs_and_reordering():
+    arrived = leg('empty_last_mile', 0.0)
+    old = output([leg('car', 8.0), leg('bus', 2.0)], [leg('walk', 0.0)], [(0, 0), (1, 0)])
+    old['journeys'].append(journey(old['segmentOptions']['firstMile'][0], arrived))
+    new = output([leg('bus', 2.0), leg('bike', 0.0)], [leg('walk', 0.0)], [(1, 0), (0, 0)])
+    new['journeys'].append(journey(leg('bike', 0.0), arrived))
+    delta, applied, new = roundtrip(old, new)
+    assert delta['segmentOptions']['firstMile'] == ['firstMile/0', 'firstMile/1']
+    assert delta['journeys']['order'] == ['bike-walk', 'bus-walk', 'bike-empty_last_mile']
+    assert 'journey/0' not in delta['legs']['changed']
+    assert applied == new
+
+
+def test_delta_for_another_build_is_rejected():
+    old = output([leg('bus', 2.0)], [leg('bus', 1.0)], [(0, 0)])
+    new = output([leg('bus', 5.0)], [leg('bus', 1.0)], [(0, 0)])
+    delta, _, _ = roundtrip(old, new)
+    with pytest.raises(ValueError):
+        route_delta.apply_delta(dict(old, build='cccc'), delta)
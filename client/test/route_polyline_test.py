@@ -0,0 +1,68 @@
+import json
+import os
+
+import pytest
+
+import process_routes as pr
+import route_polyline
+from route_polyline import decode_path_batch, decode_polyline, decode_polyline_batch, encode_polyline
+
+CLIENT_DIR = os.path.dirname(pr.RULES_PATH)
+ASSETS = [os.path.join(CLIENT_DIR, 'assets', name) for name in ['routes.json', 'routes_2.json']]
+
+EDGE_CASES = [
+    '',
+    # Google's reference example, negative deltas on both axes
+    '_p~iF~ps|U_ulLnnqC_mqNvxq`@',
+    encode_polyline([[-33.5, -70.25], [-33.6, -70.1], [-33.4, -70.3]]),
+    # A single point
+    encode_polyline([[53.8, -1.55]]),
+    # Deltas wide enough to need the most chunks per value
+    encode_polyline([[89.99999, 179.99999], [-89.99999, -179.99999], [0.00001, -0.00001]]),
+]
+
+
+def asset_polylines():
+    polylines = []
+    for path in ASSETS:
+        with open(path) as f:
+            polylines += pr.collect_polylines(json.load(f)['groups'])
+    return polylines
+
+
+@pytest.fixture(params=['numpy', 'array'])
+def decoder(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(route_polyline, 'np', None)
+    return request.param
+
+
+def test_reference_decoder_on_edge_cases():
+    assert decode_polyline(EDGE_CASES[1]) == [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+    assert decode_polyline(EDGE_CASES[3]) == [[53.8, -1.55]]
+    # Five or six chunks for each of the six values
+    assert len(EDGE_CASES[4]) >= 5 * 6
+    assert decode_polyline(EDGE_CASES[4]) == [[89.99999, 179.99999], [-89.99999, -179.99999], [0.00001, -0.00001]]
+
+
+@pytest.mark.parametrize('polylines', [EDGE_CASES, EDGE_CASES[::-1], [''], ['', ''], EDGE_CASES[3:4]])
+def test_batch_matches_reference_on_edge_cases(decoder, polylines):
+    paths = decode_polyline_batch(polylines)
+    assert paths == {p: decode_polyline(p) for p in polylines}
+
+
+def test_batch_matches_reference_on_shipped_assets(decoder):
+    polylines = asset_polylines()
+    assert polylines
+    paths = decode_polyline_batch(polylines)
+    for polyline_str in polylines:
+        assert paths[polyline_str] == decode_polyline(polyline_str)
+
+
+def test_path_batch_matches_reference(decoder):
+    polylines = EDGE_CASES + asset_polylines()
+    paths = decode_path_batch(polylines)
+    for polyline_str in polylines:
+        assert list(paths[polyline_str]) == decode_polyline(polyline_str)
@@ -0,0 +1,127 @@
+import 'package:flutter_test/flutter_test.dart';
+import 'package:client/models.dart';
+import 'package:client/utils/route_refs.dart';
+
+void main() {
+  group('resolveRouteRefs', () {
+    Map<String, dynamic> leg(String id, List<Map<String, dynamic>> segments) => {
+          'id': id,
+          'label': id,
+          'detail': '',
+          'time': 10,
+          'cost': 1.0,
+          'distance': 1.0,
+          'riskScore': 0,
+          'iconId': 'train',
+          'lineColor': '#000000',
+          'co2': 0.1,
+          'segments': segments,
+        };
+
+    Map<String, dynamic> segment(String mode, List<int> pathRefs) => {
+          'mode': mode,
+          'label': mode,
+          'lineColor': '#000000',
+          'iconId': mode,
+          'time': 5,
+          'cost': 0.0,
+          'pathRefs': pathRefs,
+        };
+
+    final refs = <String, dynamic>{
+      'format': 'refs',
+      'paths': [
+        [
+          [53.8, -1.5],
+          [53.9, -1.4],
+        ],
+        [
+          [54.0, -1.3],
+        ],
+      ],
+      'legs': [
+        leg('bus', [segment('bus', [0])]),
+        leg('train_main', [
+          {
+            ...segment('train_group', [0, 1]),
+            'subSegments': [segment('train', [0]), segment('train', [1])],
+          },
+        ]),
+        leg('uber', [segment('car', [])]),
+      ],
+      'segmentOptions': {
+        'firstMile': [0],
+        'mainLeg': 1,
+        'lastMile': [2],
+      },
+      'directDrive': {'time': 60, 'cost': 10.0, 'distance': 20.0, 'co2': 5.0},
+      'mockPath': [
+        [53.8, -1.5],
+      ],
+      'journeys': [
+        {
+          'id': 'bus-uber',
+          'leg1': 0,
+          'leg3': 2,
+          'cost': 2.0,
+          'time': 20,
+          'buffer': 10,
+          'risk': 0,
+          'emissions': {'val': 1.0, 'percent': 10, 'text': null},
+        },
+      ],
+    };
+
+    test('returns inline assets unchanged', () {
+      final inline = <String, dynamic>{'segmentOptions': {}, 'journeys': []};
+      expect(identical(resolveRouteRefs(inline), inline), isTrue);
+    });
+
+    test('expands leg and path references', () {
+      final initData = InitData.fromJson(resolveRouteRefs(refs));
+
+      expect(initData.segmentOptions.firstMile.single.id, 'bus');
+      expect(initData.segmentOptions.firstMile.single.segments.single.path!.length, 2);
+
+      final group = initData.segmentOptions.mainLeg.segments.single;
+      expect(group.path!.length, 3);
+      expect(group.path!.last.latitude, closeTo(54.0, 0.00001));
+      expect(group.subSegments!.last.path!.single.longitude, closeTo(-1.3, 0.00001));
+
+      final journey = initData.journeys.single;
+      expect(journey.leg1.id, 'bus');
+      expect(journey.leg3.id, 'uber');
+      expect(journey.leg3.segments.single.path, isEmpty);
+    });
+
+    test('decodes encoded polyline path tables', () {
+      const encoded = '_p~iF~ps|U_ulLnnqC_mqNvxq`@';
+      final initData = InitData.fromJson(resolveRouteRefs({
+        ...refs,
+        'pathEncoding': 'polyline',
+        'paths': [encoded, encoded],
+        'mockPath': encoded,
+      }));
+
+      final group = initData.segmentOptions.mainLeg.segments.single;
+      expect(group.path!.length, 6);
+      expect(group.path!.first.latitude, closeTo(38.5, 0.00001));
+      expect(group.path!.last.longitude, closeTo(-126.453, 0.00001));
+      expect(initData.mockPath.length, 3);
+    });
+
+    test('Segment.fromJson decodes an encoded path string', () {
+      final segment = Segment.fromJson({
+        'mode': 'bus',
+        'label': 'Bus 24',
+        'lineColor': '#000000',
+        'iconId': 'bus',
+        'time': 12,
+        'path': '_p~iF~ps|U_ulLnnqC_mqNvxq`@',
+      });
+
+      expect(segment.path!.length, 3);
+      expect(segment.path![1].latitude, closeTo(40.7, 0.00001));
+    });
+  });
+}
@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+import process_routes as pr
+from route_output import load_output
+
+ROUTES_2_JSON = os.path.join(os.path.dirname(pr.RULES_PATH), 'assets', 'routes_2.json')
+
+
+@pytest.fixture(scope='module')
+def route2(tmp_path_factory):
+    output = str(tmp_path_factory.mktemp('routes') / 'routes_2_clean.json')
+    pr.process_file(ROUTES_2_JSON, output, 'route2')
+    return load_output(output)
+
+
+def test_journey_buffer_comes_from_the_route_rules():
+    assert pr.RULES.journey_buffer('route1') == 10
+    assert pr.RULES.journey_buffer('route2') == 0
+    # Routes without an entry use the file-wide default
+    assert pr.RULES.journey_buffer('route9') == 10
+    assert pr.RULES.route_rules('route9', 'labels', 'Drive to Stourton P&R') == []
+
+
+def test_price_hub_matches_anywhere_in_a_station_name():
+    assert pr.RULES.price_hub('Howden for Eastrington') == 'eastrington'
+    assert pr.RULES.price_hub('Leeds') is None
+
+
+def test_route2_access_options_follow_the_rules(route2):
+    first_mile = {leg['id']: leg for leg in route2['segmentOptions']['firstMile']}
+    train = next(leg for leg in first_mile.values() if leg['label'] == 'Drive to York Station')
+    transfer = [seg for seg in train['segments'] if seg['label'] == 'Transfer']
+    assert [seg['time'] for seg in transfer] == [10]
+
+    park_and_ride = [leg for leg in first_mile.values() if 'P&R' in leg['label']]
+    assert sorted(leg['label'] for leg in park_and_ride) == [
+        'Drive via Elland Road P&R to Leeds',
+        'Drive via Stourton P&R to Leeds',
+        'Drive via Temple Green P&R to Leeds',
+    ]
+    for journey in route2['journeys']:
+        if 'P&R' in journey['leg1']['label']:
+            assert journey['leg3']['id'] == 'empty_last_mile'
+        assert journey['buffer'] == 0
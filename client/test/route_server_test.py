@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+from http.client import HTTPConnection
+
+import pytest
+
+import process_routes as pr
+import route_server
+
+ROUTES_JSON = os.path.join(os.path.dirname(pr.RULES_PATH), 'assets', 'routes.json')
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    output = str(tmp_path_factory.mktemp('routes') / 'routes_clean.json')
+    pr.process_file(ROUTES_JSON, output, 'route1')
+    server = route_server.create_server([(ROUTES_JSON, output, 'route1')], port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get(server, path):
+    conn = HTTPConnection(*server.server_address[:2], timeout=10)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def total_co2(journey, main_leg):
+    return journey['leg1'].get('co2', 0) + main_leg.get('co2', 0) + journey['leg3'].get('co2', 0)
+
+
+def test_emissions_sort_is_lowest_co2_first(server):
+    status, body = get(server, '/api/routes/route1/journeys?sort=emissions&view=full&limit=1000')
+    assert status == 200
+    main_leg = server.routes['route1'].init_data['segmentOptions']['mainLeg']
+    co2 = [total_co2(j, main_leg) for j in body['journeys']]
+    assert len(co2) == body['total'] > 1
+    assert co2 == sorted(co2)
+    assert co2[0] < co2[-1]
+
+
+def test_sorts_are_ascending(server):
+    for sort, field in [('time', 'time'), ('cost', 'cost'), ('risk', 'risk')]:
+        _, body = get(server, f'/api/routes/route1/journeys?sort={sort}&limit=1000')
+        values = [j[field] for j in body['journeys']]
+        assert values == sorted(values), sort
+
+
+def test_bad_query_is_rejected(server):
+    status, body = get(server, '/api/routes/route1/journeys?sort=colour')
+    assert status == 400
+    assert 'sort' in body['error']
+
+
+def test_legs_are_addressed_by_slot_and_position(server):
+    options = server.routes['route1'].init_data['segmentOptions']
+    first_ids = [leg['id'] for leg in options['firstMile']]
+    last_ids = [leg['id'] for leg in options['lastMile']]
+    shared = set(first_ids) & set(last_ids)
+    assert shared  # route1 repeats bus, uber and cycle
+    leg_id = sorted(shared)[0]
+
+    _, first = get(server, f'/api/routes/route1/legs/firstMile/{first_ids.index(leg_id)}')
+    _, last = get(server, f'/api/routes/route1/legs/lastMile%2F{last_ids.index(leg_id)}')
+    assert first['id'] == last['id'] == leg_id
+    assert first['label'] == options['firstMile'][first_ids.index(leg_id)]['label']
+    assert last['label'] == options['lastMile'][last_ids.index(leg_id)]['label']
+    assert first['label'] != last['label']
+    assert first['key'] == f'firstMile/{first_ids.index(leg_id)}'
+
+    status, _ = get(server, f'/api/routes/route1/legs/{leg_id}')
+    assert status == 404
+
+
+def test_journeys_carry_their_leg_keys(server):
+    _, full = get(server, '/api/routes/route1/journeys?view=full&limit=1000')
+    _, summary = get(server, '/api/routes/route1/journeys?limit=1000')
+    for journey, brief in zip(full['journeys'], summary['journeys']):
+        assert brief['leg1'] == journey['leg1Key']
+        assert brief['leg3'] == journey['leg3Key']
+        for field in ['leg1', 'leg3']:
+            _, leg = get(server, '/api/routes/route1/legs/' + journey[field + 'Key'])
+            del leg['key']
+            assert leg == journey[field]
+
+
+def test_unexpected_errors_are_answered_with_500(server, monkeypatch, capsys):
+    def search(route, query):
+        raise RuntimeError('search failed')
+
+    monkeypatch.setattr(route_server.RouteData, 'search', search)
+    status, body = get(server, '/api/routes/route1/journeys?sort=time&limit=7')
+    assert status == 500
+    assert body == {'error': 'Internal server error'}
+    assert 'RuntimeError: search failed' in capsys.readouterr().err
+
+    # The server carries on
+    monkeypatch.undo()
+    status, body = get(server, '/api/routes/route1/journeys?sort=time&limit=7')
+    assert status == 200 and len(body['journeys']) == 7
@@ -0,0 +1,155 @@
+import 'dart:convert';
+
+import 'package:flutter_test/flutter_test.dart';
+import 'package:client/models.dart';
+import 'package:client/utils/route_shards.dart';
+
+void main() {
+  group('RouteShards', () {
+    Map<String, dynamic> leg(String id, String shard) => {
+          'id': id,
+          'label': id,
+          'detail': '',
+          'time': 10,
+          'cost': 1.0,
+          'distance': 1.0,
+          'riskScore': 0,
+          'iconId': 'train',
+          'lineColor': '#000000',
+          'co2': 0.1,
+          'shard': shard,
+        };
+
+    Map<String, dynamic> segment(String mode, List<List<double>> path) => {
+          'mode': mode,
+          'label': mode,
+          'lineColor': '#000000',
+          'iconId': mode,
+          'time': 5,
+          'cost': 0.0,
+          'path': path,
+        };
+
+    final index = <String, dynamic>{
+      'format': 'shards',
+      'legs': [
+        leg('bus', 'shards/leg-a.json'),
+        leg('train_main', 'shards/leg-b.json'),
+        leg('uber', 'shards/leg-c.json'),
+      ],
+      'segmentOptions': {
+        'firstMile': [0],
+        'mainLeg': 1,
+        'lastMile': [2],
+      },
+      'directDrive': {'time': 60, 'cost': 10.0, 'distance': 20.0, 'co2': 5.0},
+      'mockPathShard': 'shards/mock-path.json',
+      'journeys': [
+        {
+          'id': 'bus-uber',
+          'leg1': 0,
+          'leg3': 2,
+          'cost': 2.0,
+          'time': 20,
+          'buffer': 10,
+          'risk': 0,
+          'emissions': {'val': 1.0, 'percent': 10, 'text': null},
+        },
+      ],
+    };
+
+    final files = {
+      'shards/leg-a.json': {
+        'segments': [
+          segment('bus', [
+            [53.8, -1.5],
+            [53.9, -1.4],
+          ]),
+        ],
+      },
+      'shards/leg-b.json': {
+        'segments': [
+          segment('train', [
+            [54.0, -1.3],
+          ]),
+        ],
+      },
+      'shards/leg-c.json': {
+        'segments': [segment('car', [])],
+      },
+      'shards/mock-path.json': {
+        'mockPath': [
+          [53.8, -1.5],
+        ],
+      },
+    };
+
+    late List<String> loaded;
+
+    RouteShards shards() {
+      loaded = [];
+      return RouteShards(index, (path) async {
+        loaded.add(path);
+        return jsonEncode(files[path]);
+      });
+    }
+
+    test('recognises sharded assets', () {
+      expect(RouteShards.isSharded(index), isTrue);
+      expect(RouteShards.isSharded({'format': 'refs'}), isFalse);
+    });
+
+    test('summary reads only the index', () {
+      final initData = InitData.fromJson(shards().summary());
+
+      expect(loaded, isEmpty);
+      expect(initData.segmentOptions.firstMile.single.id, 'bus');
+      expect(initData.segmentOptions.firstMile.single.segments, isEmpty);
+      expect(initData.journeys.single.leg3.id, 'uber');
+      expect(initData.mockPath, isEmpty);
+    });
+
+    test('loads each leg shard once', () async {
+      final reader = shards();
+
+      final segments = await reader.segmentsForOption('mainLeg');
+      await reader.segments(1);
+      expect(segments!.single['mode'], 'train');
+      expect(loaded, ['shards/leg-b.json']);
+      expect(await reader.segmentsForOption('lastMile', 1), isNull);
+      expect(await reader.segmentsForOption('elsewhere'), isNull);
+    });
+
+    test('finds options by position when leg ids repeat', () async {
+      // Like route1, where first and last mile both have a 'bus' leg
+      final repeated = <String, dynamic>{
+        ...index,
+        'legs': [...index['legs'] as List, leg('bus', 'shards/leg-c.json')],
+        'segmentOptions': {
+          'firstMile': [0],
+          'mainLeg': 1,
+          'lastMile': [3],
+        },
+      };
+      final reader = RouteShards(
+          repeated, (path) async => jsonEncode(files[path]));
+
+      expect((await reader.segmentsForOption('firstMile', 0))!.single['mode'],
+          'bus');
+      expect((await reader.segmentsForOption('lastMile', 0))!.single['mode'],
+          'car');
+    });
+
+    test('resolve expands to the inline layout', () async {
+      final initData = InitData.fromJson(await shards().resolve());
+
+      expect(loaded.length, 4);
+      final bus = initData.segmentOptions.firstMile.single;
+      expect(bus.segments.single.path!.length, 2);
+      expect(bus.segments.single.path!.last.latitude, closeTo(53.9, 0.00001));
+      expect(initData.segmentOptions.mainLeg.segments.single.mode, 'train');
+      expect(initData.journeys.single.leg1.segments.single.mode, 'bus');
+      expect(initData.mockPath.length, 1);
+    });
+  });
+}
@@ -0,0 +1,61 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import process_routes as pr
+from route_output import load_output, shard_dir_for
+
+FIXTURE = os.path.join(os.path.dirname(pr.RULES_PATH), 'test', 'fixtures', 'routes_2_small.json')
+
+
+def shard_names(index_path):
+    with open(index_path) as f:
+        index = json.load(f)
+    names = [leg['shard'] for leg in index['legs']] + [index['mockPathShard']]
+    return {os.path.basename(name) for name in names}
+
+
+def stamps(shard_dir):
+    return {name: os.stat(os.path.join(shard_dir, name)).st_mtime_ns for name in os.listdir(shard_dir)}
+
+
+@pytest.fixture
+def built(tmp_path):
+    input_path = str(tmp_path / 'routes.json')
+    output_path = str(tmp_path / 'routes_clean.json')
+    shutil.copy(FIXTURE, input_path)
+    pr.process_file(input_path, output_path, 'route2', output_format='shards')
+    return input_path, output_path
+
+
+def test_shards_read_back_as_the_inline_output(built, tmp_path):
+    input_path, output_path = built
+    inline_path = str(tmp_path / 'inline.json')
+    pr.process_file(input_path, inline_path, 'route2')
+    with open(inline_path) as f:
+        assert load_output(output_path) == json.load(f)
+
+
+def test_rebuild_removes_stale_shards_only(built):
+    input_path, output_path = built
+    shard_dir = shard_dir_for(output_path)
+    before = stamps(shard_dir)
+    with open(os.path.join(shard_dir, 'leg-0000000000000000.json'), 'w') as f:
+        f.write('{}')
+
+    with open(input_path) as f:
+        data = json.load(f)
+    data['groups'][1]['options'][0]['legs'][0]['duration_value'] += 600
+    with open(input_path, 'w') as f:
+        json.dump(data, f)
+    pr.process_file(input_path, output_path, 'route2', output_format='shards')
+
+    after = stamps(shard_dir)
+    assert set(after) == shard_names(output_path)
+    removed = set(before) - set(after)
+    assert len(removed) == 1 and removed.pop().startswith('leg-')
+    # Unchanged legs keep their shard files, untouched
+    assert {name: before[name] for name in set(before) & set(after)} == \
+        {name: after[name] for name in set(before) & set(after)}
@@ -0,0 +1,119 @@
+import math
+import random
+
+import pytest
+
+import bench_routes
+import process_routes as pr
+from route_polyline import decode_path_batch
+from route_spatial import Projection, SpatialIndex
+
+# Query latency is tracked by the spatial_query_x100 stage of bench_routes.py;
+# these tests check the grid answers exactly what a scan of everything would.
+
+
+@pytest.fixture(scope='module')
+def bench():
+    # The routes of the spatial_query_x100 stage of bench_routes.py at 20 options
+    groups = bench_routes.generate_routes(options=20, rail_legs=4, points=50)['groups']
+    polylines = pr.collect_polylines(groups)
+    paths = decode_path_batch(polylines)
+    legs = [pr.parse_option_to_leg(option, name, 'route1', paths) for name, option in pr.leg_options(groups)]
+    return SpatialIndex.build(legs), legs
+
+
+@pytest.fixture(scope='module')
+def points(bench):
+    # Points on, near and well away from the paths
+    _, legs = bench
+    on_path = [pt for leg in legs for seg in leg['segments'] for pt in (seg.get('path') or [])]
+    rng = random.Random(0)
+    return [(lat + rng.uniform(-spread, spread), lng + rng.uniform(-spread, spread))
+            for spread in [0.0, 0.002, 0.02, 0.2]
+            for lat, lng in rng.sample(on_path, 25)]
+
+
+@pytest.fixture(scope='module')
+def boxes(points):
+    # Boxes from well inside one cell to wider than the whole grid
+    rng = random.Random(1)
+    return [(lat - size, lng - size, lat + rng.uniform(0, 2) * size, lng + rng.uniform(0, 2) * size)
+            for size in [0.0005, 0.005, 0.03, 1.0]
+            for lat, lng in rng.sample(points, 15)]
+
+
+def scan_legs_near(legs, lat, lng, radius):
+    projection = Projection(lat)
+    nearest = {}
+    for leg_index, leg in enumerate(legs):
+        for seg in leg['segments']:
+            coords = [c for pt in (seg.get('path') or []) for c in pt]
+            if coords:
+                distance = projection.polyline_distance(lat, lng, coords)
+                if distance <= radius and distance < nearest.get(leg_index, math.inf):
+                    nearest[leg_index] = distance
+    return sorted((d, leg) for leg, d in nearest.items())
+
+
+def scan_stops(index, lat, lng):
+    projection = Projection(lat)
+    return sorted((projection.point_distance(lat, lng, stop[1], stop[2]), i) for i, stop in enumerate(index.stops))
+
+
+def test_legs_near_matches_a_scan_of_every_leg(bench, points):
+    index, legs = bench
+    for lat, lng in points:
+        for radius in [50, 500]:
+            found = index.legs_near(lat, lng, radius)
+            expected = scan_legs_near(legs, lat, lng, radius)
+            assert [leg for _, leg in found] == [leg for _, leg in expected]
+            assert [d for d, _ in found] == pytest.approx([d for d, _ in expected])
+
+
+def test_nearest_stops_matches_a_scan_of_every_stop(bench, points):
+    index, _ = bench
+    for lat, lng in points:
+        expected = scan_stops(index, lat, lng)
+        assert index.nearest_stops(lat, lng, k=3) == [(d, index.stop(i)) for d, i in expected[:3]]
+        within = [(d, index.stop(i)) for d, i in expected[:3] if d <= 1000]
+        assert index.nearest_stops(lat, lng, k=3, max_distance=1000) == within
+
+
+def test_stops_in_bbox_matches_a_scan_of_every_stop(bench, boxes):
+    index, _ = bench
+    for min_lat, min_lng, max_lat, max_lng in boxes:
+        expected = [index.stop(i) for i, (_, lat, lng, _) in enumerate(index.stops)
+                    if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng]
+        found = index.stops_in_bbox(min_lat, min_lng, max_lat, max_lng)
+        assert sorted(found, key=lambda s: (s['lat'], s['lng'])) == sorted(expected, key=lambda s: (s['lat'], s['lng']))
+
+
+def test_segments_in_bbox_matches_a_scan_of_every_chunk(bench, boxes):
+    index, legs = bench
+    for min_lat, min_lng, max_lat, max_lng in boxes:
+        found = index.segments_in_bbox(min_lat, min_lng, max_lat, max_lng)
+        assert len(found) == len(set(found))
+        expected = {(entry[0], entry[1]) for entry in index.segments
+                    if entry[4] <= max_lat and entry[6] >= min_lat and entry[5] <= max_lng and entry[7] >= min_lng}
+        assert set(found) == expected
+        # Every segment with a point inside the box is among them
+        inside = {(leg_index, seg_index)
+                  for leg_index, leg in enumerate(legs) for seg_index, seg in enumerate(leg['segments'])
+                  if any(min_lat <= lat <= max_lat and min_lng <= lng <= max_lng for lat, lng in seg.get('path') or [])}
+        assert inside <= expected
+
+
+def test_polyline_distance_limit():
+    projection = Projection(53.8)
+    coords = [53.8, -1.55, 53.8, -1.54]
+    distance = projection.polyline_distance(53.801, -1.545, coords)
+    assert distance == pytest.approx(111.2, abs=0.1)
+    assert projection.polyline_distance(53.801, -1.545, coords, limit=200) == distance
+    assert projection.polyline_distance(53.801, -1.545, coords, limit=100) == math.inf
+
+
+def test_query_bbox_returns_each_item_once(bench):
+    index, _ = bench
+    grid = index.segment_grid
+    items = grid.query_bbox(-90, -180, 90, 180)
+    assert sorted(items) == list(range(len(index.segments)))
@@ -0,0 +1,90 @@
+import io
+import json
+import os
+
+import pytest
+
+import process_routes as pr
+from route_stream import ROUTES_SPEC, StreamArray, StreamObject, iter_route_options, read_json_stream, write_json_stream
+
+CLIENT_DIR = os.path.dirname(pr.RULES_PATH)
+ROUTE_FILES = [os.path.join(CLIENT_DIR, 'assets', name) for name in ['routes.json', 'routes_2.json']]
+
+# Numbers, escapes and \uXXXX sequences (a surrogate pair too) that small
+# chunks split part way through
+TRICKY = ('{"groups": [{"name": "Caf\\u00e9 \\"A\\" \\\\ \\/ \\ud83d\\ude86\\n", "options": '
+          '[12345678901234567890, -2.5e-3, 0.125, "\\u00e9\\t", {"k": [true, false, null, -0]}, [], {}]}, '
+          '{"options": []}, {"name": "", "options": [1E+2]}], '
+          '"nums": [1, 22, 333, -4444.5, 6e10], "tail": "\\u2603"}')
+TRICKY_SPEC = {'groups': [{'options': [None]}], 'nums': [None]}
+
+CHUNK_SIZES = [1, 2, 7]
+
+
+def materialize(value):
+    if isinstance(value, StreamObject):
+        return {key: materialize(item) for key, item in value.items()}
+    if isinstance(value, StreamArray):
+        return [materialize(item) for item in value]
+    return value
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('path', ROUTE_FILES)
+def test_route_files_read_back_as_json_load(path, chunk_size):
+    with open(path) as f:
+        expected = json.load(f)
+    with open(path) as f:
+        assert materialize(read_json_stream(f, chunk_size=chunk_size)) == expected
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_route_options_in_file_order(chunk_size):
+    path = ROUTE_FILES[1]
+    with open(path) as f:
+        data = json.load(f)
+    expected = [(group.get('name', ''), index, option)
+                for group in data['groups'] for index, option in enumerate(group.get('options', []))]
+    with open(path) as f:
+        assert list(iter_route_options(f, chunk_size)) == expected
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES + [len(TRICKY)])
+@pytest.mark.parametrize('spec', [TRICKY_SPEC, ROUTES_SPEC, None])
+def test_values_split_across_chunks(chunk_size, spec):
+    value = read_json_stream(io.StringIO(TRICKY), spec, chunk_size)
+    assert materialize(value) == json.loads(TRICKY)
+
+
+def test_skipped_views_are_drained():
+    doc = read_json_stream(io.StringIO(TRICKY), TRICKY_SPEC, chunk_size=2)
+    assert [key for key, _ in doc.items()] == ['groups', 'nums', 'tail']
+
+
+@pytest.mark.parametrize('path', ROUTE_FILES)
+def test_write_matches_json_dump(path):
+    with open(path) as f:
+        data = json.load(f)
+    expected = json.dumps(data, indent=2)
+    out = io.StringIO()
+    write_json_stream(out, data)
+    assert out.getvalue() == expected
+
+    # Straight from a streaming read, and from generators
+    out = io.StringIO()
+    with open(path) as f:
+        write_json_stream(out, read_json_stream(f, chunk_size=7))
+    assert out.getvalue() == expected
+    out = io.StringIO()
+    write_json_stream(out, {'groups': (group for group in data['groups'])})
+    assert out.getvalue() == json.dumps({'groups': data['groups']}, indent=2)
+
+
+def test_write_matches_json_dump_on_escapes_and_empty_containers():
+    data = json.loads(TRICKY)
+    out = io.StringIO()
+    write_json_stream(out, data)
+    assert out.getvalue() == json.dumps(data, indent=2)
+    out = io.StringIO()
+    write_json_stream(out, data, compact=True)
+    assert out.getvalue() == json.dumps(data, separators=(',', ':'))
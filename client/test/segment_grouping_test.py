@@ -0,0 +1,211 @@
+import json
+import os
+import random
+
+import pytest
+
+from process_routes import (ICON_IDS, RULES_PATH, PackedPath, Segment, group_segments, parse_segment,
+                            to_json)
+
+ROUTES_JSON = os.path.join(os.path.dirname(RULES_PATH), 'assets', 'routes.json')
+
+
+# Frozen copy of the original look-ahead grouping that group_segments
+# replaced. Do not change it along with group_segments: it is the
+# reference the single-pass version has to keep matching.
+def group_segments_reference(segments, leg_context):
+    # Helper to check if a segment is just a walk/transfer
+    def is_transfer(s):
+        return s['mode'] == 'walk' or s['iconId'] == ICON_IDS['footprints']
+
+    grouped = []
+    i = 0
+    while i < len(segments):
+        seg = segments[i]
+
+        # --- Train Merge Logic ---
+        if seg['iconId'] == ICON_IDS['train']:
+            # Look ahead for next train
+            look_ahead_idx = i + 1
+            accumulated_wait = 0
+            next_train_seg = None
+
+            temp_idx = look_ahead_idx
+            if temp_idx < len(segments):
+                check_seg = segments[temp_idx]
+                if is_transfer(check_seg):
+                    accumulated_wait += check_seg['time']
+                    temp_idx += 1
+                    if temp_idx < len(segments):
+                        check_seg = segments[temp_idx]
+                    else:
+                        check_seg = None
+
+                if check_seg and check_seg['iconId'] == ICON_IDS['train']:
+                    next_train_seg = check_seg
+                    look_ahead_idx = temp_idx
+
+            if next_train_seg:
+                # Merge Found
+                # Create Group Segment
+                wait_time = next_train_seg.get('waitTime', 0) + accumulated_wait
+
+                group_seg = Segment({
+                    'mode': 'train_group', # Special mode for frontend check
+                    'label': seg['label'], # Use first train label or composite? Frontend logic uses internal.
+                    'lineColor': seg['lineColor'],
+                    'iconId': seg['iconId'],
+                    'time': seg['time'] + next_train_seg['time'], # Exclude wait_time, added separately by frontend
+                    'cost': seg['cost'] + next_train_seg['cost'],
+                    'distance': (seg.get('distance') or 0) + (next_train_seg.get('distance') or 0),
+                    'co2': (seg.get('co2') or 0) + (next_train_seg.get('co2') or 0),
+                    'subSegments': [seg, next_train_seg],
+                    'waitTime': wait_time, # Store calc wait time here
+                    'detail': f"Change at {seg.get('to', 'Station')}", # Helpful detail
+                    # Inherit other props from first segment
+                    'path': PackedPath.concat([seg.get('path'), next_train_seg.get('path')])
+                })
+
+                grouped.append(group_seg)
+                i = look_ahead_idx + 1 # Skip consumed segments
+                continue
+
+        # --- Access Merge Logic ---
+        # Group [Walk/Wait, ..., Ride]
+        def is_walk_or_wait(s):
+            if s['mode'] == 'wait' and s.get('label') != 'Transfer': return True
+            if s['mode'] == 'walk' or s['iconId'] == ICON_IDS['footprints']: return True
+            return False
+
+        def is_ride(s):
+            if is_walk_or_wait(s): return False
+            if s['mode'] == 'wait' and s.get('label') == 'Transfer': return False
+            return True
+
+        if is_walk_or_wait(seg):
+            # Start of potential group
+            k = i + 1
+            while k < len(segments) and is_walk_or_wait(segments[k]):
+                k += 1
+
+            if k < len(segments):
+                next_seg = segments[k]
+                if is_ride(next_seg):
+                    # Check for Train Merge Conflict
+                    # If ride is Train, check if it would trigger a Train Merge (Train -> Train)
+                    # If so, do NOT access merge.
+                    prevent_merge = False
+                    if next_seg['iconId'] == ICON_IDS['train']:
+                        # Quick look ahead from k
+                        t_idx = k + 1
+                        if t_idx < len(segments):
+                            c_seg = segments[t_idx]
+                            if is_transfer(c_seg):
+                                t_idx += 1
+                                if t_idx < len(segments):
+                                    c_seg = segments[t_idx]
+                                else:
+                                    c_seg = None
+
+                            if c_seg and c_seg['iconId'] == ICON_IDS['train']:
+                                prevent_merge = True
+
+                    if not prevent_merge:
+                        # Proceed with Access Merge
+                        # Scan for trailing walks
+                        end_idx = k + 1
+                        while end_idx < len(segments) and is_walk_or_wait(segments[end_idx]):
+                            end_idx += 1
+
+                        group_list = segments[i:end_idx]
+
+                        total_time = sum([s['time'] + s.get('waitTime', 0) for s in group_list])
+                        total_cost = sum([s['cost'] for s in group_list])
+                        total_dist = sum([s.get('distance', 0) for s in group_list])
+                        total_co2 = sum([s.get('co2', 0) for s in group_list])
+
+                        # Main Segment is the Ride (next_seg)
+                        main_seg = next_seg
+
+                        group_seg = Segment({
+                            'mode': 'access_group',
+                            'label': main_seg['label'],
+                            'lineColor': main_seg['lineColor'],
+                            'iconId': main_seg['iconId'],
+                            'time': total_time,
+                            'cost': total_cost,
+                            'distance': total_dist,
+                            'co2': total_co2,
+                            'subSegments': group_list,
+                            # Path is tricky - maybe concat all?
+                            'path': PackedPath.concat([s.get('path') for s in group_list])
+                        })
+
+                        # Pass through details from main segment
+                        if 'detail' in main_seg: group_seg['detail'] = main_seg['detail']
+
+                        grouped.append(group_seg)
+                        i = end_idx
+                        continue
+
+        # Default: Add single segment
+        grouped.append(seg)
+        i += 1
+
+    return grouped
+
+
+def random_segments(rng, length):
+    # Random itineraries over the segment kinds group_segments distinguishes
+    kinds = [
+        ('train', 'train', 'Train'), ('walk', 'footprints', 'Walk'), ('wait', 'clock', 'Wait'),
+        ('wait', 'clock', 'Transfer'), ('bus', 'bus', 'Bus'), ('car', 'car', 'Drive'),
+        ('bike', 'bike', 'Cycle'), ('walk', 'train', 'Walk'), ('train', 'footprints', 'Train'),
+    ]
+    segments = []
+    for i in range(length):
+        mode, icon_id, label = rng.choice(kinds)
+        seg = Segment({
+            'mode': mode,
+            'label': f'{label} {i}' if label != 'Transfer' else label,
+            'lineColor': '#000000',
+            'iconId': icon_id,
+            'time': rng.randint(0, 30),
+            'path': PackedPath.from_pairs([[i, j] for j in range(rng.randint(0, 3))]),
+            'distance': rng.random() * 10,
+            'co2': rng.random(),
+            'from': f'Stop {i}',
+            'to': f'Stop {i + 1}',
+            'cost': rng.choice([0.0, 2.5])
+        })
+        if rng.random() < 0.3:
+            seg['waitTime'] = rng.randint(1, 10)
+        if rng.random() < 0.3:
+            seg['detail'] = f'Detail {i}'
+        segments.append(seg)
+    return segments
+
+
+def as_json(segments):
+    return json.loads(json.dumps(segments, default=to_json))
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_group_segments_matches_reference_on_random_itineraries(seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        segments = random_segments(rng, rng.randint(0, 24))
+        assert as_json(group_segments(segments, {})) == as_json(group_segments_reference(segments, {}))
+
+
+def test_group_segments_matches_reference_on_route_options():
+    with open(ROUTES_JSON) as f:
+        groups = json.load(f)['groups']
+    checked = 0
+    for group in groups:
+        for option in group['options']:
+            name = option.get('name', 'Unknown')
+            segments = [parse_segment(leg, name, 'route1') for leg in option.get('legs', [])]
+            assert as_json(group_segments(segments, {})) == as_json(group_segments_reference(segments, {}))
+            checked += 1
+    assert checked > 0
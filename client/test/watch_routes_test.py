@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import process_routes as pr
+
+ROUTES_JSON = os.path.join(os.path.dirname(pr.RULES_PATH), 'assets', 'routes.json')
+
+
+def drive(monkeypatch, steps):
+    # Runs each step in place of a poll interval, then stops the watcher
+    steps = iter(steps)
+
+    def sleep(interval):
+        step = next(steps, None)
+        if step is None:
+            raise KeyboardInterrupt
+        step()
+
+    monkeypatch.setattr(pr.time, 'sleep', sleep)
+
+
+@pytest.fixture
+def watched(tmp_path, monkeypatch):
+    input_path = str(tmp_path / 'routes.json')
+    output_path = str(tmp_path / 'routes_clean.json')
+    rules_path = str(tmp_path / 'route_rules.json')
+    shutil.copy(ROUTES_JSON, input_path)
+    shutil.copy(pr.RULES_PATH, rules_path)
+    monkeypatch.setattr(pr, 'RULES_PATH', rules_path)
+    load_rules = pr.load_rules
+    monkeypatch.setattr(pr, 'load_rules', lambda: load_rules(rules_path))
+    # Rebuilds replace these, keep the module's own for the other tests
+    monkeypatch.setattr(pr, 'RULES', pr.RULES)
+    monkeypatch.setattr(pr, 'PRICING', pr.PRICING)
+    monkeypatch.setattr(pr, 'RULES_VERSION', pr.RULES_VERSION)
+    return input_path, output_path, rules_path
+
+
+def edit_json(path, edit):
+    def step():
+        with open(path) as f:
+            data = json.load(f)
+        edit(data)
+        with open(path, 'w') as f:
+            json.dump(data, f)
+    return step
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def null_legs(data):
+    data['groups'][0]['options'][0]['legs'] = None
+
+
+def drop_pricing(data):
+    del data['pricing']
+
+
+def test_bad_input_and_rules_keep_previous_output(watched, monkeypatch, capsys):
+    input_path, output_path, rules_path = watched
+    rules = pr.RULES
+    output = []
+    drive(monkeypatch, [
+        lambda: output.append(read_bytes(output_path)),
+        edit_json(input_path, null_legs), lambda: None,
+        edit_json(rules_path, drop_pricing), lambda: None,
+    ])
+    pr.watch_routes([(input_path, output_path, 'route1')], interval=0)
+
+    out = capsys.readouterr().out
+    assert f'{input_path}: build failed, keeping previous output (TypeError' in out
+    assert f'{rules_path}: not reloaded, keeping previous rules (KeyError' in out
+    assert pr.RULES is rules
+    assert read_bytes(output_path) == output[0]
+
+
+def test_fixed_input_is_rebuilt_after_a_failed_rules_reload(watched, monkeypatch, capsys):
+    input_path, output_path, rules_path = watched
+    drive(monkeypatch, [
+        edit_json(input_path, null_legs), lambda: None,
+        # A bad rules file and the fixed input are picked up in the same poll
+        lambda: (edit_json(rules_path, drop_pricing)(), shutil.copy(ROUTES_JSON, input_path)), lambda: None,
+    ])
+    pr.watch_routes([(input_path, output_path, 'route1')], interval=0)
+
+    out = capsys.readouterr().out.splitlines()
+    assert 'not reloaded' in out[-2]
+    assert out[-1].endswith(f'-> {output_path}')